@@ -32,6 +32,12 @@ def init(config):
     backend.init()
 
 
+def reindex(config):
+
+    backend = v1.celldb_backends[args.backend](args.backend_dsn, config=args)
+    backend.reindex()
+
+
 def _different_backends_selected(config):
 
     if (config.src_backend != config.dest_backend) or (config.src_dsn != config.dest_dsn):
@@ -123,6 +129,16 @@ if __name__ == '__main__':
     for codeword in filter(lambda codeword: codeword in v1.config_groups.keys(), included_plugins):
         v1.config_groups[codeword](parser_init)
 
+    parser_reindex = subparsers.add_parser('reindex', help='Rebuild celldb indexes')
+    parser_reindex.set_defaults(cmd=reindex)
+    add_backend_selection_args(parser_reindex)
+
+    # Then add argument configuration argument groups dependent on the loaded plugins, include only:
+    # - celldb backend plugins
+    included_plugins = v1.celldb_backends.keys()
+    for codeword in filter(lambda codeword: codeword in v1.config_groups.keys(), included_plugins):
+        v1.config_groups[codeword](parser_reindex)
+
     parser_etl = subparsers.add_parser('etl', help='Migrate cells between databases')
     parser_etl.set_defaults(cmd=etl)
 
@@ -0,0 +1,431 @@
+#!/usr/bin/env python3
+
+# Python 3.9 is needed to load additional plugins as the code uses
+# https://docs.python.org/3/library/pkgutil.html#pkgutil.resolve_name
+
+# Allow module load from lib/python in main repo
+import sys
+from pathlib import Path
+
+currentdir = Path(__file__).resolve(strict=True).parent
+libdir = currentdir.parent.joinpath('lib/python')
+sys.path.append(str(libdir))
+
+import argparse
+import contextlib
+import logging
+import os
+import structlog
+import random
+import statistics
+import subprocess
+import tempfile
+import time
+import tabulate
+
+from secondlife.infoset import Infoset, compile_path
+from secondlife.celldb import bind_state_vars
+from secondlife.packing import Layout
+from secondlife.cli.utils import generate_id, add_plugin_args, MatchQuery
+from secondlife.plugins.api import v1, load_plugins
+
+# Reference: https://stackoverflow.com/a/49724281
+LOG_LEVEL_NAMES = [logging.getLevelName(v) for v in
+                   sorted(getattr(logging, '_levelToName', None) or logging._levelNames) if getattr(v, "real", 0)]
+
+log = structlog.get_logger()
+
+
+def _populate(backend, ids, config):
+    # Spread cells over a few containers so that the database is not flat
+    for id in ids:
+        infoset = backend.create(id=id, path=random.choice(config.containers))
+        infoset.put('.props.brand', 'BENCH')
+        infoset.fetch('.log').append(dict(type='measurement', event='finished', ts=time.time(),
+            equipment=dict(brand='BENCH', model='BENCH'),
+            results=dict(capacity=dict(v=random.gauss(2500, 200), u='mAh'), IR=dict(v=random.gauss(50, 5), u='mOhm'))))
+        backend.put(infoset)
+
+
+def bench_fetch(config):
+    rows = []
+
+    with tempfile.TemporaryDirectory() as tempdir:
+        backend = v1.celldb_backends['json-files'](dsn=tempdir, config=config)
+        backend.init()
+
+        config.containers = [ '/' ]
+        for i in range(4):
+            container = backend.create(id=generate_id('BOX'), path='/')
+            backend.put(container)
+            config.containers.append(f"/{container.fetch('.id')}/")
+
+        ids = []
+        for size in sorted(config.sizes):
+            new_ids = [ generate_id('BENCH') for i in range(size - len(ids)) ]
+            log.info('populating celldb', size=size, new_cells=len(new_ids))
+            _populate(backend, new_ids, config)
+            ids.extend(new_ids)
+
+            # Use a fresh backend instance so that the index is loaded from disk as in a new CLI invocation
+            backend = v1.celldb_backends['json-files'](dsn=tempdir, config=config)
+
+            t = time.perf_counter()
+            backend.fetch(random.choice(ids))
+            first_fetch = time.perf_counter() - t
+
+            sample = random.choices(ids, k=config.fetches)
+            t = time.perf_counter()
+            for id in sample:
+                backend.fetch(id)
+            per_fetch = (time.perf_counter() - t) / len(sample)
+
+            rows.append( (size, f'{first_fetch * 1000:.3f}', f'{per_fetch * 1000:.3f}') )
+            log.info('fetch latency', size=size, first_fetch=first_fetch, per_fetch=per_fetch)
+
+    print( tabulate.tabulate(rows, headers=['Cells', 'First fetch [ms]', 'Per fetch [ms]'], tablefmt='fancy_grid') )
+
+
+def _rc_measurement():
+    # Same shape as the result of 'log.py -M rc'
+    return dict(type='measurement', event='finished', ts=time.time(), equipment=dict(model='RC3563'), results={
+        'IR': dict(range='AUTO', v=random.gauss(50, 5), u='mOhm'),
+        'OCV': dict(range='AUTO', u='V', v=random.gauss(3.7, 0.1))
+    })
+
+
+def bench_put(config):
+    rows = []
+
+    with tempfile.TemporaryDirectory() as tempdir:
+        dsn = f'sqlite:///{tempdir}/celldb.sqlite'
+        backend = v1.celldb_backends['sql-alchemy'](dsn=dsn, config=config)
+        backend.init()
+
+        infoset = backend.create(id='BENCH~1', path='/')
+        for i in range(config.history):
+            infoset.fetch('.log').append(_rc_measurement())
+        backend.put(infoset)
+
+        # Measure the fetch -> measure -> put cycle performed by log.py for each cell
+        t = time.perf_counter()
+        for i in range(config.iterations):
+            infoset = backend.fetch('BENCH~1')
+            infoset.fetch('.log').append(_rc_measurement())
+            backend.put(infoset)
+        incremental = config.iterations / (time.perf_counter() - t)
+
+        # The same cycle storing a copy of the infoset which the backend does not know about, all of it is written
+        t = time.perf_counter()
+        for i in range(config.iterations):
+            infoset = backend.fetch('BENCH~1')
+            infoset.fetch('.log').append(_rc_measurement())
+            backend.put( Infoset(data=dict(infoset.data)) )
+        full = config.iterations / (time.perf_counter() - t)
+
+        rows.append( ('incremental', config.history, f'{incremental:.1f}') )
+        rows.append( ('full', config.history, f'{full:.1f}') )
+
+    print( tabulate.tabulate(rows, headers=['put()', 'Log entries', 'Cells/s'], tablefmt='fancy_grid') )
+
+
+def _synthetic_cell(id):
+    # A cell with a capacity and IR measurement and bound state variables, like the ones loaded by the backends
+    infoset = Infoset()
+    infoset.put('.id', id)
+    infoset.put('.path', '/')
+    infoset.put('.props', dict(brand='BENCH', model='BENCH'))
+    infoset.put('.log', [ dict(type='measurement', event='finished', ts=time.time(),
+        equipment=dict(brand='BENCH', model='BENCH'),
+        results=dict(capacity=dict(v=random.gauss(2500, 200), u='mAh'), IR=dict(v=random.gauss(50, 5), u='mOhm'))) ])
+    infoset.put('.extra', [])
+
+    bind_state_vars(infoset)
+    return infoset
+
+
+def _rate(f, n):
+    t = time.perf_counter()
+    for i in range(n):
+        f()
+    return n / (time.perf_counter() - t)
+
+
+def bench_infoset(config):
+    import pack
+
+    rows = []
+    cell = _synthetic_cell(generate_id('BENCH'))
+
+    compiled = compile_path('.props.brand')
+    rows.append( ('fetch(str)', f"{_rate(lambda: cell.fetch('.props.brand'), config.iterations * 100):.0f}") )
+    rows.append( ('fetch(compiled)', f"{_rate(lambda: cell.fetch(compiled), config.iterations * 100):.0f}") )
+    rows.append( ('fetch(state var)', f"{_rate(lambda: cell.fetch('.state.usable_capacity'), config.iterations * 10):.0f}") )
+
+    # The pack.py optimizer loop: shuffle the pool, rebuild the string and compare it with the current one
+    pool = [ _synthetic_cell(generate_id('BENCH')) for i in range(config.S * config.P) ]
+    config.report = None
+    string = pack.build_string(pool, config.S, config.P, config)
+
+    def optimizer_iteration():
+        (i1, i2) = random.sample(range(len(pool)), 2)
+        pool[i1], pool[i2] = pool[i2], pool[i1]
+        pack.improved(string, pack.build_string(pool, config.S, config.P, config))
+
+    rows.append( (f'pack.py optimizer, String objects ({config.S}S{config.P}P)', f'{_rate(optimizer_iteration, config.iterations):.1f}') )
+
+    # The same loop on the array layout used by pack.py
+    layout = Layout([ cell.fetch('.state.usable_capacity')['v'] for cell in pool ],
+                    [ cell.fetch('.state.internal_resistance')['v'] for cell in pool ], config.S, config.P)
+    score = layout.score()
+
+    def layout_iteration():
+        (i1, i2) = random.sample(range(len(pool)), 2)
+        layout.swap(i1, i2)
+        if not pack.improved(score, layout.score()):
+            layout.swap(i1, i2)
+
+    rows.append( (f'pack.py optimizer, array layout ({config.S}S{config.P}P)', f'{_rate(layout_iteration, config.iterations * 1000):.1f}') )
+
+    print( tabulate.tabulate(rows, headers=['Operation', 'Per second'], tablefmt='fancy_grid') )
+
+
+def bench_match(config):
+    rows = []
+
+    log.info('creating cells', cells=config.cells)
+    cells = []
+    for i in range(config.cells):
+        cell = _synthetic_cell(generate_id('BENCH'))
+        cell.put('.path', random.choice([ '/', '/STOCK/', '/BOX~1/' ]))
+        cell.put('.props.tags', dict(likely_fake=random.random() < 0.1))
+        cells.append(cell)
+
+    for query in config.queries:
+        match = MatchQuery(query)
+
+        # The path used before the native evaluation: serialize each cell and pass it to jq
+        t = time.perf_counter()
+        jq_matches = sum([ match.jq_program.input(text=cell.to_json()).first() is True for cell in cells ])
+        jq_rate = len(cells) / (time.perf_counter() - t)
+
+        t = time.perf_counter()
+        native_matches = sum([ match.first(cell) is True for cell in cells ])
+        native_rate = len(cells) / (time.perf_counter() - t)
+
+        if jq_matches != native_matches:
+            log.error('match results differ', query=query, jq_matches=jq_matches, native_matches=native_matches)
+
+        rows.append( (query, match.expr is not None, native_matches, f'{jq_rate:.0f}', f'{native_rate:.0f}') )
+
+    print( tabulate.tabulate(rows, headers=['Query', 'Native', 'Matches', 'jq [cells/s]', '--match [cells/s]'], tablefmt='fancy_grid') )
+
+
+def bench_stats(config):
+    from array import array
+    from secondlife.plugins.stats import StatsReport, METRICS
+
+    rows = []
+    config.stats_bins = 10
+    config.stats_percentiles = [ 5, 25, 50, 75, 95 ]
+
+    # Collecting the values, dominated by the state variable evaluation
+    cells = [ _synthetic_cell(generate_id('BENCH')) for i in range(config.cells) ]
+    report = StatsReport(config=config)
+    t = time.perf_counter()
+    for cell in cells:
+        report.process_cell(cell)
+    rows.append( ('process_cell()', config.cells, f'{config.cells / (time.perf_counter() - t):.0f} cells/s') )
+
+    # The vectorized pass over a large fleet, the collected arrays are filled directly
+    report = StatsReport(config=config)
+    for (name, path, unit) in METRICS:
+        report.values[name] = array('d', [ random.gauss(2500, 200) for i in range(config.fleet) ])
+    report.groups = { ('BENCH', f'MODEL{i}'): i for i in range(20) }
+    report.codes = array('l', [ random.randrange(20) for i in range(config.fleet) ])
+
+    t = time.perf_counter()
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        report.report()
+    rows.append( ('report()', config.fleet, f'{time.perf_counter() - t:.3f} s') )
+
+    print( tabulate.tabulate(rows, headers=['Operation', 'Cells', 'Speed'], tablefmt='fancy_grid') )
+
+
+def bench_strategies(config):
+    from secondlife.packing import Run, BranchAndBound, stop, cost, optimize
+
+    rows = []
+    config.optimizer_timeout = config.total_timeout = config.timeout
+
+    # Capacity and IR spreads similar to a pool of used cells
+    n = int(config.S * config.P * (1 + config.spare / 100))
+    capacity = [ random.gauss(2500, 150) for i in range(n) ]
+    ir = [ random.gauss(50, 8) for i in range(n) ]
+
+    for codeword in config.strategies:
+        layout = Layout(capacity, ir, config.S, config.P)
+        run = Run(config)
+        t = time.perf_counter()
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            optimize(v1.strategies[codeword], layout, config, run, jobs=config.jobs, seed=config.seed)
+        elapsed = time.perf_counter() - t
+
+        score = layout.score()
+        rows.append( (codeword, f'{score.blocks_capa_stdev_pct:.3f}', f'{score.max_block_ir_stdev_pct:.2f}', f'{cost(score):.3f}',
+                      run.iterations, f'{elapsed:.2f}', stop(score)) )
+
+    if config.exact:
+        # Nodes of the search tree are counted as iterations
+        layout = Layout(capacity, ir, config.S, config.P)
+        run = Run(config)
+        t = time.perf_counter()
+        (best, lower_bound) = BranchAndBound(layout, run).solve()
+        elapsed = time.perf_counter() - t
+
+        score = layout.score()
+        rows.append( (f'exact (gap {best - lower_bound:.3f})', f'{score.blocks_capa_stdev_pct:.3f}', f'{score.max_block_ir_stdev_pct:.2f}',
+                      f'{cost(score):.3f}', run.iterations, f'{elapsed:.2f}', stop(score)) )
+
+    print( tabulate.tabulate(rows, headers=['Strategy', 'Capa stdev between blocks [%]', 'Max IR stdev in block [%]', 'Cost',
+                                            'Iterations', 'Time [s]', 'Stop'], tablefmt='fancy_grid') )
+
+
+def bench_replace(config):
+    from secondlife.packing import KDTree
+
+    rows = []
+    pool = [ _synthetic_cell(generate_id('BENCH')) for i in range(config.pool) ]
+    cells = random.sample(pool, config.cells)
+
+    def distance(cell, other):
+        return (abs(cell.fetch('.state.usable_capacity')['v'] - other.fetch('.state.usable_capacity')['v']) +
+                1.5 * abs(cell.fetch('.state.internal_resistance')['v'] - other.fetch('.state.internal_resistance')['v']))
+
+    # The pool sorted by the distance for every replaced cell as pack.py replace did before the KD tree
+    t = time.perf_counter()
+    remaining = list(pool)
+    for cell in cells:
+        remaining.sort(key=lambda other: distance(cell, other))
+        remaining = remaining[1:]
+    rows.append( ('sort', f'{time.perf_counter() - t:.3f}') )
+
+    def features(cell):
+        return (cell.fetch('.state.usable_capacity')['v'], 1.5 * cell.fetch('.state.internal_resistance')['v'])
+
+    t = time.perf_counter()
+    tree = KDTree([ features(cell) for cell in pool ])
+    rows.append( ('KD tree build', f'{time.perf_counter() - t:.3f}') )
+
+    t = time.perf_counter()
+    for cell in cells:
+        (d, i) = tree.nearest(features(cell))[0]
+        tree.remove(i)
+    rows.append( ('KD tree queries', f'{time.perf_counter() - t:.3f}') )
+
+    print( tabulate.tabulate(rows, headers=[f'Replacing {config.cells} cells in a pool of {config.pool}', 'Time [s]'], tablefmt='fancy_grid') )
+
+
+def bench_startup(config):
+    rows = []
+
+    for entry_point in config.entry_points:
+        row = [ entry_point ]
+        # Import all plugin modules as before the manifest and declare them from the manifest
+        for manifest in ('0', '1'):
+            env = dict(os.environ, SECONDLIFE_PLUGIN_MANIFEST=manifest)
+            subprocess.run([ sys.executable, str(currentdir / entry_point), '--help' ], env=env, capture_output=True)  # Warm up
+
+            times = []
+            for i in range(config.runs):
+                t = time.perf_counter()
+                p = subprocess.run([ sys.executable, str(currentdir / entry_point), '--help' ], env=env, capture_output=True)
+                times.append(time.perf_counter() - t)
+
+            if p.returncode != 0:
+                log.error('entry point failed', entry_point=entry_point, stderr=p.stderr.decode().splitlines()[-1:])
+                row.append('failed')
+            else:
+                row.append( f'{statistics.median(times) * 1000:.0f}' )
+        rows.append(row)
+
+    print( tabulate.tabulate(rows, headers=['Entry point', 'All plugins imported [ms]', 'Plugin manifest [ms]'], tablefmt='fancy_grid') )
+
+
+if __name__ == "__main__":
+    structlog.configure(
+        wrapper_class=structlog.make_filtering_bound_logger(logging.INFO),
+        logger_factory=structlog.PrintLoggerFactory(file=sys.stderr)
+    )
+    load_plugins()
+
+    parser = argparse.ArgumentParser(description='Benchmarks for the celldb and the CLI tools')
+    parser.add_argument('--loglevel', choices=LOG_LEVEL_NAMES, default='INFO', help='Change log level')
+    add_plugin_args(parser)
+
+    subparsers = parser.add_subparsers(help='benchmarks')
+
+    fetch_parser = subparsers.add_parser('fetch', help='Measure json-files fetch() latency as the celldb grows')
+    fetch_parser.set_defaults(cmd=bench_fetch)
+    fetch_parser.add_argument('--sizes', metavar='N', type=int, nargs='+', default=[1000, 10000, 100000],
+        help='Celldb sizes to measure at')
+    fetch_parser.add_argument('--fetches', metavar='N', type=int, default=1000, help='Number of random fetches per size')
+
+    put_parser = subparsers.add_parser('put', help='Measure sql-alchemy measurement logging throughput on a cell with a long history')
+    put_parser.set_defaults(cmd=bench_put)
+    put_parser.add_argument('--history', metavar='N', type=int, default=300, help='Number of log entries in the cell')
+    put_parser.add_argument('--iterations', metavar='N', type=int, default=100, help='Number of measurements to log')
+
+    infoset_parser = subparsers.add_parser('infoset', help='Measure infoset access speed and the pack.py optimizer loop')
+    infoset_parser.set_defaults(cmd=bench_infoset)
+    infoset_parser.add_argument('--iterations', metavar='N', type=int, default=100, help='Number of optimizer iterations')
+    infoset_parser.add_argument('-S', dest='S', type=int, default=14, help='The amount of series-connected blocks in a string')
+    infoset_parser.add_argument('-P', dest='P', type=int, default=40, help='The amount of cells connected parallel in each block')
+
+    match_parser = subparsers.add_parser('match', help='Measure --match evaluation speed')
+    match_parser.set_defaults(cmd=bench_match)
+    match_parser.add_argument('--cells', metavar='N', type=int, default=50000, help='Number of cells to match')
+    match_parser.add_argument('queries', metavar='QUERY', nargs='*',
+        default=[ '.path == "/STOCK/"', '.props.tags.likely_fake != true', '.state.usable_capacity.v > 2000' ],
+        help='Queries to measure')
+
+    stats_parser = subparsers.add_parser('stats', help='Measure the stats report')
+    stats_parser.set_defaults(cmd=bench_stats)
+    stats_parser.add_argument('--cells', metavar='N', type=int, default=10000, help='Number of cells to process')
+    stats_parser.add_argument('--fleet', metavar='N', type=int, default=1000000, help='Number of cells in the report pass')
+
+    strategies_parser = subparsers.add_parser('strategies', help='Compare the pack.py optimization strategies on a synthetic pool')
+    strategies_parser.set_defaults(cmd=bench_strategies)
+    strategies_parser.add_argument('-S', dest='S', type=int, default=14, help='The amount of series-connected blocks in a string')
+    strategies_parser.add_argument('-P', dest='P', type=int, default=40, help='The amount of cells connected parallel in each block')
+    strategies_parser.add_argument('--spare', metavar='PCT', type=float, default=20, help='Cells in the pool above S * P, in percent')
+    strategies_parser.add_argument('--timeout', metavar='SEC', type=float, default=10, help='Time budget of each strategy')
+    strategies_parser.add_argument('-j', '--jobs', metavar='N', type=int, default=1, help='Number of parallel optimizer chains')
+    strategies_parser.add_argument('--share-interval', metavar='N', type=int, default=20000,
+        help='Iterations of each chain between restarts from the best layout')
+    strategies_parser.add_argument('--seed', type=int, help='Seed of the optimizer random number generator')
+    strategies_parser.add_argument('--exact', default=False, action='store_true', help='Include the branch and bound search')
+    strategies_parser.add_argument('strategies', metavar='STRATEGY', nargs='*', default=list(v1.strategies.keys()), help='Strategies to compare')
+    for codeword in filter(lambda codeword: codeword in v1.config_groups.keys(), v1.strategies.keys()):
+        v1.config_groups[codeword](strategies_parser)
+
+    replace_parser = subparsers.add_parser('replace', help='Measure the pack.py replace nearest cell search')
+    replace_parser.set_defaults(cmd=bench_replace)
+    replace_parser.add_argument('--pool', metavar='N', type=int, default=20000, help='Number of cells in the pool')
+    replace_parser.add_argument('--cells', metavar='N', type=int, default=20, help='Number of cells to replace')
+
+    startup_parser = subparsers.add_parser('startup', help='Measure the startup time of the CLI tools')
+    startup_parser.set_defaults(cmd=bench_startup)
+    startup_parser.add_argument('--runs', metavar='N', type=int, default=5, help='Number of runs per entry point')
+    startup_parser.add_argument('entry_points', metavar='SCRIPT', nargs='*',
+        default=[ 'log.py', 'info.py', 'pack.py', 'sort.py', 'admin.py', 'mcc.py' ], help='Scripts to measure, run with --help')
+
+    args = parser.parse_args()
+
+    # Restrict log message to be above selected level
+    structlog.configure( wrapper_class=structlog.make_filtering_bound_logger(getattr(logging, args.loglevel)) )
+
+    log.debug('config', args=args)
+
+    if hasattr(args, 'cmd'):
+        args.cmd(config=args)
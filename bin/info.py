@@ -22,7 +22,9 @@ LOG_LEVEL_NAMES = [logging.getLevelName(v) for v in
 log = structlog.get_logger()
 
 
-from secondlife.cli.utils import selected_cells, add_plugin_args, add_cell_selection_args, add_backend_selection_args
+from secondlife.cli.utils import process_cells, add_plugin_args, add_cell_selection_args, add_backend_selection_args
+from secondlife.cli.utils import add_report_output_args
+from secondlife.cli.report import ReportOutput
 from secondlife.plugins.api import v1, load_plugins
 
 
@@ -34,16 +36,19 @@ def main(config):
 
     backend = v1.celldb_backends[args.backend](dsn=args.backend_dsn, config=args)
 
+    # All reports write to the same output
+    config.report_output = ReportOutput(config)
+
     # Build objects for all reports
     reports = [ v1.reports[codeword].handler_class(config=config, backend=backend) for codeword in config.reports ]
 
-    for infoset in selected_cells(config=config, backend=backend):
-        for report in reports:
-            report.process_cell(infoset=infoset)
+    process_cells(reports, config=config, backend=backend)
 
     for report in reports:
         report.report()
 
+    config.report_output.close()
+
 
 if __name__ == "__main__":
     structlog.configure(
@@ -61,6 +66,9 @@ if __name__ == "__main__":
 
     # Then add arguments dependent on the loaded plugins
     parser.add_argument('-R', '--report', choices=v1.reports.keys(), action='append', dest='reports', help='Report codewords')
+    add_report_output_args(parser)
+    parser.add_argument('-j', '--jobs', metavar='N', type=int, default=1,
+        help='Process cells in N worker processes, reports without parallel support run in the main process')
 
     # Then add argument configuration argument groups dependent on the loaded plugins, include only:
     # - report plugins
@@ -15,12 +15,9 @@ import argparse
 import logging
 import structlog
 import copy
-import random
 from statistics import mean, stdev
-import time
 import os
 from functools import cached_property
-from itertools import zip_longest
 from enum import Enum, auto
 
 # Reference: https://stackoverflow.com/a/49724281
@@ -32,6 +29,7 @@ log = structlog.get_logger()
 from secondlife.cli.utils import generate_id, selected_cells, all_cells, add_plugin_args, cell_identifiers
 from secondlife.cli.utils import add_cell_selection_args, add_all_cells_match_args, add_backend_selection_args
 from secondlife.plugins.api import v1, load_plugins
+from secondlife.packing import Layout, Run, BranchAndBound, KDTree, optimize, match, improved, stop, SHARE_INTERVAL
 
 
 def _calculate_statistics(data: list) -> dict:
@@ -124,6 +122,14 @@ class String(object):
     def blocks_ir(self):
         return _calculate_statistics(list(map(lambda b: b.ir['parallel'], self.blocks)))
 
+    @property
+    def max_block_ir_stdev_pct(self):
+        return max([ block.ir['stdev_pct'] for block in self.blocks ])
+
+    @property
+    def blocks_capa_stdev_pct(self):
+        return self.blocks_capa['stdev_pct']
+
     @property
     def energy_capacity(self):
         return (self.blocks_capa['sum'] / 1000 * self.config.cell_voltage) / 1000
@@ -144,45 +150,6 @@ class String(object):
             intrablock_ir_stdev_max=f"{max([block.ir['stdev_pct'] for block in self.blocks]):3.2f} %")
 
 
-def improved(string_before, string_after):
-    """
-    Return True if the string_after has parameters better than string_before
-    """
-
-    block_ir_stdevs_before = [ block.ir['stdev_pct'] for block in string_before.blocks ]
-    block_ir_stdevs_after = [ block.ir['stdev_pct'] for block in string_after.blocks ]
-
-    if max(block_ir_stdevs_before) > 15:
-        if max(block_ir_stdevs_after) < max(block_ir_stdevs_before):
-            log.debug('max ir stdev for all blocks improved',
-                before=max(block_ir_stdevs_before), after=max(block_ir_stdevs_after))
-            return True
-
-    if string_before.blocks_capa['stdev_pct'] > 2:
-        if string_after.blocks_capa['stdev_pct'] < string_before.blocks_capa['stdev_pct']:
-            log.debug('capa stdev between blocks improved',
-                before=string_before.blocks_capa['stdev_pct'], after=string_after.blocks_capa['stdev_pct'])
-            return True
-
-    return False
-
-
-def stop(string):
-    """
-    Return True if the string layout is good enough.
-    """
-
-    if any([ block.ir['stdev_pct'] > 10 for block in string.blocks ]):
-        # IR stdev in any block is > 10%
-        return False
-
-    if string.blocks_capa['stdev_pct'] > 1:
-        # Divergence between capacity of each block is > 1 %
-        return False
-
-    return True
-
-
 def build_string(pool, S, P, config):
     pool = pool.copy()
 
@@ -208,11 +175,9 @@ def build_string(pool, S, P, config):
     return string
 
 
-def grouper(iterable, n, fillvalue=None):
-    "Collect data into non-overlapping fixed-length chunks or blocks"
-    # grouper('ABCDEFG', 3, 'x') --> ABC DEF Gxx
-    args = [iter(iterable)] * n
-    return zip_longest(*args, fillvalue=fillvalue)
+def layout_string(pool, layout, config):
+    # Build the String of the cells selected by an array layout
+    return String(config=config, blocks=[ Block(config=config, cells=[ pool[i] for i in cells ]) for cells in layout.blocks() ])
 
 
 def cls():
@@ -243,58 +208,31 @@ def assemble_string(pool, config):
     if len(pool) < config.S * config.P:
         log.warning('pool is too small for fill out all cells', pool_size=len(pool), S=config.S, P=config.P)
 
-    # Initial blocks
-    string = build_string(pool, config.S, config.P, config)
-
-    iterations = 0
-    optimizer_start_time = time.time()
-    last_progress_report = time.time()
-    last_new_string = time.time()
-    last_new_string_iter = 0
-
-    while True:
-        n = iterations // 100 + 1
-
-        # Perform n swaps
-        log.debug('swapping cells', n=n)
-        swaps = list(grouper(random.sample(range(len(pool)), min(2 * n, len(pool))), 2))
-        for (i1, i2) in swaps:
-            if i1 is not None and i2 is not None:
-                pool[i1], pool[i2] = pool[i2], pool[i1]
-
-        new_string = build_string(pool, config.S, config.P, config)
+    # Cell parameters are fetched once, swaps update only the affected blocks
+    layout = Layout([ cell.fetch('.state.usable_capacity')['v'] for cell in pool ],
+                    [ cell.fetch('.state.internal_resistance')['v'] for cell in pool ], config.S, config.P)
 
-        if improved(string, new_string):
-            log.info('improved string found', iterations=iterations)
+    def print_improvement(layout):
+        # if config.loglevel == 'DEBUG':
+        #     cls()
+        layout_string(pool, layout, config).print_info(verbose=True if config.loglevel == 'DEBUG' else False)
 
-            # if config.loglevel == 'DEBUG':
-            #     cls()
-            string.print_info(verbose=True if config.loglevel == 'DEBUG' else False)
-
-            last_new_string = time.time()
-            iterations = 0
-            string = new_string
-        else:
-            # Reverse swaps
-            for (i1, i2) in swaps:
-                if i1 is not None and i2 is not None:
-                    pool[i1], pool[i2] = pool[i2], pool[i1]
-
-        iterations += 1
-        if iterations % 1000 == 0 or time.time() - last_progress_report >= 2:
-            last_progress_report = time.time()
-            log.info('progress', iterations=iterations)
-
-        if stop(string):
-            log.info('optimal solution found')
-            break
+    run = Run(config, on_improvement=print_improvement)
+    if config.exact and len(pool) <= config.exact_max_cells:
+        log.info('optimizing', exact=True, tolerance=config.exact_tolerance)
+        (best, lower_bound) = BranchAndBound(layout, run, tolerance=config.exact_tolerance).solve()
+        print(f"Optimality gap: {best - lower_bound:.4f} (cost {best:.4f}, lower bound {lower_bound:.4f})")
+    else:
+        if config.exact:
+            log.warning('pool too large for the exact search, using the heuristic', pool_size=len(pool), exact_max_cells=config.exact_max_cells)
+        log.info('optimizing', strategy=config.strategy, jobs=config.jobs, seed=config.seed)
+        optimize(v1.strategies[config.strategy], layout, config, run, jobs=config.jobs, seed=config.seed)
 
-        if (time.time() - last_new_string > config.optimizer_timeout) or (time.time() - optimizer_start_time > config.total_timeout):
-            log.warn('optimizer timeout')
-            break
+    if stop(layout.score()):
+        log.info('optimal solution found')
 
     log.info('optimization finished')
-    return string
+    return layout_string(pool, layout, config)
 
 
 def _layout_args(parser):
@@ -309,6 +247,23 @@ def _optimizer_args(parser):
         help='Finish optimizer when a better solution is not found in SEC seconds')
     group.add_argument('--total-timeout', metavar='SEC', default=1200, type=float,
         help='Unconditionally finish the optimizer after SEC seconds')
+    group.add_argument('--strategy', choices=v1.strategies.keys(), default='hill-climb', help='Optimization strategy')
+    group.add_argument('-j', '--jobs', metavar='N', type=int, default=1,
+        help='Run N independent optimizer chains in worker processes, sharing the best layout periodically')
+    group.add_argument('--share-interval', metavar='N', type=int, default=SHARE_INTERVAL,
+        help='Restart all chains from the best layout after N iterations of each chain')
+    group.add_argument('--seed', type=int, help='Seed of the random number generator, makes runs not ending with a timeout reproducible')
+    group.add_argument('--exact', default=False, action='store_true',
+        help='Search for the optimal string with branch and bound, the cost is the capacity stdev between blocks plus the block IR stdev above 10 %%')
+    group.add_argument('--exact-max-cells', metavar='N', type=int, default=32,
+        help='Use the heuristic strategy instead of the exact search for pools of more than N cells')
+    group.add_argument('--exact-tolerance', metavar='PCT', type=float, default=0,
+        help='Finish the exact search when no string better by more than PCT percentage points of cost can exist')
+
+    # Then add argument configuration argument groups dependent on the loaded plugins, include only strategy plugins
+    included_plugins = v1.strategies.keys()
+    for codeword in filter(lambda codeword: codeword in v1.config_groups.keys(), included_plugins):
+        v1.config_groups[codeword](parser)
 
 
 def cmd_preview(config):
@@ -343,6 +298,23 @@ def cmd_assemble(config):
             backend.move(id=cell.fetch('.id'), destination=block_path)
 
 
+def _replacement_features(cell):
+    # Cells are compared by |capacity difference| + 1.5 * |IR difference|, the KD tree uses the L1 distance
+    return (cell.fetch('.state.usable_capacity')['v'], 1.5 * cell.fetch('.state.internal_resistance')['v'])
+
+
+def _replace_cell(backend, infoset, replacement_cell, config):
+    replacement_capacity = replacement_cell.fetch('.state.usable_capacity')
+    replacement_ir = replacement_cell.fetch('.state.internal_resistance')
+    log.info('replacement cell found', id=replacement_cell.fetch('.id'),
+             capacity=replacement_capacity, ir=replacement_ir,
+             path=replacement_cell.fetch('.path'))
+
+    if config.dump_path:
+        backend.move(id=replacement_cell.fetch('.id'), destination=infoset.fetch('.path'))
+        backend.move(id=infoset.fetch('.id'), destination=config.dump_path)
+
+
 def cmd_replace(config):
     backend = v1.celldb_backends[args.backend](dsn=args.backend_dsn, config=args)
 
@@ -354,10 +326,12 @@ def cmd_replace(config):
         log.error('pool empty')
         return
 
-    replacements = {}
-
     log.info('cell pool', count=len(pool))
 
+    # Features are fetched once, replacement cells are removed from the tree
+    tree = KDTree([ _replacement_features(cell) for cell in pool ])
+
+    cells = []
     for id in cell_identifiers(config=config):
 
         # Find cell
@@ -368,31 +342,36 @@ def cmd_replace(config):
 
         capacity = infoset.fetch('.state.usable_capacity')
         ir = infoset.fetch('.state.internal_resistance')
-        path = infoset.fetch('.path')
-        log.info('replacing cell', id=id, path=path, capacity=capacity, ir=ir)
+        log.info('replacing cell', id=id, path=infoset.fetch('.path'), capacity=capacity, ir=ir)
+
+        if not config.batch:
+            (distance, i) = tree.nearest(_replacement_features(infoset))[0]
+            if pool[i].fetch('.id') == id:
+                log.error('replaced cell found in pool', id=id)
+                continue
 
-        pool.sort(reverse=False, key=lambda cell:
-            abs(capacity['v'] - cell.fetch('.state.usable_capacity')['v']) +
-            1.5 * abs(ir['v'] - cell.fetch('.state.internal_resistance')['v'])
-        )
+            tree.remove(i)  # Remove the replacement cell from the pool
+            log.info('cell pool', count=len(tree))
 
-        replacement_cell = pool[0]
-        if replacement_cell.fetch('.id') == id:
-            log.error('replaced cell found in pool', id=id)
-            continue
+            _replace_cell(backend, infoset, pool[i], config)
+        else:
+            cells.append(infoset)
 
-        pool = pool[1:]  # Remove the replacement cell from the pool
-        log.info('cell pool', count=len(pool))
+    if config.batch and len(cells) > 0:
+        # Cells being replaced can't replace each other
+        ids = { infoset.fetch('.id') for infoset in cells }
+        for (i, cell) in enumerate(pool):
+            if cell.fetch('.id') in ids:
+                tree.remove(i)
 
-        replacement_capacity = replacement_cell.fetch('.state.usable_capacity')
-        replacement_ir = replacement_cell.fetch('.state.internal_resistance')
-        log.info('replacement cell found', id=replacement_cell.fetch('.id'),
-                 capacity=replacement_capacity, ir=replacement_ir,
-                 path=replacement_cell.fetch('.path'))
+        if len(tree) < len(cells):
+            log.error('pool too small', count=len(tree), cells=len(cells))
+            sys.exit(1)
 
-        if config.dump_path:
-            backend.move(id=replacement_cell.fetch('.id'), destination=path)
-            backend.move(id=id, destination=config.dump_path)
+        # The replacements are chosen together minimizing the sum of the distances
+        for (infoset, i) in zip(cells, match(tree, [ _replacement_features(infoset) for infoset in cells ])):
+            log.info('replacing cell', id=infoset.fetch('.id'), replacement=pool[i].fetch('.id'))
+            _replace_cell(backend, infoset, pool[i], config)
 
 
 if __name__ == "__main__":
@@ -452,6 +431,8 @@ if __name__ == "__main__":
     add_backend_selection_args(replace_parser)
     add_all_cells_match_args(replace_parser)
     replace_parser.add_argument('--dump-path', help="The path where the old cell will be moved to")
+    replace_parser.add_argument('--batch', default=False, action='store_true',
+        help="Choose the replacements of all cells together minimizing the total difference instead of one by one")
     replace_parser.add_argument('identifiers', nargs='*', default=[], help='Cell identifiers to replace, use - to read from standard input')
 
     args = parser.parse_args()
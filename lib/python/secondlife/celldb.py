@@ -1,12 +1,103 @@
 #!/usr/bin/env python3
 
-from secondlife.infoset import Infoset
+from secondlife.infoset import Infoset, VersionedList, bytes_repr
+from secondlife.plugins.api import v1
+from collections.abc import Mapping
 import structlog
 import time
 
 log = structlog.get_logger()
 
 
+class LazyExtra(Mapping):
+    """
+    An extra object (name, props, ref and content) which reads its content only when 'content' is accessed.
+
+    The origin is an opaque token set by the backend which loaded the extra. Backends compare it when storing a cell
+    to skip rewriting content which has not changed.
+    """
+
+    def __init__(self, name, props, ref, size, loader, origin=None):
+        self._data = dict(name=name, props=props, ref=ref)
+        self._loader = loader
+        self._content = None
+        self.size = size
+        self.origin = origin
+
+    @property
+    def loaded(self):
+        return self._content is not None
+
+    def __getitem__(self, key):
+        if key == 'content':
+            if self._content is None:
+                self._content = self._loader()
+            return self._content
+        return self._data[key]
+
+    def __contains__(self, key):
+        return key == 'content' or key in self._data
+
+    def __iter__(self):
+        yield from self._data.keys()
+        yield 'content'
+
+    def __len__(self):
+        return len(self._data) + 1
+
+    def fetch(self, path, default=None):
+        # Used for serialization, the content is not loaded only to print its length
+        return dict(self._data, content=bytes_repr(self.size))
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__} name={self._data["name"]} size={self.size} loaded={self.loaded}>'
+
+
+class MemoizedStateVar(object):
+    """
+    Caches the values of a state variable until the cell log is modified.
+    """
+
+    def __init__(self, statevar, cell):
+        self._statevar = statevar
+        self._cell = cell
+        self._log = None
+        self._log_version = None
+        self._values = dict()
+
+    def fetch(self, path, default=None):
+        log = self._cell.fetch('.log')
+        if not isinstance(log, VersionedList):
+            return self._statevar.fetch(path, default)
+
+        if log is not self._log or log.version != self._log_version:
+            self._log = log
+            self._log_version = log.version
+            self._values = dict()
+
+        if path not in self._values:
+            self._values[path] = self._statevar.fetch(path, default)
+        return self._values[path]
+
+
+def bind_state_vars(infoset: Infoset):
+    # Track log modifications to know when the memoized state variable values need to be recomputed
+    if type(infoset.fetch('.log')) is list:
+        infoset.put('.log', VersionedList(infoset.fetch('.log')))
+
+    for (path, statevar_class) in v1.state_vars.items():
+        infoset.put(f'.state.{path}', MemoizedStateVar(statevar_class(cell=infoset), infoset))
+
+
+def _path_parts(path: str) -> list:
+    return [ part for part in path[1:].split('/') if len(part) > 0 ]  # Ignore first /
+
+
+def _normalized_path(path: str) -> str:
+    # Container paths always start and end with /
+    return '/'.join([''] + [ part for part in path.split('/') if len(part) > 0 ] + [''])
+
+
 class CellDB(object):
     def __init__(self):
         pass
@@ -30,28 +121,76 @@ class CellDB(object):
         return infoset
 
     def path_valid(self, path: str) -> bool:
-        log.debug('checking path validity', path=path)
+        return self.paths_valid([ path ])[0]
 
-        if path[0] != '/':
-            log.error('path needs to start with /', path=path)
-            return False
+    def paths_valid(self, paths) -> list:
+        """
+        Check validity of many paths at once, all path parts are checked for existence in a single batch.
+        Returns a list of booleans in the order of the paths.
+        """
+        paths = list(paths)
+        log.debug('checking path validity', paths=paths)
 
-        for part in path[1:].split('/'):  # Ignore first /
-            if len(part) == 0:
+        parts = set()
+        for path in paths:
+            parts.update(_path_parts(path))
+        existing = self.existing_ids(parts)
+
+        valid = []
+        for path in paths:
+            if path[0] != '/':
+                log.error('path needs to start with /', path=path)
+                valid.append(False)
+                continue
+
+            missing = [ part for part in _path_parts(path) if part not in existing ]
+            if len(missing) > 0:
+                log.error('path part does not exist', path=path, part=missing[0])
+                valid.append(False)
                 continue
-            if self.fetch(part) is None:
-                log.error('path part does not exist', path=path, part=part)
-                return False
-        return True
+
+            valid.append(True)
+        return valid
+
+    def existing_ids(self, ids) -> set:
+        """
+        Return the subset of cell IDs which exist in the celldb. Backends should override this with something better than
+        fetching each cell.
+        """
+        return { id for id in set(ids) if self.fetch(id) is not None }
 
     def fetch(self, id: str) -> Infoset:
         raise NotImplementedError()
 
+    def fetch_many(self, ids) -> dict:
+        """
+        Fetch a batch of cells, returns a dict mapping the IDs of the cells found to their infosets. Backends should
+        override this with something better than fetching each cell.
+        """
+        found = dict()
+        for id in dict.fromkeys(ids):
+            infoset = self.fetch(id)
+            if infoset is not None:
+                found[id] = infoset
+        return found
+
     def put(self, infoset: Infoset):
         raise NotImplementedError()
 
     def move(self, id: str, destination: str):
         raise NotImplementedError()
 
-    def find(self) -> Infoset:  # Generator
+    def find(self, path=None, recursive=True, filter=None) -> Infoset:  # Generator
+        """
+        Yield the cells in the celldb. If a container path is specified only the cells in it are yielded, including the
+        cells in the containers below it if recursive is True. The filter is an expression parsed by secondlife.predicate.parse(), backends use
+        the parts they understand (see secondlife.predicate.restrictions() and prefilter()) to skip loading cells which
+        cannot match. The cells yielded can still be a superset of the matching ones, callers apply the full filter.
+
+        The path and filter arguments are passed only when they are set. Backend plugins implementing find() without
+        arguments, as before the arguments were added, keep working: their cells are checked by the callers only.
+        """
         raise NotImplementedError()
+
+    def reindex(self):
+        log.info('backend has no indexes to rebuild')
@@ -0,0 +1,284 @@
+#!/usr/bin/env python3
+
+import csv
+import heapq
+import itertools
+import json
+import pickle
+import sys
+import tempfile
+from collections import defaultdict
+
+import tabulate
+from structlog import get_logger
+
+log = get_logger()
+
+# Default amount of rows kept in memory by reports before spilling them to temporary files
+SORT_BUFFER_ROWS = 100000
+
+OUTPUT_FORMATS = [ 'ascii', 'csv', 'jsonl', 'npz' ]
+
+# Columns of the rows written for ReportSections in the tabular output formats
+SECTION_HEADERS = [ 'title', 'text' ]
+
+
+def _read_run(f):  # Generator
+    f.seek(0)
+    while True:
+        try:
+            yield pickle.load(f)
+        except EOFError:
+            return
+
+
+class ExternalSorter(object):
+    """
+    Sorts rows by key keeping at most max_rows rows in memory. Sorted runs above that are spilled to temporary files and
+    merged when iterating. Rows with equal keys keep the order in which they were added.
+    """
+
+    def __init__(self, max_rows=None):
+        self.max_rows = max_rows or SORT_BUFFER_ROWS
+        self._rows = []
+        self._runs = []
+        self._counter = itertools.count()
+
+    def add(self, key, row):
+        # The sequence number keeps the sort stable and the rows themselves are never compared
+        self._rows.append( (key, next(self._counter), row) )
+        if len(self._rows) >= self.max_rows:
+            self._spill()
+
+    def _spill(self):
+        self._rows.sort(key=lambda item: item[:2])
+
+        f = tempfile.TemporaryFile()
+        for item in self._rows:
+            pickle.dump(item, f, protocol=pickle.HIGHEST_PROTOCOL)
+        log.debug('rows spilled to temporary file', rows=len(self._rows), size=f.tell())
+
+        self._runs.append(f)
+        self._rows = []
+
+    def items(self):  # Generator
+        # Return (key, row) tuples in order, the sorter is emptied
+        self._rows.sort(key=lambda item: item[:2])
+        runs = [ _read_run(f) for f in self._runs ]
+        try:
+            for (key, n, row) in heapq.merge(*runs, self._rows, key=lambda item: item[:2]):
+                yield (key, row)
+        finally:
+            for f in self._runs:
+                f.close()
+            self._runs = []
+            self._rows = []
+
+    def __iter__(self):  # Generator
+        for (key, row) in self.items():
+            yield row
+
+
+class ReportOutput(object):
+    """
+    The destination shared by all reports of a run. Rows are written as they come:
+
+        ascii   tab separated lines (only in streaming mode, tables are printed by ReportTable otherwise)
+        csv     CSV lines
+
+    The ascii and csv lines of all reports share a single header line: a report column followed by the columns of all
+    tables and sections, in the order they were created. Each row fills the columns of its report, the others are empty,
+    so csv.DictReader reads the file as a whole. Tables register their columns when created, before any rows are written.
+        jsonl   a JSON object per line, keyed by the column headers and the report name
+        npz     columns are collected and stored as numpy arrays named 'report/header' when the output is closed
+    """
+
+    def __init__(self, config):
+        self.format = getattr(config, 'output_format', 'ascii')
+        self.filename = getattr(config, 'output', None) or '-'
+
+        self._headers = [ 'report' ]
+        self._header_written = False
+        self._columns = defaultdict(list)
+
+        self._file = None
+        self._csv = None
+
+    def _open(self):
+        if self._file is None:
+            binary = self.format == 'npz'
+            if self.filename == '-':
+                self._file = sys.stdout.buffer if binary else sys.stdout
+            else:
+                self._file = open(self.filename, 'wb' if binary else 'w', newline=None if binary else '')
+            if self.format == 'csv':
+                self._csv = csv.writer(self._file)
+        return self._file
+
+    def register(self, headers: list):
+        new = [ header for header in headers if header not in self._headers ]
+        if len(new) > 0 and self._header_written:
+            log.warning('columns added after the header line was written', columns=new)
+        self._headers.extend(new)
+
+    def write_row(self, name: str, headers: list, row: list):
+        f = self._open()
+
+        if self.format == 'npz':
+            for (header, value) in zip(headers, row):
+                self._columns[f'{name}/{header}'].append(value)
+
+        elif self.format == 'jsonl':
+            f.write(json.dumps(dict(zip(headers, row), report=name), default=str) + '\n')
+
+        else:
+            self.register(headers)
+            if not self._header_written:
+                self._header_written = True
+                self._write_line(self._headers)
+
+            values = dict(zip(headers, row), report=name)
+            self._write_line([ values.get(header, '') for header in self._headers ])
+
+    def write_text(self, text: str):
+        # Preformatted text, used by the ascii format
+        self._open().write(text + '\n')
+
+    def _write_line(self, values):
+        if self.format == 'csv':
+            self._csv.writerow(values)
+        else:
+            self._file.write('\t'.join([ str(value) for value in values ]) + '\n')
+
+    def close(self):
+        if self.format == 'npz' and len(self._columns) > 0:
+            import numpy as np
+
+            arrays = dict()
+            for (key, values) in self._columns.items():
+                try:
+                    array = np.asarray(values)
+                except ValueError:  # Lists of different lengths
+                    array = np.asarray([ json.dumps(value, default=str) for value in values ])
+                if array.dtype == object:
+                    array = array.astype(str)  # Keep the file loadable without pickle
+                arrays[key] = array
+            np.savez_compressed(self._open(), **arrays)
+
+        if self._file is not None:
+            self._file.flush()
+            if self.filename != '-':
+                self._file.close()
+        self._file = None
+
+
+class ReportTable(object):
+    """
+    The rows of a tabular report. In the default ascii format the rows are printed as a single table when the report is
+    closed, sorted by their keys. In streaming mode (--stream) and in the other output formats each row is written as
+    soon as it is added, unless the table is ordered, then the rows are written sorted when the report is closed. Rows
+    waiting to be written are kept in an ExternalSorter so the memory usage is bounded.
+
+    Tables of info.py --jobs workers (config.report_buffer) keep all rows, they are pickled with their rows and merged
+    into the table of the main process.
+
+    Unique tables keep only the first row of each cell (the first column), cells can be selected more than once.
+    """
+
+    def __init__(self, name: str, headers: list, config, ordered=False, unique=False):
+        self.name = name
+        self.headers = headers
+        self._seen = set() if unique else None
+        self.output = getattr(config, 'report_output', None) or ReportOutput(config)
+        self.output.register(headers)
+        self.table = self.output.format == 'ascii' and not getattr(config, 'report_stream', False)
+        self.count = 0
+
+        self._rows = None
+        if ordered or self.table or getattr(config, 'report_buffer', False):
+            self._rows = ExternalSorter(getattr(config, 'sort_buffer_rows', None))
+
+    def __getstate__(self):
+        return dict(name=self.name, headers=self.headers, count=self.count,
+                    rows=list(self._rows.items()) if self._rows is not None else [])
+
+    def merge(self, other):
+        # Add the rows of an unpickled table
+        for (key, row) in other.rows:
+            self.add(row, key=key)
+
+    def add(self, row: list, key=None):
+        if self._seen is not None:
+            if row[0] in self._seen:
+                return
+            self._seen.add(row[0])
+
+        self.count += 1
+        if self._rows is not None:
+            self._rows.add(key, row)
+        else:
+            self.output.write_row(self.name, self.headers, row)
+
+    def close(self):
+        if self._rows is None:
+            return
+
+        if self.table:
+            if self.count > 0:
+                self.output.write_text( tabulate.tabulate(list(self._rows), headers=self.headers, tablefmt='fancy_grid') )
+        else:
+            for row in self._rows:
+                self.output.write_row(self.name, self.headers, row)
+
+
+class ReportSections(object):
+    """
+    Titled blocks of text, such as a per-cell log table. In the default ascii format the sections are printed when the
+    report is closed and spilled to temporary files above the sort buffer size. In streaming mode each section is printed
+    as soon as it is added, the other output formats get a row with the title and the text. Unique sections keep only the
+    first section of each title.
+    """
+
+    def __init__(self, name: str, config, unique=False):
+        self.name = name
+        self._seen = set() if unique else None
+        self.output = getattr(config, 'report_output', None) or ReportOutput(config)
+        if self.output.format != 'ascii':
+            self.output.register(SECTION_HEADERS)  # Sections are printed as text in the ascii format
+        self.count = 0
+
+        self._sections = None
+        if (self.output.format == 'ascii' and not getattr(config, 'report_stream', False)) or getattr(config, 'report_buffer', False):
+            self._sections = ExternalSorter(getattr(config, 'sort_buffer_rows', None))
+
+    def __getstate__(self):
+        return dict(name=self.name, count=self.count, sections=list(self._sections) if self._sections is not None else [])
+
+    def merge(self, other):
+        # Add the sections of an unpickled instance
+        for (title, text) in other.sections:
+            self.add(title, text)
+
+    def add(self, title: str, text: str):
+        if self._seen is not None:
+            if title in self._seen:
+                return
+            self._seen.add(title)
+
+        self.count += 1
+        if self._sections is not None:
+            self._sections.add(None, (title, text))
+        elif self.output.format == 'ascii':
+            self._print_section(title, text)
+        else:
+            self.output.write_row(self.name, SECTION_HEADERS, [ title, text ])
+
+    def _print_section(self, title, text):
+        self.output.write_text(f"=== {title}\n{text}")
+
+    def close(self):
+        if self._sections is None:
+            return
+
+        for (title, text) in self._sections:
+            self._print_section(title, text)
@@ -11,8 +11,16 @@ import json
 import string
 import os
 import pkgutil
+import inspect
+import queue
+import threading
+import weakref
 
 from secondlife.plugins.api import v1, load_plugins
+from secondlife import predicate
+from secondlife.celldb import LazyExtra, _normalized_path
+from secondlife.infoset import VersionedList
+from secondlife.cli.report import SORT_BUFFER_ROWS, OUTPUT_FORMATS
 
 log = get_logger()
 
@@ -21,27 +29,108 @@ def generate_id(prefix, k=10):
     return f"{prefix}~{''.join(random.choices(string.digits, k=k))}"
 
 
-def cell_identifiers(config):
+def cell_identifiers(config):  # Generator
+    for ids in _identifier_chunks(config, FETCH_CHUNK_SIZE):
+        yield from ids
 
-    for id in config.identifiers:
-        if id == '-':
-            for line in sys.stdin:
-                line = line.strip()
-                if len(line) == 0:
-                    continue
 
-                yield line
-        else:
-            yield id
+# Serialized JSON of infosets, shared by the match filter and all reports
+_json_cache = weakref.WeakKeyDictionary()
+
+
+def cell_json(infoset) -> str:
+    """
+    Return the infoset serialized as compact JSON text. The text is cached for as long as the infoset exists and neither
+    put() is called on it nor its log is modified, this way the match filter and all reports serialize each cell only once.
+    Infosets with a log which doesn't count its modifications (not a VersionedList) are serialized each time.
+    """
+    cell_log = infoset.fetch('.log')
+    if not isinstance(cell_log, VersionedList):
+        return infoset.to_json()
+
+    version = (infoset.version, cell_log.version)
+
+    cached = _json_cache.get(infoset)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+
+    text = infoset.to_json()
+    _json_cache[infoset] = (version, text)
+    return text
+
+
+class JQBatch(object):
+    """
+    Evaluates several compiled jq queries on the same input using a single jq program, the input is parsed only once.
+    """
+
+    def __init__(self, queries):
+        self.queries = list(queries)
+        self._program = None
+
+        if len(self.queries) > 0:
+            # Newlines keep comments in the queries from swallowing the rest of the program
+            self._program = jq.compile('[ ' + ', '.join([ f'[ (\n{query.program_string}\n) ]' for query in self.queries ]) + ' ]')
+
+    def all(self, text: str) -> list:
+        # Return a list of all outputs for each query
+        if self._program is None:
+            return []
+        return self._program.input(text=text).first()
+
+    def first(self, text: str) -> list:
+        # Return the first output for each query, None if the query has no outputs
+        return [ outputs[0] if len(outputs) > 0 else None for outputs in self.all(text) ]
+
+    def text(self, text: str) -> list:
+        # Return the outputs of each query as text, the same as text() of the query on its own. The jq module formats
+        # each output with the default json.dumps() arguments, one output per line.
+        return [ '\n'.join([ json.dumps(output) for output in outputs ]) for outputs in self.all(text) ]
+
+
+class MatchQuery(object):
+    """
+    A compiled --match query. Queries using only path access, comparisons, and/or/not and startswith() are evaluated
+    directly on the infoset, anything else is passed to jq. Cells containing values the native evaluation can't handle
+    the same way as jq (for example comparing arrays) are passed to jq as well.
+    """
+
+    def __init__(self, query: str):
+        self.program_string = query
+        self.jq_program = jq.compile(query)
+
+        try:
+            self.expr = predicate.parse(query)
+            self._native = predicate.compile_expr(self.expr)
+        except predicate.Unsupported as e:
+            log.debug('query evaluated using jq', query=query, reason=str(e))
+            self.expr = None
+            self._native = None
+
+    def first(self, infoset):
+        # Return the first output of the query for the infoset
+        if self._native is not None:
+            try:
+                return self._native(infoset)
+            except predicate.Unsupported:
+                pass
+
+        return self.jq_program.input(text=cell_json(infoset)).first()
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__} {self.program_string!r} native={self._native is not None}>'
 
 
 def include_cell(infoset, config):
     # Check if cell is to be included based on configured criteria
 
+    if config.path_prefix and not (infoset.fetch('.path') or '').startswith(config.path_prefix):
+        return False
+
     if config.jq_query:
 
         # The jq should return only a single value, use first() to get it
-        res = config.jq_query.input(text=infoset.to_json()).first()
+        res = config.jq_query.first(infoset)
         log.debug('jq query result', id=infoset.fetch('.id'), result=res, query=config.jq_query)
 
         if res is not True:
@@ -50,62 +139,236 @@ def include_cell(infoset, config):
     return True
 
 
-def all_cells(config, backend):
+def _find_cells(backend, path=None, filter=None):
+    # Backend plugins written for find() without arguments get only the arguments they accept, the cells are checked by
+    # include_cell() in any case
+    parameters = inspect.signature(backend.find).parameters.values()
+    any_keyword = any([ parameter.kind is parameter.VAR_KEYWORD for parameter in parameters ])
+    names = [ parameter.name for parameter in parameters ]
+
+    kwargs = { name: value for (name, value) in dict(path=path, filter=filter).items()
+               if value is not None and (name in names or any_keyword) }
+    return backend.find(**kwargs)
+
+
+def all_cells(config, backend, filtered=True):
     cells_found_total = 0
     last_progress_report = time.time()
 
     log.info('searching for cells')
 
-    for infoset in backend.find():
+    # Let the backend skip cells which cannot match
+    for infoset in _find_cells(backend, path=config.path_prefix, filter=config.jq_query.expr if config.jq_query else None):
         cells_found_total += 1
         if cells_found_total % 1000 == 0 or time.time() - last_progress_report >= 2:
             last_progress_report = time.time()
             log.info('progress', cells_found_total=cells_found_total)
 
-        if include_cell(infoset, config=config):
+        if not filtered or include_cell(infoset, config=config):
             yield infoset
 
 
-def identified_cells(config, backend):
+# Amount of cell identifiers fetched from the celldb at once
+FETCH_CHUNK_SIZE = 100
+
+
+def _chunks(iterable, size):  # Generator
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+
+    if len(chunk) > 0:
+        yield chunk
+
+
+def _stdin_chunks(size):  # Generator
+    # Lines are read by a thread, each chunk holds the lines read so far and only the first one is waited for. Identifiers
+    # typed or scanned on a terminal are processed right away, pipelines like 'scanner | info.py -' stay responsive and
+    # identifiers read from files are still fetched in full chunks.
+    lines = queue.Queue(maxsize=4 * size)
+
+    def read():
+        for line in iter(sys.stdin.readline, ''):
+            lines.put(line)
+        lines.put(None)
+
+    threading.Thread(target=read, name='stdin', daemon=True).start()
+
+    finished = False
+    while not finished:
+        chunk = [ lines.get() ]
+        while chunk[-1] is not None and len(chunk) < size:
+            try:
+                chunk.append(lines.get_nowait())
+            except queue.Empty:
+                break
+
+        finished = chunk[-1] is None
+        ids = [ line.strip() for line in chunk if line is not None and len(line.strip()) > 0 ]
+        if len(ids) > 0:
+            yield ids
+
+
+def _identifier_chunks(config, size):  # Generator
+    ids = []
+    for id in config.identifiers:
+        if id == '-':
+            if len(ids) > 0:
+                yield ids
+                ids = []
+            yield from _stdin_chunks(size)
+        else:
+            ids.append(id)
+            if len(ids) >= size:
+                yield ids
+                ids = []
+
+    if len(ids) > 0:
+        yield ids
+
+
+def identified_cells(config, backend, filtered=True):
     cells_found_total = 0
     last_progress_report = time.time()
 
-    for id in cell_identifiers(config=config):
+    for ids in _identifier_chunks(config, FETCH_CHUNK_SIZE):
+
+        # Find cells
+        found = backend.fetch_many(ids)
 
-        # Find cell
-        infoset = backend.fetch(id)
-        if not infoset:
-            if config.autocreate is True:
+        missing = [ id for id in dict.fromkeys(ids) if id not in found ]
+        if len(missing) > 0 and config.autocreate is not True:
+            log.error('cells not found', ids=missing)
+            sys.exit(1)
+
+        for id in ids:
+            infoset = found.get(id)
+            if not infoset:
                 infoset = backend.create(id=id, path=config.path or '/')
 
                 backend.put(infoset)
+                found[id] = infoset
 
-            else:
-                log.error('cell not found', id=id)
-                sys.exit(1)
-
-        if infoset.fetch('.id'):
-            log.info('cell found', id=id)
+            if infoset.fetch('.id'):
+                log.info('cell found', id=id)
 
-            # Progress report every 1000 cells or 2 seconds
-            cells_found_total += 1
-            if cells_found_total % 1000 == 0 or time.time() - last_progress_report >= 2:
-                last_progress_report = time.time()
-                log.info('progress', cells_found_total=cells_found_total)
+                # Progress report every 1000 cells or 2 seconds
+                cells_found_total += 1
+                if cells_found_total % 1000 == 0 or time.time() - last_progress_report >= 2:
+                    last_progress_report = time.time()
+                    log.info('progress', cells_found_total=cells_found_total)
 
-            if include_cell(infoset, config=config):
-                yield infoset
+                if not filtered or include_cell(infoset, config=config):
+                    yield infoset
 
     # Final progress report
     log.info('progress', cells_found_total=cells_found_total)
 
 
-def selected_cells(config, backend):
+def selected_cells(config, backend, filtered=True):
+    # With filtered=False the cells are not checked with include_cell()
 
     if config.all_cells:
-        return all_cells(config=config, backend=backend)
+        return all_cells(config=config, backend=backend, filtered=filtered)
     else:
-        return identified_cells(config=config, backend=backend)
+        return identified_cells(config=config, backend=backend, filtered=filtered)
+
+
+# Amount of cells sent to a worker process at once
+JOBS_CHUNK_SIZE = 200
+
+# The configuration and the reports inherited by the forked worker processes
+_worker_setup = None
+
+
+def _content_unavailable():
+    raise RuntimeError('extra content is not available in worker processes')
+
+
+def _cell_data(infoset) -> dict:
+    # State variables are bound again in the worker processes, the rest of the infoset is plain data. Extras read lazily
+    # refer to their backend which can't be pickled, the workers get their name, props, ref and size without the content.
+    data = { k: v for (k, v) in infoset.data.items() if k != 'state' }
+    if 'extra' in data:
+        data['extra'] = [ LazyExtra(extra['name'], extra['props'], extra['ref'], extra.size, _content_unavailable)
+                          if isinstance(extra, LazyExtra) else extra for extra in data['extra'] ]
+    return data
+
+
+def _process_chunk(chunk):
+    from secondlife.celldb import bind_state_vars
+    from secondlife.infoset import Infoset
+
+    (config, report_classes) = _worker_setup
+    reports = [ report_class(config=config) for report_class in report_classes ]
+
+    included = []
+    for (i, data) in enumerate(chunk):
+        infoset = Infoset(data=data)
+        bind_state_vars(infoset)
+        if include_cell(infoset, config=config):
+            included.append(i)
+            for report in reports:
+                report.process_cell(infoset=infoset)
+
+    return (included, reports)
+
+
+def process_cells(reports, config, backend):
+    """
+    Run process_cell() of the reports for all selected cells. With config.jobs above 1 the cells are sent in chunks to
+    worker processes which evaluate include_cell() and run the reports implementing merge(other). The reports created in
+    the workers are pickled and merged into the given ones in the order of the cells. Reports without merge() process
+    the included cells in this process.
+    """
+    global _worker_setup
+
+    jobs = getattr(config, 'jobs', None) or 1
+    if jobs <= 1:
+        for infoset in selected_cells(config=config, backend=backend):
+            for report in reports:
+                report.process_cell(infoset=infoset)
+        return
+
+    import copy
+    import multiprocessing
+    from collections import deque
+    from concurrent.futures import ProcessPoolExecutor
+
+    parallel = [ report for report in reports if hasattr(report, 'merge') ]
+    sequential = [ report for report in reports if not hasattr(report, 'merge') ]
+    log.debug('processing cells in parallel', jobs=jobs, parallel=parallel, sequential=sequential)
+
+    # Worker reports keep their rows to send them back. They get no backend, forked processes must not share its
+    # connections with this process.
+    worker_config = copy.copy(config)
+    worker_config.report_buffer = True
+    _worker_setup = (worker_config, [ type(report) for report in parallel ])
+
+    def merge(pending):
+        (cells, future) = pending.popleft()
+        (included, results) = future.result()
+        for (report, result) in zip(parallel, results):
+            report.merge(result)
+        for i in included:
+            for report in sequential:
+                report.process_cell(infoset=cells[i])
+
+    # The workers are forked so that they inherit the configuration including compiled jq programs
+    with ProcessPoolExecutor(max_workers=jobs, mp_context=multiprocessing.get_context('fork')) as executor:
+        pending = deque()
+        for cells in _chunks(selected_cells(config=config, backend=backend, filtered=False), JOBS_CHUNK_SIZE):
+            pending.append( (cells, executor.submit(_process_chunk, [ _cell_data(infoset) for infoset in cells ])) )
+
+            # Limit the amount of cells in flight
+            while len(pending) > 2 * jobs:
+                merge(pending)
+
+        while len(pending) > 0:
+            merge(pending)
 
 
 def perform_measurement(infoset, codeword, config):
@@ -130,6 +393,15 @@ class CompileJQ(argparse.Action):
             sys.exit(1)
 
 
+class CompileMatch(argparse.Action):
+    def __call__(self, parser, namespace, values, option_string=None):
+        try:
+            setattr(namespace, self.dest, MatchQuery(values))
+        except Exception as e:
+            log.error('cannot compile query', query=values, _exc_info=e)
+            sys.exit(1)
+
+
 class CompileJQAndAppend(argparse.Action):
     def __call__(self, parser, namespace, values, option_string=None):
         try:
@@ -144,7 +416,9 @@ def add_cell_selection_args(parser):
     group = parser.add_argument_group('cell selection')
     group.add_argument('--autocreate', default=False, action='store_true', help='Create cell IDs that are selected but not found')
     group.add_argument('--all', '-a', default=False, action='store_true', dest='all_cells', help='Process all cells')
-    group.add_argument('--match', dest='jq_query', action=CompileJQ,
+    group.add_argument('--path-prefix', metavar='PATH', type=_normalized_path,
+        help='Process only cells in the PATH container and the containers below it')
+    group.add_argument('--match', dest='jq_query', action=CompileMatch,
         help='Filter cells based on infoset content, use https://stedolan.github.io/jq/ syntax. \
             Matches when a "true" string is returned as a single output')
     group.add_argument('identifiers', nargs='*', default=[],
@@ -156,11 +430,25 @@ def add_cell_selection_args(parser):
 def add_all_cells_match_args(parser):
     group = parser.add_argument_group('cell selection')
     group.set_defaults(all_cells=True, autocreate=False)
-    group.add_argument('--match', dest='jq_query', action=CompileJQ,
+    group.add_argument('--path-prefix', metavar='PATH', type=_normalized_path,
+        help='Process only cells in the PATH container and the containers below it')
+    group.add_argument('--match', dest='jq_query', action=CompileMatch,
         help='Filter cells based on infoset content, use https://stedolan.github.io/jq/ syntax. \
             Matches when a "true" string is returned as a single output')
 
 
+# Add arguments which control how the reports are output
+def add_report_output_args(parser):
+    group = parser.add_argument_group('report output')
+    group.add_argument('--stream', default=False, action='store_true', dest='report_stream',
+        help='Print report rows as the cells are processed instead of tables at the end, memory usage stays bounded')
+    group.add_argument('--sort-buffer', metavar='ROWS', type=int, default=SORT_BUFFER_ROWS, dest='sort_buffer_rows',
+        help='Amount of report rows kept in memory, rows above that are spilled to temporary files')
+    group.add_argument('--output-format', choices=OUTPUT_FORMATS, default='ascii',
+        help='Report output format, csv and jsonl rows are written as the cells are processed, npz stores numpy arrays')
+    group.add_argument('--output', metavar='FILE', default='-', help='Write the reports to FILE instead of the standard output')
+
+
 def add_backend_selection_args(parser):
     group = parser.add_argument_group('backend selection')
     group.add_argument('--backend', default=os.getenv('CELLDB_BACKEND', 'json-files'), choices=v1.celldb_backends.keys(), help='Celldb backend')
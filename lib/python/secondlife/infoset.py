@@ -1,9 +1,50 @@
 #!/usr/bin/env python3
 
 import json
+from functools import lru_cache
+
+
+@lru_cache(maxsize=4096)
+def compile_path(path: str) -> tuple:
+    """
+    Parse a dotted infoset path ('.state.usable_capacity') into a tuple of path elements. The result is cached so each
+    distinct path string is parsed only once and the same tuple is returned each time.
+    """
+    return tuple([ item for item in path.split('.') if item ])  # Skip empty path elements
+
+
+def _bump_version(method):
+    def wrapper(self, *args, **kwargs):
+        self.version += 1
+        return method(self, *args, **kwargs)
+    return wrapper
+
+
+class VersionedList(list):
+    """
+    A list counting its modifications, values computed from the list can be cached until the version changes.
+    Modifications of the items themselves are not tracked.
+    """
+    version = 0
+
+    append = _bump_version(list.append)
+    extend = _bump_version(list.extend)
+    insert = _bump_version(list.insert)
+    pop = _bump_version(list.pop)
+    remove = _bump_version(list.remove)
+    clear = _bump_version(list.clear)
+    sort = _bump_version(list.sort)
+    reverse = _bump_version(list.reverse)
+    __setitem__ = _bump_version(list.__setitem__)
+    __delitem__ = _bump_version(list.__delitem__)
+    __iadd__ = _bump_version(list.__iadd__)
+    __imul__ = _bump_version(list.__imul__)
 
 
 class Infoset(object):
+    # Counts the put() calls, modifications of fetched values are not tracked
+    version = 0
+
     def __init__(self, data=None, **kwargs):
         self._data = data or {}
 
@@ -24,16 +65,15 @@ class Infoset(object):
         return paths
 
     def _find(self, path, mkpath=False):
-        r = self.data
-        path = path.split('.')
-        while len(path) > 0:
-            if hasattr(r, '_find'):
-                # Delegate if we reached another infoset
-                return r._find('.'.join(path), mkpath=mkpath)
+        if isinstance(path, str):
+            path = compile_path(path)
 
-            item = path.pop(0)
-            if not item:  # Skip empty path elements
-                continue
+        r = self.data
+        for (i, item) in enumerate(path):
+            if type(r) is not dict and hasattr(r, '_find'):
+                # Delegate if we reached another infoset, other objects get the remaining path as a string
+                rest = path[i:]
+                return r._find(rest if isinstance(r, Infoset) else '.'.join(rest), mkpath=mkpath)
 
             if (item not in r) and mkpath:
                 r[item] = {}
@@ -43,13 +83,16 @@ class Infoset(object):
         return r
 
     def put(self, path, data):
-        p = path.split('.')
-        d = self._find('.'.join(p[:-1]), mkpath=True)
+        self.version += 1
+        if isinstance(path, str):
+            path = compile_path(path)
+
+        d = self._find(path[:-1], mkpath=True)
 
         if hasattr(d, 'put'):
-            d.put(p[-1], data)
+            d.put(path[-1:] if isinstance(d, Infoset) else path[-1], data)
         else:
-            d[ p[-1] ] = data
+            d[ path[-1] ] = data
 
     def fetch(self, path, default=None):
         try:
@@ -65,10 +108,14 @@ class Infoset(object):
         return json.dumps(self, default=_infoset_encoder, **kwargs)
 
 
+def bytes_repr(length):
+    return f'bytes(len={length})'
+
+
 def _infoset_encoder(v):
     if hasattr(v, 'fetch'):
         return v.fetch('.')
     elif isinstance(v, bytes):
-        return f'bytes(len={len(v)})'
+        return bytes_repr(len(v))
     else:
         raise TypeError(f"Object of type {v.__class__.__name__} is not serializable")
@@ -0,0 +1,777 @@
+#!/usr/bin/env python3
+
+import bisect
+import heapq
+import itertools
+import math
+import random
+import time
+
+from structlog import get_logger
+
+log = get_logger()
+
+# Running sums are recomputed from scratch after this many swaps to get rid of accumulated rounding errors
+REFRESH_INTERVAL = 10000
+
+# Default amount of iterations of each parallel chain before the chains are restarted from the best layout
+SHARE_INTERVAL = 20000
+
+
+class Score(object):
+    """
+    The string parameters compared by improved() and stop(), the same attributes are provided by the String class of
+    pack.py.
+    """
+    __slots__ = ('max_block_ir_stdev_pct', 'blocks_capa_stdev_pct')
+
+    def __init__(self, max_block_ir_stdev_pct, blocks_capa_stdev_pct):
+        self.max_block_ir_stdev_pct = max_block_ir_stdev_pct
+        self.blocks_capa_stdev_pct = blocks_capa_stdev_pct
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__} ir={self.max_block_ir_stdev_pct:.3f}% capa={self.blocks_capa_stdev_pct:.3f}%>'
+
+
+def improved(string_before, string_after):
+    """
+    Return True if the string_after has parameters better than string_before
+    """
+
+    if string_before.max_block_ir_stdev_pct > 15:
+        if string_after.max_block_ir_stdev_pct < string_before.max_block_ir_stdev_pct:
+            log.debug('max ir stdev for all blocks improved',
+                before=string_before.max_block_ir_stdev_pct, after=string_after.max_block_ir_stdev_pct)
+            return True
+
+    if string_before.blocks_capa_stdev_pct > 2:
+        if string_after.blocks_capa_stdev_pct < string_before.blocks_capa_stdev_pct:
+            log.debug('capa stdev between blocks improved',
+                before=string_before.blocks_capa_stdev_pct, after=string_after.blocks_capa_stdev_pct)
+            return True
+
+    return False
+
+
+def stop(string):
+    """
+    Return True if the string layout is good enough.
+    """
+
+    if string.max_block_ir_stdev_pct > 10:
+        # IR stdev in any block is > 10%
+        return False
+
+    if string.blocks_capa_stdev_pct > 1:
+        # Divergence between capacity of each block is > 1 %
+        return False
+
+    return True
+
+
+def cost(score) -> float:
+    """
+    A single number to minimize for strategies which need one: the capacity stdev between blocks plus the part of the
+    maximum IR stdev within blocks which is above the stop() limit, both in percent.
+    """
+    return score.blocks_capa_stdev_pct + max(score.max_block_ir_stdev_pct - 10, 0)
+
+
+def _stdev_pct(total, squares, n):
+    # Sample standard deviation relative to the mean, 0 for less than two values as in pack.py _calculate_statistics()
+    if n < 2 or total == 0:
+        return 0
+    variance = (squares - total * total / n) / (n - 1)
+    return math.sqrt(max(variance, 0)) / (total / n) * 100
+
+
+class Layout(object):
+    """
+    A string of S blocks of P cells chosen from a pool, kept as arrays of cell parameters. Position k of the pool order
+    belongs to block k % S if k < S * P, cells at further positions are not used. This is the round-robin assignment of
+    pack.py build_string().
+
+    Per block sums of capacity, IR and squared IR as well as the sums over blocks are updated when two positions are
+    swapped, only the two affected blocks are recomputed.
+    """
+
+    def __init__(self, capacity, ir, S: int, P: int):
+        # numpy is imported only when packing, the module is loaded by all commands through the strategy plugins
+        import numpy as np
+
+        self.capacity = np.asarray(capacity, dtype=float)
+        self.ir = np.asarray(ir, dtype=float)
+        self.S = S
+        self.P = min(P, len(self.capacity) // S)  # Blocks are filled only with complete rounds of S cells
+
+        # Python lists are faster than numpy arrays for the scalar accesses of single swaps
+        self._capacity = self.capacity.tolist()
+        self._ir = self.ir.tolist()
+
+        self.order = list(range(len(self.capacity)))
+        self.refresh()
+
+    def refresh(self):
+        # Recompute all sums from the cell parameters
+        import numpy as np
+
+        positions = np.asarray(self.order[:self.S * self.P], dtype=int).reshape(self.P, self.S)
+
+        self._block_capa = self.capacity[positions].sum(axis=0).tolist()
+        self._block_ir = self.ir[positions].sum(axis=0).tolist()
+        self._block_ir_squares = (self.ir[positions] ** 2).sum(axis=0).tolist()
+        self._block_ir_stdev_pct = [ _stdev_pct(self._block_ir[b], self._block_ir_squares[b], self.P) for b in range(self.S) ]
+
+        self._capa_total = sum(self._block_capa)
+        self._capa_squares = sum([ capa * capa for capa in self._block_capa ])
+        self._swaps = 0
+
+    def _replace(self, block, old, new):
+        # Update the sums of a block after the cell old was replaced by new
+        capa = self._block_capa[block]
+        new_capa = capa - self._capacity[old] + self._capacity[new]
+        self._capa_total += new_capa - capa
+        self._capa_squares += new_capa * new_capa - capa * capa
+        self._block_capa[block] = new_capa
+
+        (ir_old, ir_new) = (self._ir[old], self._ir[new])
+        self._block_ir[block] += ir_new - ir_old
+        self._block_ir_squares[block] += ir_new * ir_new - ir_old * ir_old
+        self._block_ir_stdev_pct[block] = _stdev_pct(self._block_ir[block], self._block_ir_squares[block], self.P)
+
+    def block(self, position: int):
+        # Return the block of a position, None if it is not used
+        return position % self.S if position < self.S * self.P else None
+
+    def swap(self, p1: int, p2: int):
+        (b1, b2) = (self.block(p1), self.block(p2))
+        (c1, c2) = (self.order[p1], self.order[p2])
+        self.order[p1], self.order[p2] = c2, c1
+
+        if b1 != b2:
+            if b1 is not None:
+                self._replace(b1, c1, c2)
+            if b2 is not None:
+                self._replace(b2, c2, c1)
+
+            self._swaps += 1
+            if self._swaps >= REFRESH_INTERVAL:
+                self.refresh()
+
+    def score(self) -> Score:
+        return Score(max(self._block_ir_stdev_pct) if self.S > 0 else 0, _stdev_pct(self._capa_total, self._capa_squares, self.S))
+
+    def blocks(self) -> list:
+        # Return the pool indices of the cells in each block, in the order of the pool
+        return [ self.order[b:self.S * self.P:self.S] for b in range(self.S) ]
+
+    def set_order(self, order: list):
+        self.order = list(order)
+        self.refresh()
+
+    def assign_lpt(self):
+        """
+        Replace the layout with a greedy capacity balancing partition: the S * P cells with the highest capacity are taken
+        in decreasing capacity order and each is added to the block with the lowest capacity sum which is not full yet
+        (Longest Processing Time first with a block size limit).
+        """
+        ranked = sorted(range(len(self.order)), key=lambda i: -self._capacity[i])
+        (used, spare) = (ranked[:self.S * self.P], ranked[self.S * self.P:])
+
+        blocks = [ [] for b in range(self.S) ]
+        heap = [ (0, b) for b in range(self.S) ]
+        for i in used:
+            (total, b) = heapq.heappop(heap)
+            blocks[b].append(i)
+            if len(blocks[b]) < self.P:
+                heapq.heappush(heap, (total + self._capacity[i], b))
+
+        self.set_order([ blocks[b][r] for r in range(self.P) for b in range(self.S) ] + spare)
+
+
+class Run(object):
+    """
+    The termination conditions shared by the optimization strategies: no improvement within config.optimizer_timeout
+    seconds or config.total_timeout seconds in total. Strategies also finish when stop() is True for their layout.
+
+    Improvements are reported with the progress every 2 seconds, on_improvement is called with the layout then.
+
+    The total timeout can be overridden with timeout and the run finishes after the given amount of iterations too.
+    Runs continuing a previous one start counting at start. Quiet runs log the progress and the timeouts only as debug
+    messages.
+    """
+
+    def __init__(self, config, on_improvement=None, iterations=None, timeout=None, start=0, quiet=False):
+        self.optimizer_timeout = config.optimizer_timeout
+        self.total_timeout = config.total_timeout if timeout is None else timeout
+        self.max_iterations = None if iterations is None else start + iterations
+        self.on_improvement = on_improvement
+        (self._info, self._warning) = (log.debug, log.debug) if quiet else (log.info, log.warning)
+
+        self.start = self.last_improvement = self.last_progress_report = time.time()
+        self.iterations = start
+        self.improvements = 0
+        self._unreported = None
+
+    def improvement(self, layout):
+        self.last_improvement = time.time()
+        self.improvements += 1
+        self._unreported = layout
+
+    def _report(self):
+        if self._unreported is not None:
+            self._info('improved string found', iterations=self.iterations, score=self._unreported.score())
+            if self.on_improvement:
+                self.on_improvement(self._unreported)
+            self._unreported = None
+
+    def finished(self, iterations=1) -> bool:
+        # Called once per iteration, return True when the strategy should finish
+        self.iterations += iterations
+
+        now = time.time()
+        if now - self.last_progress_report >= 2:
+            self.last_progress_report = now
+            self._report()
+            self._info('progress', iterations=self.iterations, improvements=self.improvements)
+
+        if (now - self.last_improvement > self.optimizer_timeout) or (now - self.start > self.total_timeout):
+            self._warning('optimizer timeout')
+            return True
+        if self.max_iterations is not None and self.iterations >= self.max_iterations:
+            return True
+        return False
+
+    def remaining(self) -> float:
+        # Seconds left until the total timeout
+        return self.total_timeout - (time.time() - self.start)
+
+
+# The strategy class, configuration and layout inherited by the forked chain processes
+_chain_setup = None
+
+
+def _chain(order, seed, start, iterations, timeout):
+    # Continue the optimization from the given order in a worker process
+    (strategy_class, config, layout) = _chain_setup
+
+    layout.set_order(order)
+    run = Run(config, iterations=iterations, timeout=timeout, start=start, quiet=True)
+    strategy_class(config=config, rng=random.Random(seed)).optimize(layout, run)
+    return (layout.order, layout.score(), run.iterations - start)
+
+
+def optimize(strategy_class, layout, config, run, jobs=1, seed=None):
+    """
+    Optimize the layout in place with a strategy using a random number generator seeded with seed, runs finishing
+    before the timeouts are reproducible when a seed is given. The optional initialize(layout) method of the strategy
+    prepares the starting layout, optimize(layout, run) improves it.
+
+    With jobs above 1 the strategy runs as that many independent chains in worker processes, each seeded differently.
+    After config.share_interval iterations the best layout of all chains is taken and all chains continue from it, the
+    optimization finishes when stop() is True for that layout, the run is finished or all chains finish early.
+    """
+    global _chain_setup
+
+    rng = random.Random(seed)
+    strategy = strategy_class(config=config, rng=rng)
+    if hasattr(strategy, 'initialize'):
+        strategy.initialize(layout)
+        run.improvement(layout)
+
+    if jobs <= 1:
+        strategy.optimize(layout, run)
+        return
+
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+
+    iterations = getattr(config, 'share_interval', None) or SHARE_INTERVAL
+    best = cost(layout.score())
+    log.debug('running parallel chains', jobs=jobs, iterations=iterations)
+
+    # The workers are forked so that they inherit the strategy plugins and a copy of the layout
+    _chain_setup = (strategy_class, config, layout)
+    with ProcessPoolExecutor(max_workers=jobs, mp_context=multiprocessing.get_context('fork')) as executor:
+        start = 0
+        while not stop(layout.score()):
+            # Seeds of the chains are drawn from the main generator, this keeps the whole run reproducible
+            futures = [ executor.submit(_chain, layout.order, rng.getrandbits(64), start, iterations, run.remaining()) for job in range(jobs) ]
+            results = [ future.result() for future in futures ]
+            start += iterations
+
+            # Chains which reached stop() are preferred, the lowest cost decides otherwise
+            (order, score, chain_iterations) = min(results, key=lambda result: (not stop(result[1]), cost(result[1])))
+            if stop(score) or cost(score) < best:
+                best = cost(score)
+                layout.set_order(order)
+                run.improvement(layout)
+
+            if run.finished(iterations=sum([ result[2] for result in results ])):
+                break
+
+            # Strategies which converged or timed out in all chains won't get further from the same layout
+            if all([ result[2] < iterations for result in results ]):
+                break
+
+
+def swap_descent(layout, run, rng=random, good_enough=stop):
+    """
+    Local search on the cost() of the layout: all swaps of a cell in a block with a cell in another block or an unused
+    cell are tried, a swap is kept if it decreases the cost. Passes are repeated until none of the swaps helps,
+    good_enough() is True for the score or the run is finished. The block positions are scanned in the random order given
+    by rng.
+    """
+    current = cost(layout.score())
+
+    used = layout.S * layout.P
+    improving = True
+    while improving and not good_enough(layout.score()):
+        improving = False
+
+        positions = list(range(used))
+        rng.shuffle(positions)
+        for p1 in positions:
+            for p2 in range(p1 + 1, len(layout.order)):
+                if layout.block(p1) == layout.block(p2):
+                    continue
+
+                layout.swap(p1, p2)
+                candidate = cost(layout.score())
+                if candidate < current - 1e-9:
+                    current = candidate
+                    improving = True
+                    run.improvement(layout)
+                else:
+                    layout.swap(p1, p2)
+
+                if run.finished():
+                    return
+
+            if good_enough(layout.score()):
+                return
+
+
+def _clamped_level(lo: list, hi: list, f, target: float) -> float:
+    # Return t with f(t) = target for a nondecreasing function f, linear between the bounds lo and hi of the values
+    points = sorted(lo + hi)
+    (i, j) = (0, len(points) - 1)
+    while j - i > 1:
+        m = (i + j) // 2
+        if f(points[m]) <= target:
+            i = m
+        else:
+            j = m
+
+    (a, b) = (points[i], points[j])
+    (fa, fb) = (f(a), f(b))
+    return a if fa == fb else min(max(a + (target - fa) * (b - a) / (fb - fa), a), b)
+
+
+def _min_stdev(lo: list, hi: list, total_lo: float, total_hi: float) -> float:
+    """
+    Return the lowest sample standard deviation of values x_b with lo_b <= x_b <= hi_b and their sum between total_lo
+    and total_hi. The values of the optimum are a level t clamped to their bounds, without the sum constraint t is the
+    mean of the values.
+    """
+    S = len(lo)
+    if S < 2:
+        return 0.0
+
+    # Sum of values clamped to t from the sorted bounds, values with hi_b < t are hi_b, the ones with lo_b > t are lo_b
+    (lo_sorted, hi_sorted) = (sorted(lo), sorted(hi))
+    (lo_prefix, hi_prefix) = (list(itertools.accumulate(lo_sorted, initial=0)), list(itertools.accumulate(hi_sorted, initial=0)))
+
+    def clamped_sum(t):
+        (below, above) = (bisect.bisect_left(hi_sorted, t), bisect.bisect_right(lo_sorted, t))
+        return hi_prefix[below] + lo_prefix[S] - lo_prefix[above] + t * (above - below)
+
+    (total_lo, total_hi) = (max(total_lo, sum(lo)), min(total_hi, sum(hi)))
+    if max(lo) <= min(hi):
+        # Equal values are possible, their sum is limited by the common range
+        if S * max(lo) <= total_hi and S * min(hi) >= total_lo:
+            return 0.0
+        t = max(lo) if S * max(lo) > total_hi else min(hi)
+    else:
+        # clamped_sum(t) - S * t is decreasing, S * t - clamped_sum(t) is the nondecreasing function to solve
+        t = _clamped_level(lo, hi, lambda t: S * t - clamped_sum(t), 0)
+    total = min(max(clamped_sum(t), total_lo), total_hi)
+    t = _clamped_level(lo, hi, clamped_sum, total)
+
+    x = [ min(max(t, l), h) for (l, h) in zip(lo, hi) ]
+    mean = sum(x) / S
+    return math.sqrt(sum([ (v - mean) ** 2 for v in x ]) / (S - 1))
+
+
+class BranchAndBound(object):
+    """
+    Exact minimization of the cost() of a layout by depth-first branch and bound. Cells are taken in decreasing capacity
+    order and put into one of the blocks which are not full yet or left unused, only the first of the empty blocks is
+    tried. Children are explored in the order of their lower bounds, the search starts from the better of the given
+    layout and the greedy partition improved by swap_descent() to a local optimum.
+
+    The lower bound of a partial assignment combines:
+
+        capacity    every block gets its missing cells from the remaining ones, so its final capacity lies between the
+                    sum with the smallest and the sum with the largest remaining cells, the same holds for the total.
+                    The lowest standard deviation of block capacities within these limits is divided by the highest
+                    possible mean.
+        IR          adding cells doesn't decrease the sum of squared deviations of IR in a block, the highest possible
+                    mean is reached by adding the remaining cell with the highest IR.
+
+    Subtrees with a lower bound within tolerance of the best cost are pruned. The search finishes early if the run is
+    finished, the lowest lower bound of the unexplored subtrees is kept in lower_bound so the optimality gap is known.
+    """
+
+    def __init__(self, layout, run, tolerance=0):
+        self.layout = layout
+        self.run = run
+        self.tolerance = tolerance
+        (S, P) = (layout.S, layout.P)
+
+        self.cells = sorted(range(len(layout.order)), key=lambda i: -layout._capacity[i])
+        self.capacity = [ layout._capacity[i] for i in self.cells ]
+        self.ir = [ layout._ir[i] for i in self.cells ]
+        self.spare = len(self.cells) - S * P
+
+        # Sums of capacity of the first k cells and the highest IR of the cells from k on
+        self._capa_prefix = [ 0.0 ]
+        for capa in self.capacity:
+            self._capa_prefix.append(self._capa_prefix[-1] + capa)
+        self._ir_suffix_max = [ 0.0 ] * (len(self.cells) + 1)
+        for k in reversed(range(len(self.cells))):
+            self._ir_suffix_max[k] = max(self.ir[k], self._ir_suffix_max[k + 1])
+
+        self._block_capa = [ 0.0 ] * S
+        self._block_count = [ 0 ] * S
+        self._block_ir = [ 0.0 ] * S
+        self._block_ir_squares = [ 0.0 ] * S
+        self._assignment = [ None ] * len(self.cells)
+        self._unused = 0
+
+        self.nodes = 0
+        self.aborted = False
+        self._frontier = []
+        self._pruned = math.inf
+
+    def _add(self, k, block, sign):
+        if block is None:
+            self._unused += sign
+            return
+        self._block_capa[block] += sign * self.capacity[k]
+        self._block_count[block] += sign
+        self._block_ir[block] += sign * self.ir[k]
+        self._block_ir_squares[block] += sign * self.ir[k] * self.ir[k]
+
+    def _bound(self, k):
+        # Lower bound of the cost with the first k cells assigned
+        (S, P, n) = (self.layout.S, self.layout.P, len(self.cells))
+        prefix = self._capa_prefix
+
+        (lo, hi) = ([], [])
+        for b in range(S):
+            missing = P - self._block_count[b]
+            lo.append(self._block_capa[b] + prefix[n] - prefix[n - missing])
+            hi.append(self._block_capa[b] + prefix[k + missing] - prefix[k])
+
+        # All blocks share the remaining cells, their total is limited too
+        missing = S * P - sum(self._block_count)
+        total = sum(self._block_capa)
+        (total_lo, total_hi) = (total + prefix[n] - prefix[n - missing], total + prefix[k + missing] - prefix[k])
+        capa_bound = _min_stdev(lo, hi, total_lo, total_hi) / (total_hi / S) * 100 if total_hi > 0 else 0
+
+        ir_bound = 0
+        for b in range(S):
+            count = self._block_count[b]
+            if count < 2:
+                continue
+            squares = self._block_ir_squares[b] - self._block_ir[b] * self._block_ir[b] / count
+            mean = (self._block_ir[b] + (P - count) * self._ir_suffix_max[k]) / P
+            if mean > 0:
+                ir_bound = max(ir_bound, math.sqrt(max(squares, 0) / (P - 1)) / mean * 100)
+
+        return capa_bound + max(ir_bound - 10, 0)
+
+    def _cost(self):
+        (S, P) = (self.layout.S, self.layout.P)
+        capa = _stdev_pct(sum(self._block_capa), sum([ c * c for c in self._block_capa ]), S)
+        ir = max([ _stdev_pct(self._block_ir[b], self._block_ir_squares[b], P) for b in range(S) ])
+        return capa + max(ir - 10, 0)
+
+    def _order(self, assignment):
+        # Layout order of an assignment of the sorted cells to blocks
+        (S, P) = (self.layout.S, self.layout.P)
+        blocks = [ [] for b in range(S) ]
+        unused = []
+        for (k, block) in enumerate(assignment):
+            (unused if block is None else blocks[block]).append(self.cells[k])
+        return [ blocks[b][r] for r in range(P) for b in range(S) ] + unused
+
+    def _search(self, k, bound):
+        self.nodes += 1
+        if self.run.finished():
+            self.aborted = True
+            self._frontier.append([ bound ])
+            return
+
+        if k == len(self.cells):
+            cost = self._cost()
+            if cost < self.best:
+                self.best = cost
+                self.layout.set_order(self._order(self._assignment))
+                self.run.improvement(self.layout)
+            return
+
+        children = []
+        empty = False
+        for b in range(self.layout.S):
+            if self._block_count[b] == self.layout.P:
+                continue
+            if self._block_count[b] == 0:
+                if empty:
+                    continue  # Empty blocks are interchangeable
+                empty = True
+            children.append(b)
+        if self._unused < self.spare:
+            children.append(None)
+
+        bounds = []
+        for block in children:
+            self._add(k, block, 1)
+            bounds.append( (self._bound(k + 1), block) )
+            self._add(k, block, -1)
+
+        # Equal bounds are common close to the root, the block with the lowest capacity comes first then as in assign_lpt()
+        bounds.sort(key=lambda item: (item[0], math.inf if item[1] is None else self._block_capa[item[1]]))
+
+        # The bounds of the children not explored yet
+        pending = [ bound for (bound, block) in bounds ]
+        self._frontier.append(pending)
+        for (bound, block) in bounds:
+            pending.pop(0)
+            if bound >= self.best - self.tolerance:
+                self._pruned = min(self._pruned, bound)
+                break
+
+            self._add(k, block, 1)
+            self._assignment[k] = block
+            self._search(k + 1, bound)
+            self._add(k, block, -1)
+
+            if self.aborted:
+                pending.insert(0, bound)  # Not fully explored
+                return
+        self._frontier.pop()
+
+    def solve(self):
+        """
+        Set the layout to the best one found, return its cost and the lower bound of the optimal cost.
+        """
+        self.best = cost(self.layout.score())
+        if self.layout.S * self.layout.P == 0:
+            return (self.best, self.best)
+
+        greedy = Layout(self.layout.capacity, self.layout.ir, self.layout.S, self.layout.P)
+        greedy.assign_lpt()
+        swap_descent(greedy, self.run, good_enough=lambda score: False)
+        if cost(greedy.score()) < self.best:
+            self.best = cost(greedy.score())
+            self.layout.set_order(greedy.order)
+            self.run.improvement(self.layout)
+
+        self._search(0, self._bound(0))
+
+        self.lower_bound = min([ self.best, self._pruned ] + [ bound for pending in self._frontier for bound in pending ])
+        log.info('exact search finished', nodes=self.nodes, complete=not self.aborted, cost=self.best, lower_bound=self.lower_bound)
+        return (self.best, self.lower_bound)
+
+
+# Maximum amount of points in the leaves of a KDTree
+LEAF_SIZE = 16
+
+
+class KDTree(object):
+    """
+    A k-d tree of points supporting removal, distances are measured in the L1 (Manhattan) metric. Features which should
+    be weighted need to be scaled before, e.g. (capacity, 1.5 * IR) for the pack.py replace command.
+
+    Nodes are split at the median of the coordinate with the largest spread. Each node keeps the bounding box of its
+    points and the amount of points not removed yet, subtrees without points or with a bounding box further than the
+    current k-th nearest point are skipped by nearest(). Removed points are only marked, the boxes are not shrunk.
+    """
+
+    def __init__(self, points, leaf_size=None):
+        import numpy as np
+
+        self.points = np.asarray(points, dtype=float).reshape(len(points), -1) if len(points) > 0 else np.empty((0, 0))
+        self.leaf_size = leaf_size or LEAF_SIZE
+        self._coords = self.points.tolist()
+        self._removed = [ False ] * len(self.points)
+
+        # Node arrays, leaves have no children and own the points _indices[_start:_end]
+        (self._start, self._end, self._left, self._right, self._parent) = ([], [], [], [], [])
+        (self._low, self._high, self._count) = ([], [], [])
+        self._leaf = [ None ] * len(self.points)
+
+        self._indices = np.arange(len(self.points))
+        if len(self.points) > 0:
+            self._build(0, len(self.points), None)
+        self._indices = self._indices.tolist()
+
+    def _build(self, start, end, parent):
+        node = len(self._start)
+        points = self.points[self._indices[start:end]]
+        self._start.append(start)
+        self._end.append(end)
+        self._left.append(None)
+        self._right.append(None)
+        self._parent.append(parent)
+        self._low.append(points.min(axis=0).tolist())
+        self._high.append(points.max(axis=0).tolist())
+        self._count.append(end - start)
+
+        if end - start <= self.leaf_size:
+            for i in self._indices[start:end]:
+                self._leaf[i] = node
+            return node
+
+        axis = int((points.max(axis=0) - points.min(axis=0)).argmax())
+        middle = (end - start) // 2
+        self._indices[start:end] = self._indices[start:end][points[:, axis].argpartition(middle)]
+
+        self._left[node] = self._build(start, start + middle, node)
+        self._right[node] = self._build(start + middle, end, node)
+        return node
+
+    def __len__(self):
+        return self._count[0] if len(self._count) > 0 else 0
+
+    def remove(self, index: int):
+        if self._removed[index]:
+            return
+        self._removed[index] = True
+
+        node = self._leaf[index]
+        while node is not None:
+            self._count[node] -= 1
+            node = self._parent[node]
+
+    def _box_distance(self, node, point):
+        d = 0
+        for (x, low, high) in zip(point, self._low[node], self._high[node]):
+            if x < low:
+                d += low - x
+            elif x > high:
+                d += x - high
+        return d
+
+    def nearest(self, point, k=1) -> list:
+        """
+        Return up to k (distance, index) tuples of the nearest points not removed, sorted by distance and index.
+        """
+        point = [ float(x) for x in point ]
+        found = []  # Max-heap of (-distance, -index) of the k best points so far
+        if len(self) == 0:
+            return []
+
+        def visit(node):
+            if self._count[node] == 0:
+                return
+            if len(found) == k and self._box_distance(node, point) > -found[0][0]:
+                return
+
+            if self._left[node] is None:
+                for i in self._indices[self._start[node]:self._end[node]]:
+                    if self._removed[i]:
+                        continue
+                    d = sum([ abs(a - b) for (a, b) in zip(self._coords[i], point) ])
+                    if len(found) < k:
+                        heapq.heappush(found, (-d, -i))
+                    elif (-d, -i) > found[0]:
+                        heapq.heapreplace(found, (-d, -i))
+                return
+
+            # The child closer to the point first
+            children = (self._left[node], self._right[node])
+            if self._box_distance(children[1], point) < self._box_distance(children[0], point):
+                children = children[::-1]
+            for child in children:
+                visit(child)
+
+        visit(0)
+        return sorted([ (-d, -i) for (d, i) in found ])
+
+
+def assign(costs) -> list:
+    """
+    Solve the assignment problem for a matrix of costs with at most as many rows as columns using the Hungarian algorithm
+    (shortest augmenting paths with potentials, O(rows^2 * columns)). Return the column assigned to each row, the sum
+    of the costs of the assigned cells is minimal and no column is assigned twice.
+    """
+    costs = [ list(row) for row in costs ]
+    n = len(costs)
+    if n == 0:
+        return []
+    m = len(costs[0])
+    if n > m:
+        raise ValueError(f'more rows than columns ({n} > {m})')
+
+    # Rows and columns are numbered from 1, column 0 is the virtual start of each augmenting path
+    (u, v) = ([ 0.0 ] * (n + 1), [ 0.0 ] * (m + 1))
+    row_of = [ 0 ] * (m + 1)
+    way = [ 0 ] * (m + 1)
+    for row in range(1, n + 1):
+        row_of[0] = row
+        column = 0
+        minimum = [ math.inf ] * (m + 1)
+        used = [ False ] * (m + 1)
+        while True:
+            used[column] = True
+            (r, delta, next_column) = (row_of[column], math.inf, None)
+            for j in range(1, m + 1):
+                if used[j]:
+                    continue
+                reduced = costs[r - 1][j - 1] - u[r] - v[j]
+                if reduced < minimum[j]:
+                    (minimum[j], way[j]) = (reduced, column)
+                if minimum[j] < delta:
+                    (delta, next_column) = (minimum[j], j)
+
+            for j in range(m + 1):
+                if used[j]:
+                    u[row_of[j]] += delta
+                    v[j] -= delta
+                else:
+                    minimum[j] -= delta
+            column = next_column
+            if row_of[column] == 0:
+                break
+
+        # Flip the augmenting path
+        while column != 0:
+            previous = way[column]
+            row_of[column] = row_of[previous]
+            column = previous
+
+    assignment = [ None ] * n
+    for j in range(1, m + 1):
+        if row_of[j] != 0:
+            assignment[row_of[j] - 1] = j - 1
+    return assignment
+
+
+def match(tree, points) -> list:
+    """
+    Return the indices of distinct points of the tree matched to the given points so that the sum of distances is
+    minimal. Only the len(points) nearest tree points of each point are candidates, another point is never needed: one
+    of them is always left unused by the others.
+    """
+    if len(points) > len(tree):
+        raise ValueError(f'not enough points in the tree ({len(points)} > {len(tree)})')
+
+    import numpy as np
+
+    candidates = sorted({ i for point in points for (d, i) in tree.nearest(point, k=len(points)) })
+    coords = tree.points[candidates]
+    costs = [ np.abs(coords - np.asarray(point, dtype=float)).sum(axis=1).tolist() for point in points ]
+    return [ candidates[column] for column in assign(costs) ]
@@ -1,11 +1,20 @@
+import hashlib
 import importlib
+import json
+import os
 import pkgutil
 import structlog
 
 import secondlife.plugins
+from secondlife.plugins.api import v1
 
 log = structlog.get_logger()
 
+# Plugin modules imported so far, most are imported only when one of their codewords is used
+loaded_plugins = dict()
+
+MANIFEST_VERSION = 1
+
 
 # Reference: https://packaging.python.org/guides/creating-and-discovering-plugins/
 def iter_namespace(ns_pkg):
@@ -16,15 +25,92 @@ def iter_namespace(ns_pkg):
     return pkgutil.iter_modules(ns_pkg.__path__, ns_pkg.__name__ + ".")
 
 
-def load_plugins(plugin_namespace=secondlife.plugins):
-    global loaded_plugins
+def _manifest_filename(plugin_namespace):
+    from xdg import XDG_CACHE_HOME
+
+    key = hashlib.sha1(json.dumps([ plugin_namespace.__name__ ] + list(plugin_namespace.__path__)).encode()).hexdigest()[:16]
+    return XDG_CACHE_HOME / 'secondlife' / 'plugin-manifest' / f'{key}.json'
+
+
+def _source_signature(plugin_namespace) -> list:
+    # The manifest is rebuilt when any file in the namespace is added, removed or modified
+    signature = []
+    for path in plugin_namespace.__path__:
+        for (dirpath, dirnames, filenames) in os.walk(path):
+            dirnames[:] = sorted([ d for d in dirnames if d != '__pycache__' ])
+            for filename in sorted(filenames):
+                if filename.endswith('.py'):
+                    st = os.stat(os.path.join(dirpath, filename))
+                    signature.append( (os.path.join(dirpath, filename), st.st_mtime_ns, st.st_size) )
+    return signature
+
+
+def build_manifest(plugin_namespace=secondlife.plugins) -> dict:
+    """
+    Import all plugin modules of the namespace and record which codewords each of them registers.
+    """
+    registrations = { registry: [] for registry in v1.REGISTRIES }
+
+    for finder, name, ispkg in iter_namespace(plugin_namespace):
+        before = { registry: set(getattr(v1, registry).keys()) for registry in v1.REGISTRIES }
+        loaded_plugins[name] = importlib.import_module(name)
+
+        for registry in v1.REGISTRIES:
+            registrations[registry].extend([ (codeword, name) for codeword in getattr(v1, registry).keys()
+                                             if codeword not in before[registry] ])
 
+    return dict(version=MANIFEST_VERSION, registrations=registrations)
+
+
+def _read_manifest(filename, signature):
+    try:
+        with open(filename) as f:
+            cached = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    if cached.get('signature') != json.loads(json.dumps(signature)) or cached.get('manifest', {}).get('version') != MANIFEST_VERSION:
+        return None
+    return cached['manifest']
+
+
+def _write_manifest(filename, signature, manifest):
+    try:
+        filename.parent.mkdir(parents=True, exist_ok=True)
+        tmp = filename.with_suffix(f'.{os.getpid()}.tmp')
+        with open(tmp, 'w') as f:
+            json.dump(dict(signature=signature, manifest=manifest), f)
+        os.replace(tmp, filename)
+    except OSError as e:
+        log.debug('cannot store plugin manifest', filename=filename, _exc_info=e)
+
+
+def load_plugins(plugin_namespace=secondlife.plugins):
+    """
+    Register the plugins of the namespace. The codewords registered by each plugin module are cached in a manifest, when
+    it is up to date the modules are only declared in the registries and imported when one of their codewords is used.
+    Otherwise all modules are imported and the manifest is rebuilt. Set SECONDLIFE_PLUGIN_MANIFEST=0 to always import
+    all modules.
+    """
     log.info('loading plugins', namespace=plugin_namespace)
 
-    loaded_plugins = {
-        name: importlib.import_module(name)
-        for finder, name, ispkg
-        in iter_namespace(plugin_namespace)
-    }
+    if os.getenv('SECONDLIFE_PLUGIN_MANIFEST', '1') == '0':
+        build_manifest(plugin_namespace)
+        log.debug('loaded plugins', plugins=loaded_plugins)
+        return
+
+    filename = _manifest_filename(plugin_namespace)
+    signature = _source_signature(plugin_namespace)
+
+    manifest = _read_manifest(filename, signature)
+    if manifest is None:
+        log.debug('building plugin manifest', filename=filename)
+        manifest = build_manifest(plugin_namespace)
+        _write_manifest(filename, signature, manifest)
+        log.debug('loaded plugins', plugins=loaded_plugins)
+        return
 
-    log.debug('loaded plugins', plugins=loaded_plugins)
+    for (registry, entries) in manifest['registrations'].items():
+        for (codeword, module) in entries:
+            getattr(v1, registry).declare(codeword, module)
+    log.debug('declared plugins', registrations=manifest['registrations'])
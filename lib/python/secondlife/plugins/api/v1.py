@@ -1,5 +1,8 @@
 #!/usr/bin/env python3
 
+import importlib
+from collections.abc import MutableMapping
+
 
 class Measurement(object):
     def __init__(self, codeword, handler_class, **kwargs):
@@ -14,12 +17,67 @@ class Report(object):
         self.default_enable = kwargs.get('default_enable', False)
 
 
-measurements = dict()
-reports = dict()
-state_vars = dict()
-celldb_backends = dict()
-infoset_transforms = dict()
-config_groups = dict()
+class _Declared(object):
+    # Placeholder for a registry entry of a plugin module which has not been imported yet
+    def __init__(self, module):
+        self.module = module
+
+
+class Registry(MutableMapping):
+    """
+    Maps codewords to plugin objects. Entries can be declared with the name of the module registering them, the module
+    is imported when the entry is first looked up. Listing the codewords doesn't import anything.
+    """
+
+    def __init__(self):
+        self._entries = dict()
+
+    def declare(self, codeword, module):
+        if codeword not in self._entries:
+            self._entries[codeword] = _Declared(module)
+
+    def __getitem__(self, codeword):
+        entry = self._entries[codeword]
+        if isinstance(entry, _Declared):
+            importlib.import_module(entry.module)
+            entry = self._entries[codeword]
+            if isinstance(entry, _Declared):
+                raise KeyError(f'{codeword} not registered by {entry.module}')
+        return entry
+
+    def __setitem__(self, codeword, value):
+        self._entries[codeword] = value
+
+    def __delitem__(self, codeword):
+        del self._entries[codeword]
+
+    def __contains__(self, codeword):
+        return codeword in self._entries
+
+    def __iter__(self):
+        return iter(list(self._entries))
+
+    def __len__(self):
+        return len(self._entries)
+
+    def clear(self):
+        self._entries.clear()
+
+    def copy(self):
+        # Shallow copy which doesn't import declared entries, used by unittest.mock.patch.dict()
+        return dict(self._entries)
+
+
+measurements = Registry()
+reports = Registry()
+state_vars = Registry()
+celldb_backends = Registry()
+infoset_transforms = Registry()
+strategies = Registry()
+config_groups = Registry()
+
+# Names of the registries above, used by the plugin manifest
+REGISTRIES = [ 'measurements', 'reports', 'state_vars', 'celldb_backends', 'infoset_transforms', 'strategies', 'config_groups' ]
 
 
 def register_measurement(measurement):
@@ -42,5 +100,9 @@ def register_infoset_transform(codeword, transform_class):
     infoset_transforms[codeword] = transform_class
 
 
+def register_strategy(codeword, strategy_class):
+    strategies[codeword] = strategy_class
+
+
 def register_config_group(codeword, callback):
     config_groups[codeword] = callback
@@ -1,8 +1,10 @@
 #!/usr/bin/env python3
 
 from secondlife.plugins.api import v1
+from secondlife.units import normalize
 from structlog import get_logger
-import tabulate
+
+from secondlife.cli.report import ReportTable
 
 
 class CapacityReport(object):
@@ -10,7 +12,7 @@ class CapacityReport(object):
     def __init__(self, **kwargs):
         self.config = kwargs['config']
         self.log = get_logger(name=__class__.__name__)
-        self.data = {}
+        self.table = ReportTable('capacity', ['Cell ID', 'Capacity [mAh]'], self.config, unique=True)
 
     def process_cell(self, infoset):
         log = self.log.bind(id=infoset.fetch('.id'))
@@ -18,18 +20,21 @@ class CapacityReport(object):
 
         usable_capacity = infoset.fetch('.state.usable_capacity')
         if usable_capacity is not None:
-            self.data[infoset.fetch('.id')] = usable_capacity
+            self.table.add( (infoset.fetch('.id'), float(usable_capacity['v'])) )
         else:
             log.debug('no capacity measurement')
 
+    def __getstate__(self):
+        # Only the collected rows are sent back from info.py --jobs workers
+        return dict(table=self.table)
+
+    def merge(self, other):
+        self.table.merge(other.table)
+
     def report(self, format='ascii'):
         if format == 'ascii':
-            if len(self.data.keys()) > 0:
-                print(
-                    tabulate.tabulate([ (id, float(capacity['v'])) for (id, capacity) in self.data.items() ],
-                                      headers=['Cell ID', 'Capacity [mAh]'],
-                                      tablefmt='fancy_grid')
-                )
+            if self.table.count > 0:
+                self.table.close()
             else:
                 self.log.warning('no data')
         else:
@@ -45,7 +50,9 @@ class UsableCapacity(object):
             measurement_log = self._cell.fetch('.log')
 
             capacity_measurement = next(filter(lambda m: 'capacity' in m.get('results', {}), measurement_log))
-            return capacity_measurement['results']['capacity']
+
+            # Always represented in mAh, the log entry itself is left as it is
+            return normalize(capacity_measurement['results']['capacity'], 'mAh')
         except StopIteration:
             return None
 
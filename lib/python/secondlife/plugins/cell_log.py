@@ -7,6 +7,8 @@ import tabulate
 import json
 import time
 
+from secondlife.cli.report import ReportSections
+
 # We care only about hour level accuracy
 _attrs = ['years', 'months', 'days', 'hours']
 
@@ -53,7 +55,7 @@ class LogReport(object):
     def __init__(self, **kwargs):
         self.config = kwargs['config']
         self.log = get_logger(name=__class__.__name__)
-        self.cells = dict()
+        self.sections = ReportSections('log', self.config, unique=True)
 
     def process_cell(self, infoset):
         log = self.log.bind(id=infoset.fetch('.id'))
@@ -63,7 +65,7 @@ class LogReport(object):
 
         log.debug('measurement log', log=measurement_log)
 
-        self.cells[infoset.fetch('.id')] = [
+        rows = [
             [
                 _since_now(m.get('ts')),
                 m.get('type', 'NO TYPE CODE'),
@@ -73,15 +75,23 @@ class LogReport(object):
             ] for m in measurement_log
         ]
 
+        if len(rows) > 0:
+            text = tabulate.tabulate(rows, headers=['Timestamp', 'Type', 'Event', 'Equipment', 'Data'], tablefmt='fancy_grid')
+        else:
+            text = "LOG EMPTY"
+        self.sections.add(f"Log for {infoset.fetch('.id')}", text)
+
+    def __getstate__(self):
+        # Only the collected sections are sent back from info.py --jobs workers
+        return dict(sections=self.sections)
+
+    def merge(self, other):
+        self.sections.merge(other.sections)
+
     def report(self):
 
-        if len(self.cells.items()) > 0:
-            for (id, rows) in self.cells.items():
-                print(f"=== Log for {id}")
-                if len(rows) > 0:
-                    print( tabulate.tabulate(rows, headers=['Timestamp', 'Type', 'Event', 'Equipment', 'Data'], tablefmt='fancy_grid') )
-                else:
-                    print("LOG EMPTY")
+        if self.sections.count > 0:
+            self.sections.close()
         else:
             self.log.warning('no data')
 
@@ -10,8 +10,13 @@ import sys
 import jq
 import argparse
 
+from secondlife.cli.report import ReportTable
+
 log = structlog.get_logger()
 
+# Amount of cells whose log paths are validated together
+CHECK_PATHS_BATCH_SIZE = 1000
+
 
 def _check_log_units(log):
     for entry in log:
@@ -48,24 +53,31 @@ def _count_mcc_workflows(log):
     return count
 
 
-def _check_paths(backend, infoset):
+def _log_paths(infoset):
+    # Return all paths referenced in the log, None if an invalid path entry is present
+    paths = []
     for e in infoset.fetch('.log'):
         if 'path' in e:
             p = e['path']
             if p is None:
-                return False
+                return None
 
             if hasattr(p, 'values'):
                 if 'old' in p:
-                    if not backend.path_valid(p['old']):
-                        return False
+                    paths.append(p['old'])
                 if 'new' in p:
-                    if not backend.path_valid(p['new']):
-                        return False
+                    paths.append(p['new'])
             else:
-                if not backend.path_valid(p):
-                    return False
-    return True
+                paths.append(p)
+    return paths
+
+
+def _check_paths(backend, infoset):
+    paths = _log_paths(infoset)
+    if paths is None:
+        return False
+
+    return all(backend.paths_valid(paths))
 
 
 def _check_log_ir_spelling(infoset):
@@ -104,33 +116,69 @@ class CheckerReport(object):
         self.config = kwargs['config']
         self.backend = kwargs.get('backend', None)
         self.log = get_logger(name=__class__.__name__)
-        self.cells = defaultdict(list)
+        self.table = ReportTable('checker', ['Cell ID', 'Failed checks'], self.config, unique=True)
         self.codewords = self.config.checker_codewords
 
+        # Cells waiting for their log paths to be validated in a single batch
+        self.pending = dict()
+
         if self.codewords is None:
             self.codewords = checks.keys()
+        self.codewords = list(self.codewords)
 
     def process_cell(self, infoset):
         cell_id = infoset.fetch('.id')
         log = self.log.bind(id=cell_id)
         log.debug('processing cell', check_codewords=self.codewords)
 
+        failed = []
+        paths = []
         for codeword in self.codewords:
+            if codeword == 'paths_invalid':
+                paths = _log_paths(infoset)
+                if paths is None:
+                    failed.append(codeword)
+                    paths = []
+                continue
+
             if checks[codeword](backend=self.backend, infoset=infoset) is False:
-                self.cells[cell_id].append(codeword)
+                failed.append(codeword)
+
+        if 'paths_invalid' in self.codewords:
+            self.pending[cell_id] = (failed, paths)
+            if len(self.pending) >= CHECK_PATHS_BATCH_SIZE:
+                self._check_log_paths()
+        elif len(failed) > 0:
+            self.table.add( (cell_id, ','.join(failed)), key=cell_id )
+
+    def _check_log_paths(self):
+        paths = list({ path for (failed, cell_paths) in self.pending.values() for path in cell_paths })
+        self.log.debug('validating log paths', count=len(paths))
+        valid = dict(zip(paths, self.backend.paths_valid(paths)))
+
+        for (cell_id, (failed, cell_paths)) in self.pending.items():
+            if not all([ valid[path] for path in cell_paths ]):
+                failed.append('paths_invalid')
+                # Keep the failed checks in the order they were selected
+                failed.sort(key=self.codewords.index)
+
+            if len(failed) > 0:
+                self.table.add( (cell_id, ','.join(failed)), key=cell_id )
+
+        self.pending = dict()
 
     def report(self, format='ascii'):
         if format != 'ascii':
             log.error('unknown report format', format=format)
             return
 
-        if len(self.cells.items()) == 0:
+        self._check_log_paths()
+
+        if self.table.count == 0:
             self.log.warning('no data')
             return
 
-        print( tabulate.tabulate([ (id, ','.join(self.cells[id])) for id in sorted(self.cells.keys()) ],
-                              headers=['Cell ID', 'Failed checks'],
-                              tablefmt='fancy_grid') )
+        self.table.close()
 
 
 def _config_group(parser):
@@ -3,14 +3,13 @@
 from secondlife.plugins.api import v1
 from structlog import get_logger
 import tabulate
-import json
 from collections import defaultdict
 import structlog
 import sys
 import jq
 import argparse
 
-from secondlife.cli.utils import CompileJQ, CompileJQAndAppend
+from secondlife.cli.utils import CompileJQ, CompileJQAndAppend, JQBatch, cell_json
 
 log = structlog.get_logger()
 
@@ -21,21 +20,27 @@ class GroupsReport(object):
         self.config = kwargs['config']
         self.log = get_logger(name=__class__.__name__)
         self.cells = defaultdict(int)
+        self.key_queries = JQBatch(self.config.key_queries)
 
     def process_cell(self, infoset):
         log = self.log.bind(id=infoset.fetch('.id'))
         log.debug('processing cell')
 
         k = []
-        json_text = infoset.to_json(indent=2)
-
-        for query in self.config.key_queries:
-            result = query.input(text=json_text).text()
+        for (query, result) in zip(self.config.key_queries, self.key_queries.text(cell_json(infoset))):
             k.append( result )
             log.debug('jq query result', id=infoset.fetch('.id'), result=result, query=query)
 
         self.cells[tuple(k)] += 1
 
+    def __getstate__(self):
+        # Only the group counts are sent back from info.py --jobs workers
+        return dict(cells=self.cells)
+
+    def merge(self, other):
+        for (key, count) in other.cells.items():
+            self.cells[key] += count
+
     def report(self, format='ascii'):
         if format != 'ascii':
             log.error('unknown report format', format=format)
@@ -10,7 +10,8 @@ import sys
 import jq
 import argparse
 
-from secondlife.cli.utils import CompileJQAndAppend
+from secondlife.cli.utils import CompileJQAndAppend, JQBatch, cell_json
+from secondlife.cli.report import ReportTable, ReportSections
 
 log = structlog.get_logger()
 
@@ -20,51 +21,58 @@ class InfosetReport(object):
     def __init__(self, **kwargs):
         self.config = kwargs['config']
         self.log = get_logger(name=__class__.__name__)
-        self.cells = defaultdict(list)
-        self.sort_results = dict()
         if len(self.config.sort_queries) > 0:
             self.sort_queries = self.config.sort_queries
         else:
             self.sort_queries = [ jq.compile('.id') ]
 
+        # Sort and infoset queries are evaluated together
+        self.queries = JQBatch(self.sort_queries + self.config.infoset_queries)
+
+        # Streamed rows are sorted only if a sort query was given
+        self.table = ReportTable('infoset', ['.id'] + [ query.program_string for query in self.config.infoset_queries ],
+                                 self.config, ordered=len(self.config.sort_queries) > 0, unique=True)
+        self.sections = ReportSections('infoset', self.config, unique=True)
+
     def process_cell(self, infoset):
         cell_id = infoset.fetch('.id')
         log = self.log.bind(id=cell_id)
         log.debug('processing cell')
 
-        json_text = infoset.to_json(indent=2)
-        self.sort_results[ cell_id ] = [ sort_query.input(text=json_text).first() for sort_query in self.sort_queries ]
-
         if len(self.config.infoset_queries) > 0:
             # Apply the jq queries if defined
-            for query in self.config.infoset_queries:
-                result = query.input(text=json_text).first()
-                if result is None:
-                    result = 'null'
-                self.cells[ cell_id ].append( result )
+            results = self.queries.first(cell_json(infoset))
+            row = [ cell_id ]
+            for (query, result) in zip(self.config.infoset_queries, results[len(self.sort_queries):]):
+                if self.table.output.format == 'ascii':
+                    # Text output, other formats keep the JSON values
+                    result = 'null' if result is None else str(result)
+                row.append( result )
                 log.debug('jq query result', id=cell_id, result=result, query=query)
+
+            self.table.add(row, key=results[:len(self.sort_queries)])
         else:
-            self.cells[ cell_id ] = [ json_text ]
+            self.sections.add(f"Infoset for {cell_id}", infoset.to_json(indent=2))
+
+    def __getstate__(self):
+        # Only the collected rows are sent back from info.py --jobs workers
+        return dict(table=self.table, sections=self.sections)
+
+    def merge(self, other):
+        self.table.merge(other.table)
+        self.sections.merge(other.sections)
 
     def report(self, format='ascii'):
         if format != 'ascii':
             log.error('unknown report format', format=format)
             return
 
-        if len(self.cells.items()) == 0:
+        if self.table.count + self.sections.count == 0:
             self.log.warning('no data')
             return
 
-        if len(self.config.infoset_queries) > 0:
-            print(
-                tabulate.tabulate([ [id] + [ str(result) for result in self.cells[id] ] for id in sorted(self.cells.keys(), key=lambda key: self.sort_results[key]) ],  # noqa
-                                  headers=['.id'] + [ query.program_string for query in self.config.infoset_queries ],
-                                  tablefmt='fancy_grid')
-            )
-        else:
-            for (id, item) in self.cells.items():
-                print(f"=== Infoset for {id}")
-                print(item[0])
+        self.table.close()
+        self.sections.close()
 
 
 def _config_group(parser):
@@ -1,13 +1,12 @@
 #!/usr/bin/env python3
 
 from secondlife.plugins.api import v1
+from secondlife.units import normalize
 from structlog import get_logger
 from dateutil.relativedelta import relativedelta
-import tabulate
 import json
-import pint
 
-ureg = pint.UnitRegistry(case_sensitive=False)
+from secondlife.cli.report import ReportTable
 
 
 class InternalResistanceReport(object):
@@ -15,7 +14,7 @@ class InternalResistanceReport(object):
     def __init__(self, **kwargs):
         self.config = kwargs['config']
         self.log = get_logger(name=__class__.__name__)
-        self.data = {}
+        self.table = ReportTable('ir', ['Cell ID', 'IR [mΩ]'], self.config, unique=True)
 
     def process_cell(self, infoset):
         log = self.log.bind(id=infoset.fetch('.id'))
@@ -23,16 +22,21 @@ class InternalResistanceReport(object):
 
         internal_resistance = infoset.fetch('.state.internal_resistance')
         if internal_resistance is not None:
-            self.data[infoset.fetch('.id')] = internal_resistance
+            self.table.add( (infoset.fetch('.id'), float(internal_resistance['v'])) )
         else:
             log.debug('no IR measurement')
 
+    def __getstate__(self):
+        # Only the collected rows are sent back from info.py --jobs workers
+        return dict(table=self.table)
+
+    def merge(self, other):
+        self.table.merge(other.table)
+
     def report(self, format='ascii'):
         if format == 'ascii':
-            if len(self.data.keys()) > 0:
-                print( tabulate.tabulate([ (id, float(ir['v'])) for (id, ir) in self.data.items() ],
-                                      headers=['Cell ID', 'IR [mΩ]'],
-                                      tablefmt='fancy_grid') )
+            if self.table.count > 0:
+                self.table.close()
             else:
                 self.log.warning('no data')
         else:
@@ -56,13 +60,8 @@ class InternalResistance(object):
             else:
                 last_measurement = ir_measurements[-1]  # Last measurement is the newest one
 
-            # Convert to alway be represented in milliohms
-            ir_measurement = last_measurement['results']['IR']
-            ir_quantity = ir_measurement['v'] * ureg.parse_units(ir_measurement['u'])
-            ir_measurement['u'] = 'mOhm'
-            ir_measurement['v'] = ir_quantity.to('mOhm').magnitude
-
-            return ir_measurement
+            # Convert to alway be represented in milliohms, the log entry itself is left as it is
+            return normalize(last_measurement['results']['IR'], 'mOhm')
         except Exception as e:
             return None
 
@@ -1,14 +1,18 @@
 #!/usr/bin/env python3
 
 from pathlib import Path
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 import json
+import os
 import shutil
 import time
 
 from structlog import get_logger
 from secondlife.plugins.api import v1
 from secondlife.infoset import Infoset
-from secondlife.celldb import CellDB
+from secondlife.celldb import CellDB, LazyExtra, bind_state_vars, _normalized_path
+from secondlife import predicate
 
 
 class JsonFiles(CellDB):
@@ -21,30 +25,124 @@ class JsonFiles(CellDB):
         else:
             self.basepath = Path().resolve(strict=True)
 
+        self.workers = getattr(kwargs.get('config'), 'json_files_workers', 1)
+
+        # The id -> location index is loaded lazily on first lookup
+        self.index_filename = self.basepath.joinpath(JsonFiles.INDEX_FILENAME)
+        self._index = None
+        self._index_offset = 0
+        self._index_complete = False
+
         self.log.debug('backend setup', basepath=self.basepath)
 
+    # Maximum amount of cells being loaded in advance by each worker in find()
+    PREFETCH_PER_WORKER = 4
+
+    # The index is an append-only journal of JSON lines, one line per stored cell location.
+    # Later lines override earlier ones, reindex() compacts the journal.
+    INDEX_FILENAME = '.index.jsonl'
+
     def init(self):
         self.log.info('creating celldb', basepath=self.basepath)
 
         Path(self.basepath).mkdir(exist_ok=True)
+        self.index_filename.touch(exist_ok=True)
 
     def __repr__(self):
         return f'JsonFiles/{repr(self.basepath)}'
 
+    def _refresh_index(self):
+        if self._index is None:
+            self._index = dict()
+            self._index_offset = 0
+
+        # Read journal entries appended since the last refresh (possibly by other processes)
+        try:
+            with open(self.index_filename, 'r', encoding='utf8') as f:
+                f.seek(self._index_offset)
+                for line in f:
+                    if not line.endswith('\n'):
+                        break  # Partially written entry, pick it up on the next refresh
+                    self._index_offset += len(line.encode('utf8'))
+                    try:
+                        entry = json.loads(line)
+                        self._index[entry['id']] = entry['dir']
+                    except Exception as e:
+                        self.log.warn('invalid index entry', line=line, _exc_info=e)
+        except FileNotFoundError:
+            pass
+
+    def _index_put(self, id: str, location: Path):
+        self._refresh_index()
+
+        rp = location.relative_to(self.basepath).as_posix()
+        if self._index.get(id) == rp:
+            return
+
+        line = json.dumps(dict(id=id, dir=rp)) + '\n'
+        with open(self.index_filename, 'a', encoding='utf8') as f:
+            f.write(line)
+
+        self._index[id] = rp
+        self._index_offset += len(line.encode('utf8'))
+
+    def _scan(self) -> dict:
+        # The cell directory name is the cell ID, this allows us to locate cells without parsing them
+        return { path.parent.name: path.parent.relative_to(self.basepath).as_posix()
+                 for path in self.basepath.glob('**/meta.json') }
+
+    def reindex(self):
+        self.log.info('rebuilding index', filename=self.index_filename)
+
+        self._index = self._scan()
+        self._index_complete = True
+
+        try:
+            tmp_filename = self.index_filename.with_name(f'{self.index_filename.name}.{os.getpid()}.tmp')
+            with open(tmp_filename, 'w', encoding='utf8') as f:
+                for (id, rp) in self._index.items():
+                    f.write(json.dumps(dict(id=id, dir=rp)) + '\n')
+            os.replace(tmp_filename, self.index_filename)
+
+            self._index_offset = self.index_filename.stat().st_size
+        except OSError as e:
+            # A read-only celldb still works, just without a persistent index
+            self.log.warn('cannot store index', filename=self.index_filename, _exc_info=e)
+
+        self.log.info('index rebuilt', cell_count=len(self._index))
+
     def _locate(self, id: str) -> (Path, Infoset):
         self.log.debug('locating cell', id=id)
 
-        for path in self.basepath.glob('**/meta.json'):
-            try:
-                infoset = self._load_cell_infoset(path)
-                if infoset.fetch('.id') == id:
-                    return (path.parent, infoset)
-            except Exception as e:
-                pass
-        else:
+        self._refresh_index()
+
+        rp = self._index.get(id)
+        if rp is None and not self._index_complete:
+            # The cell might have been stored without updating the index, rebuild it once per backend instance
+            self.log.debug('cell not in index', id=id)
+            self.reindex()
+            rp = self._index.get(id)
+
+        if rp is None:
             return (None, None)
 
-    def _load_cell_infoset(self, location: Path) -> Infoset:
+        location = self.basepath.joinpath(rp)
+        if not location.joinpath('meta.json').is_file():
+            # Stale entry, the cell has been moved or removed behind our back
+            self.log.debug('stale index entry', id=id, location=location)
+            self.reindex()
+            rp = self._index.get(id)
+            if rp is None:
+                return (None, None)
+            location = self.basepath.joinpath(rp)
+
+        try:
+            return (location, self._load_cell_infoset(location.joinpath('meta.json')))
+        except Exception as e:
+            self.log.error('cannot load cell', location=location, _exc_info=e)
+            return (None, None)
+
+    def _load_cell_infoset(self, location: Path, check=None) -> Infoset:
         infoset = Infoset()
 
         cell_id = location.parent.name
@@ -69,6 +167,10 @@ class JsonFiles(CellDB):
             else:
                 infoset.put('.path', '/')
 
+            # Skip loading the rest of cells which cannot match
+            if check is not None and not check(dict(id=cell_id, path=infoset.fetch('.path'), props=j)):
+                return None
+
             infoset.put('.props', Infoset(data=j))
 
         # Try to load the log
@@ -84,31 +186,76 @@ class JsonFiles(CellDB):
         # Load non-JSON files (extra objects)
         infoset.put('.extra', [])
         for extra_filename in filter(lambda p: not p.match('*.json') and not p.is_dir(), location.parent.glob("*")):
+            st = extra_filename.stat()
 
-            infoset.fetch('.extra').append({
-                'name': extra_filename.name,
-                'props': {
+            # Content is directly stored, not referenced. It is read only when accessed.
+            infoset.fetch('.extra').append(LazyExtra(
+                name=extra_filename.name,
+                props={
                     'stat': {
-                        'ctime': extra_filename.stat().st_ctime,
-                        'mtime': extra_filename.stat().st_mtime
+                        'ctime': st.st_ctime,
+                        'mtime': st.st_mtime
                     }
                 },
-                'ref': None,  # Content is directly stored, not referenced
-                'content': extra_filename.read_bytes()
-            })
+                ref=None,
+                size=st.st_size,
+                loader=extra_filename.read_bytes,
+                origin=extra_filename
+            ))
 
         # Bind the state variables
-        for (path, statevar_class) in v1.state_vars.items():
-            infoset.put(f'.state.{path}', statevar_class(cell=infoset))
+        bind_state_vars(infoset)
 
         return infoset
 
+    def existing_ids(self, ids) -> set:
+        ids = set(ids)
+
+        self._refresh_index()
+        if not ids <= self._index.keys() and not self._index_complete:
+            self.reindex()
+
+        return ids & self._index.keys()
+
     def fetch(self, id: str) -> Infoset:
         self.log.info('searching for cell', id=id)
 
         (location, infoset) = self._locate(id)
         return infoset
 
+    def fetch_many(self, ids) -> dict:
+        ids = list(dict.fromkeys(ids))
+        self.log.info('searching for cells', count=len(ids))
+
+        # A single index refresh (and at most one rebuild) for the whole batch
+        existing = self.existing_ids(ids)
+        ids = [ id for id in ids if id in existing ]
+        locations = [ self.basepath.joinpath(self._index[id], 'meta.json') for id in ids ]
+
+        def load(location):
+            if not location.is_file():
+                return None
+            try:
+                return self._load_cell_infoset(location)
+            except Exception as e:
+                self.log.error('cannot load cell', location=location, _exc_info=e)
+                return None
+
+        if self.workers > 1:
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                infosets = list(executor.map(load, locations))
+        else:
+            infosets = [ load(location) for location in locations ]
+
+        found = dict()
+        for (id, location, infoset) in zip(ids, locations, infosets):
+            if infoset is None and not location.is_file():
+                # Stale index entry, the cell has been moved or removed behind our back
+                (location, infoset) = self._locate(id)
+            if infoset is not None:
+                found[id] = infoset
+        return found
+
     def put(self, infoset: Infoset):
         self.log.info('storing cell', cell_id=infoset.fetch('.id'), path=infoset.fetch('.path'))
 
@@ -129,8 +276,16 @@ class JsonFiles(CellDB):
         location.joinpath('log.json').write_text(json.dumps(infoset.fetch('.log')) )
 
         for extra in infoset.fetch('.extra'):
+            extra_filename = location.joinpath(extra['name'])
+
+            # Skip unchanged content which is already stored in this location
+            if getattr(extra, 'origin', None) == extra_filename and extra_filename.exists():
+                continue
+
             # TODO: Restore file ctime and mtime from props
-            location.joinpath(extra['name']).write_bytes(extra['content'])
+            extra_filename.write_bytes(extra['content'])
+
+        self._index_put(infoset.fetch('.id'), location)
 
     def move(self, id: str, destination: str):
         self.log.info('moving cell', id=id, destination=destination)
@@ -154,17 +309,105 @@ class JsonFiles(CellDB):
         # Remove old location
         shutil.rmtree(location)
 
-    def find(self) -> Infoset:  # Generator
+    def _found(self, path: Path, load) -> Infoset:
+        try:
+            infoset = load()
+            if infoset is not None and infoset.fetch('.id'):
+                self.log.debug('cell found', path=path)
+                return infoset
 
-        for path in self.basepath.glob('**/meta.json'):
-            try:
-                infoset = self._load_cell_infoset(path)
-                if infoset.fetch('.id'):
-                    self.log.debug('cell found', path=path)
+        except Exception as e:
+            self.log.error('cannot load cell', path=path, _exc_info=e)
+        return None
+
+    def _search_paths(self, restrictions: list):  # Generator
+        # Container paths are directories, only the subtree which can contain matching cells is searched
+        (container, pattern) = ('/', '**/meta.json')
+        for restriction in restrictions:
+            if restriction[0] == 'path':
+                (container, pattern) = (restriction[1], '*/meta.json')
+                break
+            elif restriction[0] == 'path_prefix':
+                # Cut at the last complete container, '/BOX' can match cells in '/BOX~1/' and '/BOX~2/'.
+                # Matching cells need to satisfy all restrictions, the deepest container is used.
+                container = max(container, restriction[1][:restriction[1].rfind('/') + 1] or '/', key=len)
+
+        parts = [ part for part in container.split('/') if len(part) > 0 ]
+        if not container.startswith('/') or not container.endswith('/') or any([ part in ('.', '..') for part in parts ]):
+            # Not a path of any stored cell, search everything and leave it to the filter
+            (parts, pattern) = ([], '**/meta.json')
+
+        for path in self.basepath.joinpath(*parts).glob(pattern):
+            if self._satisfies(path, restrictions):
+                yield path
+
+    def _satisfies(self, location: Path, restrictions: list) -> bool:
+        # Check the restrictions following from the cell location, the directory name is the cell ID and the parent
+        # directories make up the container path: a/b/c/d/meta.json -> path is /a/b/c/
+        id = location.parent.name
+        path = '/'.join([''] + list(location.relative_to(self.basepath).parts[:-2]) + [''])
+
+        for restriction in restrictions:
+            (kind, value) = restriction[:2]
+            if (kind == 'id' and id != value) or (kind == 'id_prefix' and not id.startswith(value)) or \
+               (kind == 'path' and path != value) or (kind == 'path_prefix' and not path.startswith(value)):
+                return False
+        return True
+
+    def find(self, path=None, recursive=True, workers=None, filter=None) -> Infoset:  # Generator
+        workers = workers or self.workers
+
+        restrictions = predicate.restrictions(filter)
+        if path is not None:
+            # Only the container directory (or the subtree below it) is searched
+            restrictions.insert(0, ('path_prefix' if recursive else 'path', _normalized_path(path)))
+        check = predicate.prefilter(filter, ('id', 'path', 'props'))
+
+        ids = [ restriction[1] for restriction in restrictions if restriction[0] == 'id' ]
+        if len(ids) > 0:
+            # A single cell can match, use the index to find it
+            (location, infoset) = self._locate(ids[0])
+            if infoset is not None and self._satisfies(location.joinpath('meta.json'), restrictions):
+                yield infoset
+            return
+
+        paths = self._search_paths(restrictions)
+
+        if workers <= 1:
+            for path in paths:
+                infoset = self._found(path, lambda: self._load_cell_infoset(path, check))
+                if infoset:
                     yield infoset
+            return
 
-            except Exception as e:
-                self.log.error('cannot load cell', path=path, _exc_info=e)
+        # Load cells on a thread pool to hide file open latency, the cells are yielded in the same order as they are
+        # found. Only a bounded amount of cells is loaded in advance to keep memory usage capped.
+        executor = ThreadPoolExecutor(max_workers=workers)
+        in_flight = deque()
+        try:
+            for path in paths:
+                in_flight.append( (path, executor.submit(self._load_cell_infoset, path, check)) )
+
+                if len(in_flight) >= workers * JsonFiles.PREFETCH_PER_WORKER:
+                    (path, future) = in_flight.popleft()
+                    infoset = self._found(path, future.result)
+                    if infoset:
+                        yield infoset
+
+            while len(in_flight) > 0:
+                (path, future) = in_flight.popleft()
+                infoset = self._found(path, future.result)
+                if infoset:
+                    yield infoset
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+
+def _config_group(parser):
+    group = parser.add_argument_group('json-files backend')
+    group.add_argument('--json-files-workers', metavar='N', type=int, default=int(os.getenv('CELLDB_JSON_FILES_WORKERS', 1)),
+        help='Load cells using N threads when processing all cells, helps with high latency storage such as NFS')
 
 
 v1.register_celldb_backend('json-files', JsonFiles)
+v1.register_config_group('json-files', _config_group)
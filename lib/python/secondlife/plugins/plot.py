@@ -10,13 +10,10 @@ import sys
 import jq
 import argparse
 
-from secondlife.cli.utils import CompileJQ
+from secondlife.cli.utils import CompileJQ, JQBatch, cell_json
 
 log = structlog.get_logger()
 
-import matplotlib.pyplot as plt
-import numpy as np
-
 
 class PlotReport(object):
 
@@ -25,20 +22,21 @@ class PlotReport(object):
         self.log = get_logger(name=__class__.__name__)
         self.x = []
         self.y = []
+        self.queries = None
 
     def process_cell(self, infoset):
         cell_id = infoset.fetch('.id')
         log = self.log.bind(id=cell_id)
         log.debug('processing cell')
 
-        json_text = infoset.to_json(indent=2)
-
         if self.config.plot_query_x is None or self.config.plot_query_y is None:
             log.error('both x and y queries need to be defined')
             sys.exit(1)
 
-        result_x = self.config.plot_query_x.input(text=json_text).first()
-        result_y = self.config.plot_query_y.input(text=json_text).first()
+        if self.queries is None:
+            self.queries = JQBatch([ self.config.plot_query_x, self.config.plot_query_y ])
+
+        (result_x, result_y) = self.queries.first(cell_json(infoset))
 
         if result_x is None or result_y is None:
             log.warn('no result', id=cell_id, x=result_x, y=result_y)
@@ -51,6 +49,14 @@ class PlotReport(object):
         self.x.append(float(result_x))
         self.y.append(float(result_y))
 
+    def __getstate__(self):
+        # Only the collected points are sent back from info.py --jobs workers
+        return dict(x=self.x, y=self.y)
+
+    def merge(self, other):
+        self.x.extend(other.x)
+        self.y.extend(other.y)
+
     def report(self, format='ascii'):
         if format != 'ascii':
             log.error('unknown report format', format=format)
@@ -66,6 +72,9 @@ class PlotReport(object):
 
         log.info('plotting', num_points=len(self.x))
 
+        # Importing matplotlib takes a while, do it only when plotting
+        import matplotlib.pyplot as plt
+
         fig, ax = plt.subplots()
 
         ax.scatter(self.x, self.y)
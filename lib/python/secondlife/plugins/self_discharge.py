@@ -1,6 +1,7 @@
 #!/usr/bin/env python3
 
 from secondlife.plugins.api import v1
+from secondlife.units import normalize
 from structlog import get_logger
 import tabulate
 
@@ -53,7 +54,7 @@ class SelfDischargeCheckResult(object):
             #
             ocv1 = (4.2, last_capacity_measurement['ts'])
             if 'OCV' in last_capacity_measurement['results']:
-                ocv1 = (last_capacity_measurement['results']['OCV']['v'], last_capacity_measurement['ts'])
+                ocv1 = (normalize(last_capacity_measurement['results']['OCV'], 'V')['v'], last_capacity_measurement['ts'])
 
             # If the cell has been fully charged after capacity measurement assume voltage drops to 4.15 V within 8h and
             # start from there
@@ -83,7 +84,7 @@ class SelfDischargeCheckResult(object):
                     continue
 
                 # Calculate voltage drop in mV / day
-                voltage_drop = (ocv_measurement['results']['OCV']['v'] - ocv1[0]) * 1000
+                voltage_drop = (normalize(ocv_measurement['results']['OCV'], 'V')['v'] - ocv1[0]) * 1000
                 voltage_drop = voltage_drop / T
 
                 # Acceptable voltage drop is 8 mV / day
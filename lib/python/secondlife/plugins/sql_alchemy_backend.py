@@ -4,33 +4,85 @@ from structlog import get_logger
 import logging
 from pathlib import Path
 from collections import defaultdict
-from copy import deepcopy
+import json
 import time
+import weakref
 
-from sqlalchemy import select, create_engine, Table, Column, Integer, String, LargeBinary, Float, JSON, ForeignKey
-from sqlalchemy.orm import Session, declarative_base, relationship
+from sqlalchemy import select, insert, update, delete, func, literal, bindparam, text, inspect, case
+from sqlalchemy import create_engine, Table, Column, Integer, String, LargeBinary, Float, JSON, ForeignKey
+from sqlalchemy.orm import Session, declarative_base, relationship, deferred, column_property
 
 from secondlife.plugins.api import v1
 from secondlife.infoset import Infoset
-from secondlife.celldb import CellDB
+from secondlife.celldb import CellDB, LazyExtra, bind_state_vars, _normalized_path
+from secondlife import predicate
 
 log = get_logger()
 
 Base = declarative_base()
 
+# Maximum amount of values in a single IN (...) clause, keeps us below the SQLite bound parameter limit
+IN_CHUNK_SIZE = 500
+
+
+# JSON types of the numbers and booleans in props, as returned by json_type() (SQLite) and json_typeof() (PostgreSQL)
+JSON_TYPES = {
+    'sqlite': dict(number=('integer', 'real'), boolean=('true', 'false')),
+    'postgresql': dict(number=('number', ), boolean=('boolean', )),
+}
+
+
+def _json_type(names, dialect):
+    # Return the expression giving the JSON type of a prop
+    if dialect == 'sqlite':
+        return func.json_type(Cell.props, '$' + ''.join([ f'."{name}"' for name in names ]))
+    return func.json_typeof(Cell.props[names if len(names) > 1 else names[0]])
+
+
+def _restriction_clause(restriction, dialect):
+    # Translate a restriction returned by secondlife.predicate.restrictions() into a WHERE clause, None if it is not
+    # supported by the database dialect
+    kind = restriction[0]
+    if kind == 'id':
+        return Cell.id == restriction[1]
+    elif kind == 'id_prefix':
+        return Cell.id.startswith(restriction[1], autoescape=True)
+    elif kind == 'path':
+        return Cell.path == restriction[1]
+    elif kind == 'path_prefix':
+        return Cell.path.startswith(restriction[1], autoescape=True)
+
+    names = restriction[1]
+    element = Cell.props[names if len(names) > 1 else names[0]]
+    if kind == 'prop_present':
+        return element.as_string().isnot(None)
+
+    value = restriction[2]
+    if type(value) is str:
+        return element.as_string() == value
+    elif dialect not in JSON_TYPES:
+        return None
+
+    # Props of other JSON types can't be cast to numbers or booleans (PostgreSQL fails the query), the cast is done only
+    # for props of the expected type
+    (json_types, converted) = (JSON_TYPES[dialect]['boolean'], element.as_boolean()) if type(value) is bool else \
+        (JSON_TYPES[dialect]['number'], element.as_float())
+    return case((_json_type(names, dialect).in_(json_types), converted), else_=None) == value
+
 
 class Cell(Base):
     __tablename__ = 'cells'
 
     id = Column(String, primary_key=True)
     container_cell_id = Column(String, ForeignKey('cells.id'), nullable=True)
+    path = Column(String, index=True)  # Materialized container path, derived from container_cell_id by put()
     props = Column(JSON)
 
     log_entries = relationship('LogEntry', back_populates='cell')
     extras = relationship('Extra', back_populates='cell')
 
     def __repr__(self):
-        return f'<{self.__class__.__name__} {self.id} container_cell_id={self.container_cell_id} props={self.props}>'
+        return f'<{self.__class__.__name__} {self.id} container_cell_id={self.container_cell_id} path={self.path} props={self.props}>'
 
 
 class LogEntry(Base):
@@ -54,12 +106,16 @@ class Extra(Base):
     name = Column(String, primary_key=True)
     props = Column(JSON)
     ref = Column(String)
-    content = Column(LargeBinary)
+    content = deferred(Column(LargeBinary))  # Loaded only when accessed
 
     cell = relationship('Cell', back_populates='extras')
 
     def __repr__(self):
-        return f'<{self.__class__.__name__} cell_id={self.cell_id} name={self.name} props={self.props} ref={self.ref} content={len(self.content)} bytes>'  # noqa
+        return f'<{self.__class__.__name__} cell_id={self.cell_id} name={self.name} props={self.props} ref={self.ref} content={self.size} bytes>'  # noqa
+
+
+# The content size is available without loading the content itself
+Extra.size = column_property(func.length(Extra.__table__.c.content))
 
 
 class SQLAlchemy(CellDB):
@@ -71,7 +127,11 @@ class SQLAlchemy(CellDB):
         self.engine = create_engine(self.dsn, echo=True if self.config.loglevel == 'DEBUG' else False, future=True)
         self.session = Session(self.engine)
 
+        # The stored state of the infosets loaded from (or stored in) this database, put() writes only the difference
+        self._stored = weakref.WeakKeyDictionary()
+
         log.debug('backend setup', engine=self.engine)
+        self._migrate()
 
     def __repr__(self):
         return f'SQLAlchemy/{repr(self.engine)}'
@@ -81,76 +141,166 @@ class SQLAlchemy(CellDB):
 
         Base.metadata.create_all(self.engine)
 
+    def _materialized_path(self, container_cell_id, path: str) -> str:
+        # The container cell hierarchy is authoritative, the path of the container is used if it is stored.
+        if container_cell_id is None:
+            return '/'
+
+        container_path = self.session.execute( select(Cell.path).where(Cell.id == container_cell_id) ).scalar()
+        if container_path is not None:
+            return f'{container_path}{container_cell_id}/'
+
+        # Container not stored (yet), use the requested path
+        return _normalized_path(path)
+
+    def _move_descendants(self, cell_id: str, old_path: str, new_path: str):
+        old_prefix = f'{old_path}{cell_id}/'
+        new_prefix = f'{new_path}{cell_id}/'
+        log.debug('moving descendants', cell_id=cell_id, old_prefix=old_prefix, new_prefix=new_prefix)
+
+        self.session.execute(
+            update(Cell).where(Cell.path.startswith(old_prefix, autoescape=True))
+            .values(path=literal(new_prefix) + func.substr(Cell.path, len(old_prefix) + 1))
+            .execution_options(synchronize_session=False)
+        )
+
+    def _path_column_missing(self) -> bool:
+        inspector = inspect(self.engine)
+        if not inspector.has_table(Cell.__tablename__):
+            return False  # Not created yet
+        return 'path' not in [ column['name'] for column in inspector.get_columns(Cell.__tablename__) ]
+
+    def _migrate(self):
+        # Databases created before the path column existed are upgraded when opened, the same way as 'admin.py reindex' does
+        if self._path_column_missing():
+            log.warning('celldb has no materialized paths, upgrading', engine=self.engine)
+            self.reindex()
+
+    def reindex(self):
+        log.info('rebuilding materialized paths', engine=self.engine)
+
+        # Add the path column to databases created before it existed
+        if self._path_column_missing():
+            log.info('adding path column')
+            with self.engine.begin() as conn:
+                conn.execute(text(f'ALTER TABLE {Cell.__tablename__} ADD COLUMN path VARCHAR'))
+                conn.execute(text(f'CREATE INDEX ix_{Cell.__tablename__}_path ON {Cell.__tablename__} (path)'))
+
+        containers = dict(self.session.execute( select(Cell.id, Cell.container_cell_id) ).all())
+        paths = dict()
+
+        def path(id):
+            if id not in paths:
+                container_cell_id = containers.get(id)
+                paths[id] = '/' if container_cell_id is None else f'{path(container_cell_id)}{container_cell_id}/'
+            return paths[id]
+
+        for id in containers.keys():
+            path(id)
+
+        ids = list(paths.keys())
+        for i in range(0, len(ids), IN_CHUNK_SIZE):
+            self.session.execute(
+                update(Cell.__table__).where(Cell.__table__.c.id == bindparam('cell_id')).values(path=bindparam('new_path')),
+                [ dict(cell_id=id, new_path=paths[id]) for id in ids[i:i + IN_CHUNK_SIZE] ]
+            )
+        self.session.commit()
+
+        log.info('materialized paths rebuilt', cell_count=len(paths))
+
+    def _load_extra_content(self, cell_id: str, name: str) -> bytes:
+        return self.session.execute( select(Extra.content).where(Extra.cell_id == cell_id, Extra.name == name) ).scalar()
+
     def _build_infoset(self, cell, log_entries: list, extras: list) -> Infoset:
         log.debug('building infoset', cell_row=cell, log_entries=log_entries, extras=extras)
-        id = cell.id
 
+        # Rows are fetched as plain values (not ORM objects), JSON columns are decoded for each query so there is no need
+        # to copy them.
         infoset = Infoset()
         infoset.put('.id', cell.id)
+        infoset.put('.path', cell.path)
         infoset.put('.extra', [])
         infoset.put('.log', [])
 
-        infoset.put('.props', deepcopy(cell.props))
-
-        if hasattr(self, '_container_cache'):
-
-            # Synthesize path from cache
-            if cell.container_cell_id is not None:
-                parts = [ '' ]
-                p = self._container_cache[cell.id]
-                while p is not None:
-                    parts.append(p)
-                    p = self._container_cache[p]
-
-                infoset.put('.path', '/'.join([''] + list(reversed(parts))))
-            else:
-                infoset.put('.path', '/')
-
-        else:
-
-            # Synthesize path from database
-            if cell.container_cell_id is not None:
-                parts = [ '' ]
-                p = cell.container_cell_id
-                while p is not None:
-                    parts.append(p)
-                    container_row = self.session.execute( select(Cell).where(Cell.id == p)).first()[0]
-                    p = container_row.container_cell_id
-
-                infoset.put('.path', '/'.join([''] + list(reversed(parts))))
-            else:
-                infoset.put('.path', '/')
+        infoset.put('.props', cell.props)
 
-        for e in sorted(log_entries, key=lambda e: e.idx):
+        for e in log_entries:
             if e.ts is not None:
                 e.entry.update({ 'ts': e.ts })
 
-            infoset.fetch('.log').append(deepcopy(e.entry))
+            infoset.fetch('.log').append(e.entry)
 
         for extra in extras:
             # TODO: Restore mtime and ctime from props
-            infoset.fetch('.extra').append({
-                'name': extra.name,
-                'props': deepcopy(extra.props),
-                'ref': extra.ref,
-                'content': deepcopy(extra.content)
-            })
+            infoset.fetch('.extra').append(LazyExtra(
+                name=extra.name,
+                props=extra.props,
+                ref=extra.ref,
+                size=extra.size,
+                loader=lambda cell_id=cell.id, name=extra.name: self._load_extra_content(cell_id, name),
+                origin=(self, cell.id, extra.name)
+            ))
 
         # Bind the state variables
-        for (path, statevar_class) in v1.state_vars.items():
-            infoset.put(f'.state.{path}', statevar_class(cell=infoset))
+        bind_state_vars(infoset)
+
+        self._remember_stored(infoset, cell.container_cell_id)
 
         return infoset
 
+    def _remember_stored(self, infoset: Infoset, container_cell_id):
+        self._stored[infoset] = dict(
+            container_cell_id=container_cell_id,
+            props=json.dumps(infoset.fetch('.props'), sort_keys=True),
+            log_count=len(infoset.fetch('.log'))
+        )
+
+    def _load_infosets(self, cells: list) -> Infoset:  # Generator
+        # Load log entries and extras (without content) for a chunk of cells with a single query each
+        ids = [ cell.id for cell in cells ]
+
+        log_entries = defaultdict(list)
+        for e in self.session.execute( select(LogEntry.cell_id, LogEntry.idx, LogEntry.ts, LogEntry.entry)
+                                       .where(LogEntry.cell_id.in_(ids)).order_by(LogEntry.cell_id, LogEntry.idx) ):
+            log_entries[e.cell_id].append(e)
+
+        extras = defaultdict(list)
+        for e in self.session.execute( select(Extra.cell_id, Extra.name, Extra.props, Extra.ref, Extra.size)
+                                       .where(Extra.cell_id.in_(ids)) ):
+            extras[e.cell_id].append(e)
+
+        for cell in cells:
+            yield self._build_infoset(cell, log_entries[cell.id], extras[cell.id])
+
+    def existing_ids(self, ids) -> set:
+        ids = list(set(ids))
+        existing = set()
+
+        for i in range(0, len(ids), IN_CHUNK_SIZE):
+            existing.update( self.session.execute( select(Cell.id).where(Cell.id.in_(ids[i:i + IN_CHUNK_SIZE])) ).scalars() )
+
+        return existing
+
     def fetch(self, id: str) -> Infoset:
         log.info('fetching infoset', id=id)
 
-        cell = self.session.execute( select(Cell).where(Cell.id == id) ).first()
+        cell = self.session.execute( select(Cell.id, Cell.container_cell_id, Cell.path, Cell.props).where(Cell.id == id) ).first()
         if cell is None:
             return None
-        cell = cell[0]
 
-        return self._build_infoset(cell, cell.log_entries, cell.extras)
+        return next(self._load_infosets([ cell ]))
+
+    def fetch_many(self, ids) -> dict:
+        ids = list(dict.fromkeys(ids))
+        log.info('fetching infosets', count=len(ids))
+
+        found = dict()
+        for i in range(0, len(ids), IN_CHUNK_SIZE):
+            cells = self.session.execute( select(Cell.id, Cell.container_cell_id, Cell.path, Cell.props)
+                                          .where(Cell.id.in_(ids[i:i + IN_CHUNK_SIZE])) ).all()
+            for infoset in self._load_infosets(cells):
+                found[infoset.fetch('.id')] = infoset
+        return found
 
     def put(self, infoset: Infoset):
 
@@ -163,20 +313,56 @@ class SQLAlchemy(CellDB):
             if parent_container:
                 container_cell_id = parent_container
 
-        self.session.merge( Cell(id=cell_id, container_cell_id=container_cell_id, props=props) )
-
         log_entries = infoset.fetch('.log')
-        for idx in range(len(log_entries)):
-            ts = log_entries[idx].get('ts', None)
-            self.session.merge( LogEntry(cell_id=cell_id, idx=idx, ts=ts, entry=log_entries[idx]) )
+
+        # The log is append-only, log entries which have already been stored are not written again
+        stored = self._stored.get(infoset)
+        if stored is not None and len(log_entries) >= stored['log_count']:
+            log.debug('storing changes', cell_id=cell_id, stored=stored)
+
+            if stored['container_cell_id'] != container_cell_id:
+                self._store_cell(cell_id, container_cell_id, infoset.fetch('.path'), props)
+            elif stored['props'] != json.dumps(props, sort_keys=True):
+                self.session.execute( update(Cell).where(Cell.id == cell_id).values(props=props) )
+
+            first_new_idx = stored['log_count']
+        else:
+            # The infoset has not been loaded from this database, store everything
+            self._store_cell(cell_id, container_cell_id, infoset.fetch('.path'), props)
+
+            self.session.execute( delete(LogEntry).where(LogEntry.cell_id == cell_id) )
+            first_new_idx = 0
+
+        if first_new_idx < len(log_entries):
+            self.session.execute( insert(LogEntry), [
+                dict(cell_id=cell_id, idx=idx, ts=log_entries[idx].get('ts', None), entry=log_entries[idx])
+                for idx in range(first_new_idx, len(log_entries))
+            ] )
 
         for extra in infoset.fetch('.extra'):
+            # Skip unchanged content which is already stored for this cell
+            if getattr(extra, 'origin', None) == (self, cell_id, extra['name']):
+                continue
+
             self.session.merge( Extra(cell_id=cell_id, name=extra['name'],
                 props=extra['props'], ref=extra['ref'], content=extra['content']) )
 
         self.session.flush()
         self.session.commit()
 
+        self._remember_stored(infoset, container_cell_id)
+
+    def _store_cell(self, cell_id: str, container_cell_id, path: str, props):
+        old_path = self.session.execute( select(Cell.path).where(Cell.id == cell_id) ).scalar()
+        new_path = self._materialized_path(container_cell_id, path or '/')
+
+        self.session.merge( Cell(id=cell_id, container_cell_id=container_cell_id, path=new_path, props=props) )
+        self.session.flush()
+
+        # Cells contained in this cell move together with it
+        if old_path is not None and old_path != new_path:
+            self._move_descendants(cell_id, old_path, new_path)
+
     def move(self, id: str, destination: str):
         log.info('moving cell', id=id, destination=destination)
 
@@ -196,50 +382,39 @@ class SQLAlchemy(CellDB):
         infoset.put('.path', destination)
         self.put(infoset)
 
-    def find(self) -> Infoset:
+    def find(self, path=None, recursive=True, filter=None) -> Infoset:  # Generator
 
-        # FIXME:
-        # A better way needs to be developed for handling the task of quickly loading all information from the DB.
-        # Using the ORM directly is too slow.
+        # Cells are loaded in chunks ordered by ID (keyset pagination), each chunk costs three short queries. No cursor is
+        # kept open between chunks so the cells can be stored while iterating and the memory usage does not depend on the
+        # amount of cells in the database.
         #
-        #
-        # The caches will be invalidated with any changes performed on the infosets and as such are only useful
-        # in a simple load all -> modify -> save all kind of workflow
-        #
-
-        # Build caches first for quicker access
-        # - logs cache holds all logs
-        # - extras cache holds all extras
-        # - container cache holds all container cell IDs (used to synthesize paths)
-        self._logs_cache = defaultdict(list)
-        self._extras_cache = defaultdict(list)
-        self._container_cache = defaultdict(lambda: None)
-
-        # Fetch and cache all logs
-        for e in self.session.execute( select(LogEntry) ):
-            e = e[0]
-            self._logs_cache[e.cell_id].append(e)
-
-        log.info('cached all logs', count=len(self._logs_cache.keys()))
-
-        # Fetch and cache all extras
-        for e in self.session.execute( select(Extra) ):
-            e = e[0]
-            self._extras_cache[e.cell_id].append(e)
-
-        log.info('cached all extras', count=len(self._extras_cache.keys()))
-
-        # Fetch and cache all container cell IDs
-        for cell in self.session.execute( select(Cell) ):
-            cell = cell[0]
-            if cell.container_cell_id is not None:
-                self._container_cache[cell.id] = cell.container_cell_id
-
-        log.info('cached all container IDs', count=len(self._container_cache.keys()))
-
-        for cell in self.session.execute( select(Cell) ):
-            cell = cell[0]
-            yield self._build_infoset(cell, self._logs_cache[cell.id], self._extras_cache[cell.id])
+        # If a path is specified only cells in the container (or the subtree below it) are loaded, the materialized container
+        # path is indexed. Restrictions from the filter are applied
+        # in the database, the remaining filter parts using only the cell row are checked before loading the log and extras.
+
+        clauses = [ _restriction_clause(restriction, self.engine.dialect.name) for restriction in predicate.restrictions(filter) ]
+        clauses = [ clause for clause in clauses if clause is not None ]
+        if path is not None and recursive:
+            clauses.append( Cell.path.startswith(_normalized_path(path), autoescape=True) )
+        elif path is not None:
+            clauses.append( Cell.path == _normalized_path(path) )
+        check = predicate.prefilter(filter, ('id', 'path', 'props'))
+
+        last_id = None
+        while True:
+            query = select(Cell.id, Cell.container_cell_id, Cell.path, Cell.props).where(*clauses).order_by(Cell.id).limit(IN_CHUNK_SIZE)
+            if last_id is not None:
+                query = query.where(Cell.id > last_id)
+
+            cells = self.session.execute(query).all()
+            if len(cells) == 0:
+                break
+            last_id = cells[-1].id
+
+            if check is not None:
+                cells = [ cell for cell in cells if check(dict(id=cell.id, path=cell.path, props=cell.props)) ]
+
+            yield from self._load_infosets(cells)
 
 
 v1.register_celldb_backend('sql-alchemy', SQLAlchemy)
@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+
+from secondlife.plugins.api import v1
+from secondlife.units import scale_factor
+from structlog import get_logger
+from array import array
+import math
+
+from secondlife.cli.report import ReportTable
+
+log = get_logger()
+
+# The state variables collected by the report: (name, infoset path, canonical unit)
+METRICS = [
+    ('usable_capacity', '.state.usable_capacity', 'mAh'),
+    ('internal_resistance', '.state.internal_resistance', 'mOhm'),
+    ('self_discharge', '.state.self_discharge', 'mV/day'),
+    ('ocv', None, 'V'),
+]
+
+DEFAULT_PERCENTILES = [ 5, 25, 50, 75, 95 ]
+
+
+def _value(measurement, canonical):
+    # Return a measurement expressed in the canonical unit, NaN when missing
+    if measurement is None or measurement.get('v') is None:
+        return math.nan
+
+    unit = measurement.get('u', canonical)
+    if unit == canonical:
+        return float(measurement['v'])
+    return float(measurement['v']) * scale_factor(unit, canonical)
+
+
+def _last_ocv(infoset):
+    for m in reversed(infoset.fetch('.log')):
+        ocv = m.get('results', {}).get('OCV')
+        if ocv is not None:
+            return ocv
+    return None
+
+
+def summarize(values, percentiles=DEFAULT_PERCENTILES) -> dict:
+    """
+    Return the count, mean, sample standard deviation, minimum, maximum and percentiles of an array ignoring NaN values.
+    """
+    import numpy as np
+
+    values = values[~np.isnan(values)]
+    d = dict(count=len(values), mean=np.nan, stdev=np.nan, min=np.nan, max=np.nan, percentiles=[ np.nan ] * len(percentiles))
+
+    if len(values) > 0:
+        d.update(mean=values.mean(), min=values.min(), max=values.max(), percentiles=list(np.percentile(values, percentiles)))
+    if len(values) > 1:
+        d['stdev'] = values.std(ddof=1)
+    return d
+
+
+def group_stats(codes, values, groups: int) -> dict:
+    """
+    Return per group count, mean, sample standard deviation and median arrays of the values, codes contain the group
+    number of each value. NaN values are ignored, the statistics of groups without values are NaN.
+    """
+    import numpy as np
+
+    valid = ~np.isnan(values)
+    (codes, values) = (codes[valid], values[valid])
+
+    count = np.bincount(codes, minlength=groups)
+    total = np.bincount(codes, weights=values, minlength=groups)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = total / count
+
+        # Sum of squared deviations from the group mean, the sample standard deviation needs at least two values
+        squares = np.bincount(codes, weights=(values - mean[codes]) ** 2, minlength=groups)
+        stdev = np.where(count > 1, np.sqrt(squares / (count - 1)), np.nan)
+
+    # Sort by group and value, the median is in the middle of each group
+    ordered = values[np.lexsort((values, codes))]
+    starts = np.concatenate(([ 0 ], np.cumsum(count)[:-1]))
+    median = np.full(groups, np.nan)
+    present = count > 0
+    lower = ordered[(starts + (count - 1) // 2)[present]]
+    upper = ordered[(starts + count // 2)[present]]
+    median[present] = (lower + upper) / 2
+
+    return dict(count=count, mean=mean, stdev=stdev, median=median)
+
+
+class StatsReport(object):
+
+    def __init__(self, **kwargs):
+        self.config = kwargs['config']
+        self.log = get_logger(name=__class__.__name__)
+
+        # Values are appended to compact arrays of doubles which numpy uses without copying
+        self.values = { name: array('d') for (name, path, unit) in METRICS }
+        self.codes = array('l')
+        self.groups = dict()
+
+        # The tables are created before any report writes rows, their columns are part of the csv header line
+        self.summary = ReportTable('stats', ['Metric', 'Unit', 'Cells', 'Mean', 'Stdev', 'Min'] +
+                                   [ f'P{p:g}' for p in self.config.stats_percentiles ] + ['Max'], self.config)
+        self.histogram = ReportTable('stats-histogram', ['Metric', 'From', 'To', 'Cells'], self.config)
+        self.group_table = ReportTable('stats-groups', ['Brand', 'Model', 'Metric', 'Cells', 'Mean', 'Stdev', 'Median'], self.config)
+
+    def process_cell(self, infoset):
+        log = self.log.bind(id=infoset.fetch('.id'))
+        log.debug('processing cell')
+
+        for (name, path, unit) in METRICS:
+            measurement = infoset.fetch(path) if path is not None else _last_ocv(infoset)
+            self.values[name].append( _value(measurement, unit) )
+
+        key = (infoset.fetch('.props.brand'), infoset.fetch('.props.model'))
+        self.codes.append( self.groups.setdefault(key, len(self.groups)) )
+
+    def __getstate__(self):
+        # Only the collected values are sent back from info.py --jobs workers
+        return dict(values=self.values, codes=self.codes, groups=self.groups)
+
+    def merge(self, other):
+        for (name, values) in other.values.items():
+            self.values[name].extend(values)
+
+        # Group numbers of the other report are translated to the ones used here
+        codes = { code: self.groups.setdefault(key, len(self.groups)) for (key, code) in other.groups.items() }
+        self.codes.extend( codes[code] for code in other.codes )
+
+    def report(self, format='ascii'):
+        if format != 'ascii':
+            log.error('unknown report format', format=format)
+            return
+
+        if len(self.codes) == 0:
+            self.log.warning('no data')
+            return
+
+        # Imported only when the report is printed, plugins are loaded by all commands
+        import numpy as np
+
+        percentiles = self.config.stats_percentiles
+        columns = { name: np.frombuffer(values, dtype=float) for (name, values) in self.values.items() }
+        codes = np.frombuffer(self.codes, dtype=self.codes.typecode)
+
+        (summary, histogram, groups) = (self.summary, self.histogram, self.group_table)
+        for (name, path, unit) in METRICS:
+            d = summarize(columns[name], percentiles)
+            summary.add( [ name, unit, d['count'] ] + [ float(v) for v in [ d['mean'], d['stdev'], d['min'] ] + d['percentiles'] + [ d['max'] ] ] )
+
+            values = columns[name][~np.isnan(columns[name])]
+            if len(values) == 0:
+                continue
+            (counts, edges) = np.histogram(values, bins=self.config.stats_bins)
+            for (i, count) in enumerate(counts):
+                histogram.add( [ name, float(edges[i]), float(edges[i + 1]), int(count) ] )
+
+        keys = list(self.groups.keys())
+        for (name, path, unit) in METRICS:
+            d = group_stats(codes, columns[name], len(keys))
+            for code in sorted(range(len(keys)), key=lambda code: tuple(str(v) for v in keys[code])):
+                if d['count'][code] > 0:
+                    groups.add( list(keys[code]) + [ name, int(d['count'][code]) ] +
+                                [ float(d[stat][code]) for stat in ('mean', 'stdev', 'median') ] )
+
+        summary.close()
+        histogram.close()
+        groups.close()
+
+
+def _config_group(parser):
+    group = parser.add_argument_group('stats report')
+    group.add_argument('--stats-bins', metavar='N', type=int, default=10, help='Number of histogram bins')
+    group.add_argument('--stats-percentiles', metavar='P', type=float, nargs='+', default=DEFAULT_PERCENTILES,
+        help='Percentiles included in the summary')
+
+
+v1.register_report(v1.Report('stats', StatsReport))
+v1.register_config_group('stats', _config_group)
@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+
+import math
+import random
+import sys
+from itertools import zip_longest
+
+from secondlife.plugins.api import v1
+from secondlife.packing import improved, stop, cost, swap_descent
+from structlog import get_logger
+
+log = get_logger()
+
+# Each strategy is created with the configuration and a random number generator (rng, the random module by default)
+# and optimizes a secondlife.packing.Layout in place until stop() is True for it or the secondlife.packing.Run is
+# finished. Strategies can prepare the starting layout in initialize(layout), see secondlife.packing.optimize().
+
+
+def _grouper(iterable, n, fillvalue=None):
+    # grouper('ABCDEFG', 3, 'x') --> ABC DEF Gxx
+    args = [iter(iterable)] * n
+    return zip_longest(*args, fillvalue=fillvalue)
+
+
+class HillClimb(object):
+    """
+    Random swaps accepted only if improved() is True, the amount of cells swapped at once grows with the number of
+    iterations since the last improvement.
+    """
+
+    def __init__(self, **kwargs):
+        self.config = kwargs['config']
+        self.rng = kwargs.get('rng', random)
+
+    def optimize(self, layout, run):
+        score = layout.score()
+        iterations = 0
+
+        while not stop(score):
+            n = iterations // 100 + 1
+
+            # Perform n swaps
+            swaps = list(_grouper(self.rng.sample(range(len(layout.order)), min(2 * n, len(layout.order))), 2))
+            for (p1, p2) in swaps:
+                if p1 is not None and p2 is not None:
+                    layout.swap(p1, p2)
+
+            new_score = layout.score()
+            if improved(score, new_score):
+                score = new_score
+                iterations = 0
+                run.improvement(layout)
+            else:
+                # Reverse swaps
+                for (p1, p2) in reversed(swaps):
+                    if p1 is not None and p2 is not None:
+                        layout.swap(p1, p2)
+                iterations += 1
+
+            if run.finished():
+                break
+
+
+class Annealing(object):
+    """
+    Simulated annealing of single swaps on the cost() of the layout. Worse layouts are accepted with the probability
+    exp(-delta / T), the temperature T is multiplied by the cooling factor after each iteration and the search is
+    restarted from the best layout when T drops below the final temperature.
+    """
+
+    def __init__(self, **kwargs):
+        self.config = kwargs['config']
+        self.rng = kwargs.get('rng', random)
+
+        # The temperature has to decrease towards the final temperature, otherwise there is no cooling schedule
+        if not 0 < self.config.annealing_cooling < 1:
+            log.error('annealing cooling factor must be between 0 and 1', annealing_cooling=self.config.annealing_cooling)
+            sys.exit(1)
+        if not 0 < self.config.annealing_final_temperature < self.config.annealing_temperature:
+            log.error('annealing final temperature must be positive and below the initial temperature',
+                      annealing_temperature=self.config.annealing_temperature,
+                      annealing_final_temperature=self.config.annealing_final_temperature)
+            sys.exit(1)
+
+    def optimize(self, layout, run):
+        used = layout.S * layout.P
+        if used == 0:
+            return
+
+        current = best = cost(layout.score())
+        best_order = list(layout.order)
+
+        # Runs continuing a previous one (parallel chains) continue its cooling schedule
+        cooling_iterations = math.ceil(math.log(self.config.annealing_final_temperature / self.config.annealing_temperature) /
+                                       math.log(self.config.annealing_cooling))
+        temperature = self.config.annealing_temperature * self.config.annealing_cooling ** (run.iterations % cooling_iterations)
+
+        while not stop(layout.score()):
+            if run.finished():
+                break
+
+            # One of the swapped cells is always in a block
+            (p1, p2) = (self.rng.randrange(used), self.rng.randrange(len(layout.order)))
+            layout.swap(p1, p2)
+            candidate = cost(layout.score())
+
+            delta = candidate - current
+            if delta <= 0 or self.rng.random() < math.exp(-delta / temperature):
+                current = candidate
+                if current < best:
+                    (best, best_order) = (current, list(layout.order))
+                    run.improvement(layout)
+            else:
+                layout.swap(p1, p2)
+
+            temperature *= self.config.annealing_cooling
+            if temperature < self.config.annealing_final_temperature:
+                log.debug('reheating', best=best)
+                layout.set_order(best_order)
+                (current, temperature) = (best, self.config.annealing_temperature)
+        else:
+            return  # Good enough, even if not the lowest cost seen
+
+        layout.set_order(best_order)
+
+
+class Greedy(object):
+    """
+    Greedy capacity balancing partition (LPT), IR is not taken into account.
+    """
+
+    def __init__(self, **kwargs):
+        self.config = kwargs['config']
+        self.rng = kwargs.get('rng', random)
+
+    def initialize(self, layout):
+        layout.assign_lpt()
+
+    def optimize(self, layout, run):
+        pass
+
+
+class TwoOpt(object):
+    """
+    Pair swap local search (secondlife.packing.swap_descent()) starting from the greedy partition. The block positions
+    are scanned in random order, so that parallel chains explore different swaps.
+    """
+
+    def __init__(self, **kwargs):
+        self.config = kwargs['config']
+        self.rng = kwargs.get('rng', random)
+
+    def initialize(self, layout):
+        layout.assign_lpt()
+
+    def optimize(self, layout, run):
+        swap_descent(layout, run, self.rng)
+
+
+def _config_group(parser):
+    group = parser.add_argument_group('annealing strategy')
+    group.add_argument('--annealing-temperature', metavar='T', type=float, default=1.0,
+        help='Initial temperature, in percent of the cost (capacity stdev between blocks and excess IR stdev within blocks)')
+    group.add_argument('--annealing-cooling', metavar='FACTOR', type=float, default=0.9999, help='Temperature multiplier per iteration')
+    group.add_argument('--annealing-final-temperature', metavar='T', type=float, default=0.001,
+        help='Restart from the best layout when the temperature drops below T')
+
+
+v1.register_strategy('hill-climb', HillClimb)
+v1.register_strategy('annealing', Annealing)
+v1.register_strategy('greedy', Greedy)
+v1.register_strategy('2-opt', TwoOpt)
+v1.register_config_group('annealing', _config_group)
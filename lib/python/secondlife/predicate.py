@@ -0,0 +1,341 @@
+#!/usr/bin/env python3
+
+import json
+import re
+
+from secondlife.infoset import compile_path
+
+# A subset of the jq language which can be evaluated directly on infosets:
+#
+#   .path.to.value                  path access
+#   "string", 42, true, false, null literals
+#   ==, !=, <, <=, >, >=            comparisons
+#   and, or                         boolean operators
+#   ... | not                       negation
+#   ... | startswith("prefix")      string prefix test
+#   ( ... )                         grouping
+#
+# Queries are parsed into a tree of tuples:
+#
+#   ('path', ('props', 'brand'))
+#   ('literal', value)
+#   ('cmp', op, left, right)
+#   ('and', left, right)
+#   ('or', left, right)
+#   ('not', expr)
+#   ('startswith', expr, prefix)
+
+_TOKEN_RE = re.compile(r'''
+    (?P<space>\s+)
+  | (?P<path>(?:\.[A-Za-z_][A-Za-z0-9_]*)+|\.)
+  | (?P<string>"(?:[^"\\]|\\.)*")
+  | (?P<number>-?\d+(?:\.\d+)?(?:[eE][+-]?\d+)?)
+  | (?P<op>==|!=|<=|>=|<|>)
+  | (?P<punct>[()|])
+  | (?P<word>[A-Za-z_][A-Za-z0-9_]*)
+''', re.VERBOSE)
+
+_KEYWORDS = { 'true': True, 'false': False, 'null': None }
+
+
+class Unsupported(Exception):
+    """
+    The query or the value it is applied to is outside of the supported jq subset, real jq has to be used.
+    """
+    pass
+
+
+def _tokenize(query):
+    tokens = []
+    pos = 0
+    while pos < len(query):
+        m = _TOKEN_RE.match(query, pos)
+        if not m:
+            raise Unsupported(f'unsupported syntax at {pos}')
+        pos = m.end()
+
+        kind = m.lastgroup
+        text = m.group()
+        if kind == 'space':
+            continue
+        elif kind == 'path':
+            tokens.append( ('path', compile_path(text)) )
+        elif kind == 'string':
+            if '\\(' in text:
+                raise Unsupported('string interpolation')
+            tokens.append( ('literal', json.loads(text)) )
+        elif kind == 'number':
+            tokens.append( ('literal', json.loads(text)) )
+        elif kind == 'word' and text in _KEYWORDS:
+            tokens.append( ('literal', _KEYWORDS[text]) )
+        else:
+            tokens.append( (kind, text) )
+    return tokens
+
+
+class _Parser(object):
+    # Recursive descent parser following the jq operator precedence: '|' < 'or' < 'and' < comparisons
+
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.pos = 0
+
+    def peek(self):
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else (None, None)
+
+    def take(self, kind, text=None):
+        token = self.peek()
+        if token[0] != kind or (text is not None and token[1] != text):
+            raise Unsupported(f'unexpected token {token}')
+        self.pos += 1
+        return token
+
+    def parse(self):
+        expr = self.pipe()
+        if self.pos != len(self.tokens):
+            raise Unsupported(f'unexpected token {self.peek()}')
+        return expr
+
+    def pipe(self):
+        expr = self.disjunction()
+        while self.peek() == ('punct', '|'):
+            self.take('punct', '|')
+            # Only filters applied to the value on the left hand side are supported
+            if self.peek() == ('word', 'not'):
+                self.take('word')
+                expr = ('not', expr)
+            elif self.peek() == ('word', 'startswith'):
+                self.take('word')
+                self.take('punct', '(')
+                (kind, prefix) = self.take('literal')
+                self.take('punct', ')')
+                if not isinstance(prefix, str):
+                    raise Unsupported('startswith() needs a string argument')
+                expr = ('startswith', expr, prefix)
+            else:
+                raise Unsupported(f'unsupported filter {self.peek()}')
+        return expr
+
+    def disjunction(self):
+        expr = self.conjunction()
+        while self.peek() == ('word', 'or'):
+            self.take('word')
+            expr = ('or', expr, self.conjunction())
+        return expr
+
+    def conjunction(self):
+        expr = self.comparison()
+        while self.peek() == ('word', 'and'):
+            self.take('word')
+            expr = ('and', expr, self.comparison())
+        return expr
+
+    def comparison(self):
+        expr = self.term()
+        if self.peek()[0] == 'op':
+            (kind, op) = self.take('op')
+            expr = ('cmp', op, expr, self.term())
+        return expr
+
+    def term(self):
+        (kind, value) = self.peek()
+        if kind in ('path', 'literal'):
+            self.pos += 1
+            return (kind, value)
+        elif (kind, value) == ('punct', '('):
+            self.take('punct', '(')
+            expr = self.pipe()
+            self.take('punct', ')')
+            return expr
+        raise Unsupported(f'unexpected token {(kind, value)}')
+
+
+def parse(query: str) -> tuple:
+    """
+    Parse a jq query into an expression tree, raises Unsupported if the query is outside of the supported subset.
+    """
+    return _Parser(_tokenize(query)).parse()
+
+
+def _jq_order(v):
+    # Order of values of different types in jq: null < false < true < numbers < strings
+    if v is None:
+        return 0
+    elif v is False:
+        return 1
+    elif v is True:
+        return 2
+    elif type(v) in (int, float):
+        return 3
+    elif type(v) is str:
+        return 4
+    # Arrays and objects have their own ordering rules, leave them to jq
+    raise Unsupported(f'cannot compare {type(v).__name__}')
+
+
+def _compare(op, a, b):
+    (order_a, order_b) = (_jq_order(a), _jq_order(b))
+    if order_a != order_b or order_a < 3:
+        # Values of different types (or null and booleans) are compared by their type order only
+        (a, b) = (order_a, order_b)
+
+    if op == '==':
+        return a == b
+    elif op == '!=':
+        return a != b
+    elif op == '<':
+        return a < b
+    elif op == '<=':
+        return a <= b
+    elif op == '>':
+        return a > b
+    else:
+        return a >= b
+
+
+def _truthy(v):
+    return v is not None and v is not False
+
+
+def _resolve(v):
+    # Delegates (infosets, state variables) are replaced by their values, as in the JSON representation
+    if type(v) is not dict and hasattr(v, 'fetch'):
+        return v.fetch('')
+    return v
+
+
+def _fetch(infoset, path):
+    v = infoset
+    for item in path:
+        v = _resolve(v)
+        if v is None:
+            return None  # Indexing null returns null in jq
+        elif type(v) is not dict:
+            # jq raises an error
+            raise Unsupported(f'cannot index {type(v).__name__} with {item}')
+        v = v.get(item)
+    return _resolve(v)
+
+
+def compile_expr(expr: tuple):
+    """
+    Compile an expression tree into a function taking an infoset and returning the value the jq query would output.
+    The function raises Unsupported if it encounters a value it can't handle the same way as jq.
+    """
+    kind = expr[0]
+
+    if kind == 'literal':
+        value = expr[1]
+        return lambda infoset: value
+
+    elif kind == 'path':
+        path = expr[1]
+        return lambda infoset: _fetch(infoset, path)
+
+    elif kind == 'cmp':
+        (op, left, right) = (expr[1], compile_expr(expr[2]), compile_expr(expr[3]))
+        return lambda infoset: _compare(op, left(infoset), right(infoset))
+
+    elif kind == 'and':
+        (left, right) = (compile_expr(expr[1]), compile_expr(expr[2]))
+        return lambda infoset: _truthy(left(infoset)) and _truthy(right(infoset))
+
+    elif kind == 'or':
+        (left, right) = (compile_expr(expr[1]), compile_expr(expr[2]))
+        return lambda infoset: _truthy(left(infoset)) or _truthy(right(infoset))
+
+    elif kind == 'not':
+        operand = compile_expr(expr[1])
+        return lambda infoset: not _truthy(operand(infoset))
+
+    elif kind == 'startswith':
+        (operand, prefix) = (compile_expr(expr[1]), expr[2])
+
+        def startswith(infoset):
+            value = operand(infoset)
+            if type(value) is not str:
+                # jq raises an error
+                raise Unsupported('startswith() requires string inputs')
+            return value.startswith(prefix)
+        return startswith
+
+    raise Unsupported(f'unknown expression {kind}')
+
+
+def conjuncts(expr: tuple) -> list:
+    """
+    Split an expression into the list of expressions joined with 'and' on the top level. An empty list is returned for
+    a missing expression.
+    """
+    if expr is None:
+        return []
+    elif expr[0] == 'and':
+        return conjuncts(expr[1]) + conjuncts(expr[2])
+    return [ expr ]
+
+
+def paths(expr: tuple) -> set:
+    # Return all paths accessed by the expression
+    if expr[0] == 'path':
+        return { expr[1] }
+    return set().union(*[ paths(operand) for operand in expr[1:] if type(operand) is tuple and len(operand) > 0 and type(operand[0]) is str ])
+
+
+def restrictions(expr: tuple) -> list:
+    """
+    Return the restrictions implied by an expression which celldb backends can apply before loading cells:
+
+        ('id', value)                   .id == "value"
+        ('id_prefix', prefix)           .id | startswith("prefix")
+        ('path', value)                 .path == "value"
+        ('path_prefix', prefix)         .path | startswith("prefix")
+        ('prop', names, value)          .props.name.subname == value (a string, number or boolean)
+        ('prop_present', names)         .props.name.subname (a non-null value)
+
+    Only restrictions joined with 'and' on the top level are returned, any cell matching the expression satisfies all
+    of them. Other parts of the expression are ignored, cells passing the restrictions still need to be filtered.
+    """
+    found = []
+    for expr in conjuncts(expr):
+        if expr[0] == 'cmp' and expr[1] == '==':
+            (left, right) = expr[2:]
+            if left[0] == 'literal':
+                (left, right) = (right, left)
+            if left[0] != 'path' or right[0] != 'literal':
+                continue
+
+            (path, value) = (left[1], right[1])
+            if path in (('id',), ('path',)) and type(value) is str:
+                found.append( (path[0], value) )
+            elif len(path) > 1 and path[0] == 'props' and type(value) in (str, int, float, bool):
+                found.append( ('prop', path[1:], value) )
+
+        elif expr[0] == 'startswith' and expr[1][0] == 'path' and expr[1][1] in (('id',), ('path',)):
+            found.append( (f'{expr[1][1][0]}_prefix', expr[2]) )
+
+        elif expr[0] == 'path' and len(expr[1]) > 1 and expr[1][0] == 'props':
+            found.append( ('prop_present', expr[1][1:]) )
+
+    return found
+
+
+def prefilter(expr: tuple, fields):
+    """
+    Return a function checking the parts of an expression (joined with 'and' on the top level) which access only the
+    given top level fields, or None if there are no such parts. The function takes a dict containing the fields and
+    returns False if the cell cannot match, this way the rest of the cell doesn't need to be loaded.
+    """
+    checks = [ compile_expr(expr) for expr in conjuncts(expr)
+               if all([ len(path) > 0 and path[0] in fields for path in paths(expr) ]) ]
+    if len(checks) == 0:
+        return None
+
+    def check(data: dict) -> bool:
+        for f in checks:
+            try:
+                if not _truthy(f(data)):
+                    return False
+            except Unsupported:
+                pass  # Left for the full evaluation
+        return True
+    return check
@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+
+from functools import lru_cache
+
+# The unit registry is built on first use, this takes a while
+_ureg = None
+
+
+def unit_registry():
+    global _ureg
+
+    if _ureg is None:
+        import pint
+        _ureg = pint.UnitRegistry(case_sensitive=False)
+    return _ureg
+
+
+@lru_cache(maxsize=None)
+def scale_factor(unit: str, canonical: str) -> float:
+    """
+    Return the factor converting values expressed in unit to the canonical unit. Each unit string is parsed only once.
+    Only multiplicative units are supported (no degC).
+    """
+    ureg = unit_registry()
+    return (1 * ureg.parse_units(unit)).to(canonical).magnitude
+
+
+def normalize(measurement: dict, canonical: str) -> dict:
+    """
+    Return a copy of a measurement (a dict with 'v' and 'u' keys) expressed in the canonical unit. The measurement
+    itself is not modified. Measurements without a unit are taken to be in the canonical unit.
+    """
+    unit = measurement.get('u', canonical)
+    if unit == canonical:
+        return dict(measurement, u=canonical)
+    return dict(measurement, v=measurement['v'] * scale_factor(unit, canonical), u=canonical)
+
+
+def convert(values, units, canonical):
+    """
+    Convert a sequence of values to the canonical unit in one go. The units are either a single unit string for all
+    values or a sequence of unit strings matching the values. Returns a numpy array.
+    """
+    import numpy as np
+
+    values = np.asarray(values, dtype=float)
+    if isinstance(units, str):
+        return values * scale_factor(units, canonical)
+
+    factors = { unit: scale_factor(unit, canonical) for unit in set(units) }
+    return values * np.fromiter((factors[unit] for unit in units), dtype=float, count=len(values))
@@ -0,0 +1,266 @@
+#!/usr/bin/env python3
+
+# Allow module load from lib/python in main repo
+import sys
+from pathlib import Path
+currentdir = Path(__file__).resolve(strict=True).parent
+libdir = currentdir.parent.joinpath('lib/python')
+sys.path.append(str(libdir))
+
+import io
+import json
+import logging
+import os
+import structlog
+import unittest
+import jq
+
+from secondlife.infoset import Infoset
+from secondlife.celldb import bind_state_vars
+from secondlife.cli.utils import JQBatch, MatchQuery, all_cells, cell_identifiers, cell_json, identified_cells, process_cells, _cell_data
+from secondlife.plugins.json_files_backend import JsonFiles
+from secondlife.plugins.sql_alchemy_backend import SQLAlchemy
+from secondlife.plugins.groups import GroupsReport
+
+import argparse
+import tempfile
+from unittest import mock
+
+
+class IdsReport(object):
+    # Collects the identifiers of processed cells
+
+    def __init__(self, **kwargs):
+        self.ids = []
+        self.backends = [ kwargs.get('backend') ]
+        self.extras = []
+
+    def process_cell(self, infoset):
+        self.ids.append(infoset.fetch('.id'))
+        self.extras.extend([ (extra['name'], extra.size) for extra in infoset.fetch('.extra') or [] ])
+
+
+class MergedIdsReport(IdsReport):
+
+    def merge(self, other):
+        self.ids.extend(other.ids)
+        self.backends.extend(other.backends)
+        self.extras.extend(other.extras)
+
+
+class FindWithoutArgs(object):
+    # A backend plugin implementing find() the way it was before the path and filter arguments
+
+    def __init__(self, cells):
+        self.cells = cells
+
+    def find(self):  # Generator
+        yield from self.cells
+
+
+class FindWithPath(FindWithoutArgs):
+
+    def find(self, path=None, recursive=True):  # Generator
+        yield from self.cells
+
+
+class TestCliUtils(unittest.TestCase):
+
+    def test_cell_json(self):
+        infoset = Infoset()
+        infoset.put('.id', 'TEST~1')
+        infoset.put('.log', [])
+        bind_state_vars(infoset)
+
+        text = cell_json(infoset)
+        self.assertNotIn('\n', text)
+        self.assertIs(cell_json(infoset), text)
+
+        # Modifying the log invalidates the cached text
+        infoset.fetch('.log').append(dict(type='measurement'))
+        self.assertIn('measurement', cell_json(infoset))
+
+        # So does put()
+        for (path, value) in [ ('.props', dict(brand='Fake')), ('.path', '/BOX~1/') ]:
+            infoset.put(path, value)
+            self.assertEqual(json.loads(cell_json(infoset))[path[1:]], value)
+
+        # Without a VersionedList the log modifications can't be detected
+        infoset.put('.log', [])
+        text = cell_json(infoset)
+        infoset.fetch('.log').append(dict(type='measurement'))
+        self.assertIsNot(cell_json(infoset), text)
+        self.assertIn('measurement', cell_json(infoset))
+
+    def test_jq_batch(self):
+        batch = JQBatch([ jq.compile('.a'), jq.compile('.b[]'), jq.compile('empty # comment') ])
+        text = '{"a": 1, "b": [2, 3]}'
+
+        self.assertEqual(batch.all(text), [ [1], [2, 3], [] ])
+        self.assertEqual(batch.first(text), [ 1, 2, None ])
+        self.assertEqual(JQBatch([]).first(text), [])
+
+    def test_jq_batch_text(self):
+        infoset = Infoset()
+        infoset.put('.id', 'TEST~1')
+        infoset.put('.props', dict(brand='Ünïcode 电池', tags=dict(likely_fake=False, codes=[ 1, 2.5, None, '"x"\n' ])))
+        infoset.put('.log', [])
+        bind_state_vars(infoset)
+
+        queries = [ jq.compile('.props'), jq.compile('.props.tags.codes[]'), jq.compile('.props.brand'), jq.compile('empty') ]
+        text = infoset.to_json(indent=2)
+
+        # Group keys are the same as the text() of each query
+        self.assertEqual(JQBatch(queries).text(cell_json(infoset)), [ query.input(text=text).text() for query in queries ])
+
+        config = argparse.Namespace(key_queries=queries)
+        report = GroupsReport(config=config)
+        report.process_cell(infoset)
+        self.assertEqual(list(report.cells.keys()), [ tuple([ query.input(text=text).text() for query in queries ]) ])
+
+    def test_all_cells_find_without_args(self):
+        cells = []
+        for (i, (path, brand)) in enumerate([ ('/', 'LG'), ('/BOX~1/', 'LG'), ('/BOX~1/', 'Samsung') ]):
+            infoset = Infoset()
+            infoset.put('.id', f'FAKE~{i}')
+            infoset.put('.path', path)
+            infoset.put('.props', dict(brand=brand))
+            infoset.put('.log', [])
+            bind_state_vars(infoset)
+            cells.append(infoset)
+
+        config = argparse.Namespace(path_prefix='/BOX~1/', jq_query=MatchQuery('.props.brand == "LG"'))
+        self.assertEqual([ infoset.fetch('.id') for infoset in all_cells(config, FindWithoutArgs(cells)) ], [ 'FAKE~1' ])
+
+        # Only the arguments accepted are passed
+        with mock.patch.object(FindWithPath, 'find', autospec=True, return_value=iter(cells)) as find:
+            backend = FindWithPath(cells)
+            self.assertEqual([ infoset.fetch('.id') for infoset in all_cells(config, backend) ], [ 'FAKE~1' ])
+        find.assert_called_once_with(backend, path='/BOX~1/')
+
+    def test_identified_cells(self):
+        tempdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tempdir.cleanup)
+
+        backend = JsonFiles(dsn=tempdir.name)
+        backend.init()
+        for i in range(5):
+            backend.put(backend.create(id=f'FAKE~{i}', path='/'))
+
+        config = argparse.Namespace(identifiers=[ 'FAKE~3', 'FAKE~0', 'FAKE~4', 'FAKE~3', 'FAKE~1' ], autocreate=False, path=None,
+                                    path_prefix=None, jq_query=None)
+        with mock.patch('secondlife.cli.utils.FETCH_CHUNK_SIZE', 2), mock.patch.object(backend, 'fetch_many', wraps=backend.fetch_many) as fetch_many:
+            self.assertEqual([ infoset.fetch('.id') for infoset in identified_cells(config, backend) ], config.identifiers)
+            self.assertEqual(fetch_many.call_count, 3)
+
+        # Missing cells are reported together
+        config.identifiers = [ 'FAKE~1', 'FAKE~8', 'FAKE~9' ]
+        with self.assertRaises(SystemExit):
+            list(identified_cells(config, backend))
+
+        config.autocreate = True
+        self.assertEqual([ infoset.fetch('.id') for infoset in identified_cells(config, backend) ], config.identifiers)
+        self.assertIsNotNone(backend.fetch('FAKE~9'))
+
+    def test_identified_cells_stdin(self):
+        tempdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tempdir.cleanup)
+
+        backend = JsonFiles(dsn=tempdir.name)
+        backend.init()
+        for i in range(5):
+            backend.put(backend.create(id=f'FAKE~{i}', path='/'))
+
+        (read_fd, write_fd) = os.pipe()
+        stdin = open(read_fd, 'r')
+        self.addCleanup(stdin.close)
+
+        config = argparse.Namespace(identifiers=[ 'FAKE~4', '-' ], autocreate=False, path=None, path_prefix=None, jq_query=None)
+        with mock.patch('sys.stdin', stdin), mock.patch.object(backend, 'fetch_many', wraps=backend.fetch_many) as fetch_many:
+            cells = identified_cells(config, backend)
+            self.assertEqual(next(cells).fetch('.id'), 'FAKE~4')
+
+            # Lines already written are processed while the pipe is still open
+            os.write(write_fd, b'FAKE~0\n\nFAKE~1\nFAKE')
+            self.assertEqual([ next(cells).fetch('.id') for i in range(2) ], [ 'FAKE~0', 'FAKE~1' ])
+
+            os.write(write_fd, b'~2\nFAKE~3')
+            os.close(write_fd)
+            self.assertEqual([ infoset.fetch('.id') for infoset in cells ], [ 'FAKE~2', 'FAKE~3' ])
+
+            # Lines read at once share a chunk
+            self.assertEqual(fetch_many.call_args_list[0], mock.call([ 'FAKE~4' ]))
+            self.assertEqual([ id for call in fetch_many.call_args_list[1:] for id in call.args[0] ], [ 'FAKE~0', 'FAKE~1', 'FAKE~2', 'FAKE~3' ])
+
+        # Streams without a file descriptor, pack.py reads the identifiers the same way
+        config.identifiers = [ '-' ]
+        with mock.patch('sys.stdin', io.StringIO('FAKE~1\n  FAKE~2  \n\nFAKE~3')):
+            self.assertEqual(list(cell_identifiers(config)), [ 'FAKE~1', 'FAKE~2', 'FAKE~3' ])
+
+        stdin = io.StringIO('\n'.join([ f'FAKE~{i % 5}' for i in range(12) ]))
+        with mock.patch('sys.stdin', stdin), mock.patch('secondlife.cli.utils.FETCH_CHUNK_SIZE', 5):
+            self.assertEqual([ infoset.fetch('.id') for infoset in identified_cells(config, backend) ], [ f'FAKE~{i % 5}' for i in range(12) ])
+
+    def test_process_cells(self):
+        tempdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tempdir.cleanup)
+
+        backend = JsonFiles(dsn=tempdir.name)
+        backend.init()
+        for i in range(20):
+            backend.put(backend.create(id=f'FAKE~{i:02d}', path='/'))
+
+        config = argparse.Namespace(all_cells=True, path_prefix=None, jq_query=MatchQuery('.id != "FAKE~07"'), jobs=1)
+        serial = IdsReport(config=config)
+        process_cells([ serial ], config, backend)
+        self.assertEqual(len(serial.ids), 19)
+
+        config.jobs = 3
+        (parallel, sequential) = (MergedIdsReport(config=config), IdsReport(config=config))
+
+        with mock.patch('secondlife.cli.utils.JOBS_CHUNK_SIZE', 3):
+            process_cells([ parallel, sequential ], config, backend)
+
+        # Both kinds of reports get the cells in the same order as without workers
+        self.assertEqual(parallel.ids, serial.ids)
+        self.assertEqual(sequential.ids, serial.ids)
+
+    def test_process_cells_extras(self):
+        tempdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tempdir.cleanup)
+
+        # Extras of the sql-alchemy backend are loaded lazily through the backend
+        backend = SQLAlchemy(dsn=f'sqlite:///{tempdir.name}/celldb.sqlite', config=argparse.Namespace(loglevel='INFO'))
+        backend.init()
+        for i in range(5):
+            infoset = backend.create(id=f'FAKE~{i}', path='/')
+            infoset.fetch('.extra').append(dict(name='photo.jpg', props={}, ref=None, content=f'JPEG{i}'.encode()))
+            backend.put(infoset)
+
+        config = argparse.Namespace(all_cells=True, path_prefix=None, jq_query=None, jobs=2)
+        report = MergedIdsReport(config=config, backend=backend)
+        with mock.patch('secondlife.cli.utils.JOBS_CHUNK_SIZE', 2):
+            process_cells([ report ], config, backend)
+        self.assertEqual(sorted(report.ids), [ f'FAKE~{i}' for i in range(5) ])
+        self.assertEqual(report.extras, [ ('photo.jpg', 5) ] * 5)
+
+        # Only the reports of this process use the backend
+        self.assertIs(report.backends[0], backend)
+        self.assertEqual(report.backends[1:], [ None ] * 3)
+
+        # The content is not loaded to send the extras to the workers
+        infoset = backend.fetch('FAKE~3')
+        extra = _cell_data(infoset)['extra'][0]
+        self.assertFalse(infoset.fetch('.extra')[0].loaded)
+        self.assertEqual(extra.fetch('.'), dict(name='photo.jpg', props={}, ref=None, content='bytes(len=5)'))
+        with self.assertRaises(RuntimeError):
+            extra['content']
+
+
+if __name__ == '__main__':
+    structlog.configure(
+        wrapper_class=structlog.make_filtering_bound_logger(logging.DEBUG),
+        logger_factory=structlog.PrintLoggerFactory(file=sys.stderr)
+    )
+
+    unittest.main()
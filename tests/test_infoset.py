@@ -11,7 +11,7 @@ import logging
 import structlog
 import unittest
 
-from secondlife.infoset import Infoset
+from secondlife.infoset import Infoset, VersionedList, compile_path
 
 
 class TestInfoset(unittest.TestCase):
@@ -25,6 +25,38 @@ class TestInfoset(unittest.TestCase):
         self.assertEqual(infoset.fetch('.dict'), {'key': 'value'})
         self.assertEqual(infoset.fetch('.dict.notexist', 'FAKE_VALUE'), 'FAKE_VALUE')
 
+    def test_compiled_path(self):
+        infoset = Infoset()
+
+        self.assertIs(compile_path('.dict.key'), compile_path('.dict.key'))
+        self.assertEqual(compile_path('..dict.key.'), ('dict', 'key'))
+
+        infoset.put(compile_path('.dict.key'), 'value')
+        infoset.put('.embedded', Infoset())
+        infoset.put(compile_path('.embedded.key.inside'), 42)
+
+        self.assertEqual(infoset.fetch(compile_path('.dict')), {'key': 'value'})
+        self.assertEqual(infoset.fetch('.embedded.key.inside'), 42)
+        self.assertEqual(infoset.fetch(compile_path('.dict.notexist'), 'FAKE_VALUE'), 'FAKE_VALUE')
+
+    def test_versioned_list(self):
+        log = VersionedList([ dict(type='lifecycle') ])
+        self.assertEqual(log.version, 0)
+
+        log.append(dict(type='test-event'))
+        log[0] = dict(type='replaced')
+        log.extend([])
+        self.assertEqual(log.version, 3)
+        self.assertEqual(log, [ dict(type='replaced'), dict(type='test-event') ])
+
+        infoset = Infoset()
+        infoset.put('.log', log)
+        self.assertEqual(infoset.to_json(), '{"log": [{"type": "replaced"}, {"type": "test-event"}]}')
+        self.assertEqual(infoset.version, 1)
+
+        infoset.put('.props.brand', 'Fake')
+        self.assertEqual(infoset.version, 2)
+
     def test_paths(self):
 
         infoset = Infoset()
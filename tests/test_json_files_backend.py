@@ -12,18 +12,23 @@ import structlog
 import unittest
 
 from secondlife.infoset import Infoset
+from secondlife.plugins.api import v1
 from secondlife.plugins.json_files_backend import JsonFiles
+from secondlife.predicate import parse
 
 import tempfile
 import os
+from unittest import mock
 
 
 class TestJsonFilesBackend(unittest.TestCase):
     def setUp(self):
-        with tempfile.TemporaryDirectory() as tempdir:
-            self.dsn = tempdir
-            self.backend = JsonFiles(dsn=self.dsn)
-            self.backend.init()
+        tempdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tempdir.cleanup)
+
+        self.dsn = tempdir.name
+        self.backend = JsonFiles(dsn=self.dsn)
+        self.backend.init()
 
     def test_create(self):
         infoset = self.backend.create(id='FAKE~1', path='/')
@@ -39,7 +44,153 @@ class TestJsonFilesBackend(unittest.TestCase):
         self.assertEqual(first_event, dict(type='lifecycle', event='created', path='/'))
 
     def test_put(self):
-        pass
+        infoset = self.backend.create(id='FAKE~1', path='/')
+        infoset.put('.props.brand', 'FAKE')
+        self.backend.put(infoset)
+
+        infoset = JsonFiles(dsn=self.dsn).fetch('FAKE~1')
+        self.assertEqual(infoset.fetch('.id'), 'FAKE~1')
+        self.assertEqual(infoset.fetch('.path'), '/')
+        self.assertEqual(infoset.fetch('.props.brand'), 'FAKE')
+
+    def test_fetch_not_found(self):
+        self.assertIsNone(self.backend.fetch('FAKE~404'))
+
+    def test_move(self):
+        self.backend.put(self.backend.create(id='BOX~1', path='/'))
+        self.backend.put(self.backend.create(id='FAKE~1', path='/'))
+
+        self.backend.move('FAKE~1', '/BOX~1/')
+
+        # Both the current instance and a new one reading the index from disk need to see the new location
+        for backend in (self.backend, JsonFiles(dsn=self.dsn)):
+            self.assertEqual(backend.fetch('FAKE~1').fetch('.path'), '/BOX~1/')
+
+    def test_index_fallback(self):
+        self.backend.put(self.backend.create(id='BOX~1', path='/'))
+        self.backend.put(self.backend.create(id='FAKE~1', path='/'))
+
+        # Stale index entry
+        os.rename(Path(self.dsn, 'FAKE~1'), Path(self.dsn, 'BOX~1', 'FAKE~1'))
+        self.assertEqual(JsonFiles(dsn=self.dsn).fetch('FAKE~1').fetch('.path'), '/BOX~1/')
+
+        # Missing index
+        os.unlink(Path(self.dsn, JsonFiles.INDEX_FILENAME))
+        self.assertEqual(JsonFiles(dsn=self.dsn).fetch('FAKE~1').fetch('.path'), '/BOX~1/')
+        self.assertTrue(Path(self.dsn, JsonFiles.INDEX_FILENAME).exists())
+
+    def test_find_workers(self):
+        for i in range(20):
+            self.backend.put(self.backend.create(id=f'FAKE~{i}', path='/'))
+
+        serial = [ infoset.fetch('.id') for infoset in self.backend.find() ]
+        self.assertEqual(len(serial), 20)
+        self.assertEqual([ infoset.fetch('.id') for infoset in self.backend.find(workers=3) ], serial)
+
+    def test_memoized_state_vars(self):
+        computed = []
+
+        class LogLength(object):
+            def __init__(self, **kwargs):
+                self._cell = kwargs['cell']
+
+            def fetch(self, path, default=None):
+                computed.append(path)
+                return len(self._cell.fetch('.log'))
+
+        self.backend.put(self.backend.create(id='FAKE~1', path='/'))
+
+        with mock.patch.dict(v1.state_vars, dict(log_length=LogLength)):
+            infoset = self.backend.fetch('FAKE~1')
+
+            self.assertEqual(infoset.fetch('.state.log_length'), 1)
+            self.assertEqual(infoset.fetch('.state.log_length'), 1)
+            self.assertEqual(len(computed), 1)
+
+            infoset.fetch('.log').append(dict(type='test-event'))
+            self.assertEqual(infoset.fetch('.state.log_length'), 2)
+            self.assertEqual(len(computed), 2)
+
+    def test_paths_valid(self):
+        self.backend.put(self.backend.create(id='BOX~1', path='/'))
+        self.backend.put(self.backend.create(id='BOX~2', path='/BOX~1/'))
+
+        self.assertEqual(self.backend.paths_valid(['/', '/BOX~1/', '/BOX~1/BOX~2', '/BOX~1/BOX~3/', 'BOX~1/']),
+                         [True, True, True, False, False])
+        self.assertIsNone(self.backend.create(id='FAKE~1', path='/BOX~3/'))
+
+    def test_find_filter(self):
+        self.backend.put(self.backend.create(id='BOX~1', path='/'))
+        for i in range(4):
+            infoset = self.backend.create(id=f'FAKE~{i}', path='/BOX~1/' if i > 0 else '/')
+            infoset.put('.props.brand', 'LG' if i % 2 == 0 else 'Samsung')
+            infoset.put('.props.tags', dict(likely_fake=True) if i == 1 else {})
+            self.backend.put(infoset)
+
+        def found(query):
+            return sorted([ infoset.fetch('.id') for infoset in self.backend.find(filter=parse(query)) ])
+
+        self.assertEqual(found('.id == "FAKE~2"'), ['FAKE~2'])
+        self.assertEqual(found('.id | startswith("FAKE")'), ['FAKE~0', 'FAKE~1', 'FAKE~2', 'FAKE~3'])
+        self.assertEqual(found('.path == "/BOX~1/"'), ['FAKE~1', 'FAKE~2', 'FAKE~3'])
+        self.assertEqual(found('(.path | startswith("/BOX")) and .props.brand == "LG"'), ['FAKE~2'])
+        self.assertEqual(found('.props.tags.likely_fake'), ['FAKE~1'])
+        self.assertEqual(found('.props.tags.likely_fake == true or .props.brand == "LG"'), ['FAKE~0', 'FAKE~1', 'FAKE~2'])
+
+    def test_find_path(self):
+        self.backend.put(self.backend.create(id='BOX~1', path='/'))
+        self.backend.put(self.backend.create(id='BOX~2', path='/BOX~1/'))
+        self.backend.put(self.backend.create(id='FAKE~1', path='/BOX~1/'))
+        self.backend.put(self.backend.create(id='FAKE~2', path='/BOX~1/BOX~2/'))
+
+        def found(path, recursive=True, query=None):
+            return sorted([ infoset.fetch('.id') for infoset in
+                            self.backend.find(path=path, recursive=recursive, filter=parse(query) if query else None) ])
+
+        self.assertEqual(found('/BOX~1/'), ['BOX~2', 'FAKE~1', 'FAKE~2'])
+        self.assertEqual(found('/BOX~1', recursive=False), ['BOX~2', 'FAKE~1'])
+        self.assertEqual(found('/', recursive=False), ['BOX~1'])
+        self.assertEqual(found('/BOX~1/BOX~2/'), ['FAKE~2'])
+        self.assertEqual(found('/BOX~3/'), [])
+        self.assertEqual(found('/BOX~1/', query='.id == "FAKE~2"'), ['FAKE~2'])
+        self.assertEqual(found('/BOX~1/BOX~2/', query='.id == "FAKE~1"'), [])
+        self.assertEqual(found('/BOX~1/BOX~2/', query='.path | startswith("/BOX~1/")'), ['FAKE~2'])
+
+    def test_fetch_many(self):
+        for i in range(5):
+            self.backend.put(self.backend.create(id=f'FAKE~{i}', path='/'))
+
+        found = self.backend.fetch_many(['FAKE~3', 'FAKE~1', 'FAKE~9', 'FAKE~3'])
+        self.assertEqual(sorted(found.keys()), ['FAKE~1', 'FAKE~3'])
+        self.assertEqual(found['FAKE~3'].fetch('.id'), 'FAKE~3')
+        self.assertEqual(self.backend.fetch_many([]), {})
+
+    def test_lazy_extra(self):
+        infoset = self.backend.create(id='FAKE~1', path='/')
+        infoset.fetch('.extra').append(dict(name='photo.jpg', props={}, ref=None, content=b'JPEG'))
+        self.backend.put(infoset)
+
+        extra_filename = Path(self.dsn, 'FAKE~1', 'photo.jpg')
+        os.utime(extra_filename, ns=(0, 0))
+
+        infoset = JsonFiles(dsn=self.dsn).fetch('FAKE~1')
+        extra = infoset.fetch('.extra')[0]
+        self.assertIn('bytes(len=4)', infoset.to_json())
+        self.assertFalse(extra.loaded)
+
+        # Unchanged content is not rewritten
+        self.backend.put(infoset)
+        self.assertEqual(extra_filename.stat().st_mtime_ns, 0)
+        self.assertFalse(extra.loaded)
+
+        self.assertEqual(extra['content'], b'JPEG')
+        self.assertTrue(extra.loaded)
+        self.assertEqual(extra['name'], 'photo.jpg')
+
+        # Content is carried over when moving
+        self.backend.put(self.backend.create(id='BOX~1', path='/'))
+        self.backend.move('FAKE~1', '/BOX~1/')
+        self.assertEqual(Path(self.dsn, 'BOX~1', 'FAKE~1', 'photo.jpg').read_bytes(), b'JPEG')
 
 
 if __name__ == '__main__':
@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+
+# Allow module load from lib/python in main repo
+import sys
+from pathlib import Path
+currentdir = Path(__file__).resolve(strict=True).parent
+libdir = currentdir.parent.joinpath('lib/python')
+sys.path.append(str(libdir))
+
+import itertools
+import logging
+import os
+import random
+import statistics
+import structlog
+import subprocess
+import unittest
+from argparse import Namespace
+from unittest import mock
+
+from secondlife.packing import Layout, Run, Score, BranchAndBound, KDTree, improved, stop, cost, optimize, assign, match
+from secondlife.plugins.api import v1
+import secondlife.plugins.strategies  # noqa: F401
+
+
+def _score(capacity, ir, blocks):
+    # The string parameters computed from scratch, the same way as pack.py does for Block and String objects
+    ir_stdev_pct = [ statistics.stdev([ ir[i] for i in cells ]) / statistics.mean([ ir[i] for i in cells ]) * 100 for cells in blocks ]
+    block_capa = [ sum([ capacity[i] for i in cells ]) for cells in blocks ]
+    return Score(max(ir_stdev_pct), statistics.stdev(block_capa) / statistics.mean(block_capa) * 100)
+
+
+class TestPacking(unittest.TestCase):
+
+    def test_numpy_not_imported(self):
+        # Loading the strategy plugins to register them doesn't import numpy
+        code = 'import sys; import secondlife.plugins.strategies; print("numpy" in sys.modules)'
+        result = subprocess.run([ sys.executable, '-c', code ], env=dict(os.environ, PYTHONPATH=str(libdir)), capture_output=True,
+                                text=True, check=True)
+        self.assertEqual(result.stdout.strip(), 'False')
+
+    def test_layout(self):
+        rng = random.Random(1)
+        capacity = [ rng.gauss(2500, 200) for i in range(50) ]
+        ir = [ rng.gauss(50, 10) for i in range(50) ]
+
+        layout = Layout(capacity, ir, 4, 10)
+        self.assertEqual(layout.blocks()[1], [ 1, 5, 9, 13, 17, 21, 25, 29, 33, 37 ])
+
+        with mock.patch('secondlife.packing.REFRESH_INTERVAL', 7):
+            for i in range(100):
+                layout.swap(*rng.sample(range(len(capacity)), 2))
+
+                expected = _score(capacity, ir, layout.blocks())
+                self.assertAlmostEqual(layout.score().max_block_ir_stdev_pct, expected.max_block_ir_stdev_pct)
+                self.assertAlmostEqual(layout.score().blocks_capa_stdev_pct, expected.blocks_capa_stdev_pct)
+
+        # Each cell is used at most once
+        used = [ i for cells in layout.blocks() for i in cells ]
+        self.assertEqual(len(set(used)), 40)
+
+    def test_improved(self):
+        self.assertTrue(improved(Score(20, 1), Score(19, 5)))
+        self.assertFalse(improved(Score(12, 1.5), Score(11, 1)))
+        self.assertTrue(improved(Score(12, 3), Score(13, 2.5)))
+
+        self.assertTrue(stop(Score(10, 1)))
+        self.assertFalse(stop(Score(10, 1.1)))
+
+    def test_assign_lpt(self):
+        rng = random.Random(1)
+        capacity = [ rng.gauss(2500, 200) for i in range(50) ]
+        ir = [ rng.gauss(50, 10) for i in range(50) ]
+
+        layout = Layout(capacity, ir, 4, 10)
+        layout.assign_lpt()
+
+        # The 40 cells with the highest capacity are used, 10 in each block
+        blocks = layout.blocks()
+        self.assertEqual([ len(cells) for cells in blocks ], [ 10 ] * 4)
+        self.assertEqual(sorted([ i for cells in blocks for i in cells ]), sorted(sorted(range(50), key=lambda i: -capacity[i])[:40]))
+        self.assertEqual(sorted(layout.order), list(range(50)))
+
+        # Block sums differ by less than the capacity of a single cell
+        block_capa = [ sum([ capacity[i] for i in cells ]) for cells in blocks ]
+        self.assertLess(max(block_capa) - min(block_capa), max(capacity))
+        self.assertAlmostEqual(layout.score().blocks_capa_stdev_pct, _score(capacity, ir, blocks).blocks_capa_stdev_pct)
+
+    def test_strategies(self):
+        rng = random.Random(1)
+        config = Namespace(optimizer_timeout=2, total_timeout=2, annealing_temperature=1.0, annealing_cooling=0.999,
+                           annealing_final_temperature=0.001)
+        capacity = [ rng.gauss(2500, 200) for i in range(60) ]
+        ir = [ rng.gauss(50, 5) for i in range(60) ]
+
+        results = dict()
+        for codeword in ('hill-climb', 'annealing', 'greedy', '2-opt'):
+            with self.subTest(strategy=codeword):
+                layout = Layout(capacity, ir, 5, 10)
+                initial = layout.score()
+                optimize(v1.strategies[codeword], layout, config, Run(config), seed=1)
+                results[codeword] = layout.score()
+
+                self.assertEqual(sorted(layout.order), list(range(60)))
+                expected = _score(capacity, ir, layout.blocks())
+                self.assertAlmostEqual(layout.score().blocks_capa_stdev_pct, expected.blocks_capa_stdev_pct)
+
+        # The greedy partition balances only the capacity, 2-opt starts from it. Hill climbing follows improved() instead
+        # of the cost.
+        self.assertLess(results['greedy'].blocks_capa_stdev_pct, initial.blocks_capa_stdev_pct)
+        self.assertLessEqual(cost(results['2-opt']), cost(results['greedy']) + 1e-6)
+        self.assertLessEqual(cost(results['annealing']), cost(initial) + 1e-6)
+
+    def test_annealing_config(self):
+        for (temperature, cooling, final) in ((1.0, 1.0, 0.001), (1.0, 1.5, 0.001), (1.0, 0.0, 0.001), (1.0, 0.999, 1.0),
+                                              (1.0, 0.999, 0.0), (0.001, 0.999, 1.0)):
+            with self.subTest(temperature=temperature, cooling=cooling, final=final):
+                config = Namespace(optimizer_timeout=2, total_timeout=2, annealing_temperature=temperature, annealing_cooling=cooling,
+                                   annealing_final_temperature=final)
+                with self.assertRaises(SystemExit):
+                    optimize(v1.strategies['annealing'], Layout([ 1.0, 2.0 ], [ 1.0, 1.0 ], 1, 2), config, Run(config))
+
+    def test_seed(self):
+        rng = random.Random(1)
+        config = Namespace(optimizer_timeout=60, total_timeout=60, share_interval=300, annealing_temperature=1.0,
+                           annealing_cooling=0.999, annealing_final_temperature=0.001)
+        capacity = [ rng.gauss(2500, 200) for i in range(120) ]
+        ir = [ rng.gauss(50, 20) for i in range(120) ]
+
+        # Runs limited by the amount of iterations are reproducible, also with parallel chains
+        for jobs in (1, 2):
+            with self.subTest(jobs=jobs):
+                orders = []
+                for seed in (1, 1, 2):
+                    layout = Layout(capacity, ir, 10, 10)
+                    optimize(v1.strategies['annealing'], layout, config, Run(config, iterations=1200), jobs=jobs, seed=seed)
+                    self.assertEqual(sorted(layout.order), list(range(120)))
+                    orders.append(layout.order)
+
+                self.assertEqual(orders[0], orders[1])
+                self.assertNotEqual(orders[0], orders[2])
+
+    def test_branch_and_bound(self):
+        rng = random.Random(1)
+        config = Namespace(optimizer_timeout=60, total_timeout=60)
+
+        for i in range(5):
+            capacity = [ rng.gauss(2500, 200) for i in range(7) ]
+            ir = [ rng.gauss(50, 8) for i in range(7) ]
+
+            # All orders of the pool cover all layouts
+            costs = []
+            layout = Layout(capacity, ir, 2, 3)
+            for order in itertools.permutations(range(7)):
+                layout.set_order(order)
+                costs.append(cost(layout.score()))
+            optimum = min(costs)
+
+            layout = Layout(capacity, ir, 2, 3)
+            (best, lower_bound) = BranchAndBound(layout, Run(config)).solve()
+            self.assertAlmostEqual(best, optimum)
+            self.assertAlmostEqual(lower_bound, optimum)
+            self.assertAlmostEqual(cost(layout.score()), optimum)
+
+        # An unfinished search returns a lower bound below the best cost found
+        capacity = [ rng.gauss(2500, 200) for i in range(28) ]
+        ir = [ rng.gauss(50, 5) for i in range(28) ]
+        layout = Layout(capacity, ir, 7, 4)
+        (best, lower_bound) = BranchAndBound(layout, Run(config, iterations=500)).solve()
+        self.assertLessEqual(lower_bound, best)
+        self.assertAlmostEqual(cost(layout.score()), best)
+        self.assertEqual(sorted(layout.order), list(range(28)))
+
+    def test_kdtree(self):
+        rng = random.Random(1)
+        points = [ (rng.gauss(2500, 200), 1.5 * rng.gauss(50, 10)) for i in range(300) ]
+        points += points[:20]  # Equal distances are ordered by index
+
+        def distance(a, b):
+            return abs(a[0] - b[0]) + abs(a[1] - b[1])
+
+        tree = KDTree(points, leaf_size=4)
+        removed = set(rng.sample(range(len(points)), 100))
+        for i in removed:
+            tree.remove(i)
+        self.assertEqual(len(tree), len(points) - 100)
+
+        for i in range(50):
+            query = (rng.gauss(2500, 250), 1.5 * rng.gauss(50, 12))
+            expected = sorted([ (distance(point, query), i) for (i, point) in enumerate(points) if i not in removed ])[:5]
+            self.assertEqual([ i for (d, i) in tree.nearest(query, k=5) ], [ i for (d, i) in expected ])
+
+        self.assertEqual(KDTree([]).nearest((1, 2)), [])
+
+    def test_assign(self):
+        rng = random.Random(1)
+        for i in range(20):
+            costs = [ [ rng.randint(0, 20) for column in range(6) ] for row in range(4) ]
+            assignment = assign(costs)
+
+            self.assertEqual(len(set(assignment)), 4)
+            optimum = min([ sum([ costs[row][columns[row]] for row in range(4) ]) for columns in itertools.permutations(range(6), 4) ])
+            self.assertEqual(sum([ costs[row][assignment[row]] for row in range(4) ]), optimum)
+
+        with self.assertRaises(ValueError):
+            assign([ [ 1 ], [ 2 ] ])
+
+        # Cells close to each other compete for the same replacement
+        tree = KDTree([ (0, 0), (10, 0), (100, 0) ])
+        self.assertEqual(match(tree, [ (4, 0), (1, 0) ]), [ 1, 0 ])
+
+
+if __name__ == '__main__':
+    structlog.configure(
+        wrapper_class=structlog.make_filtering_bound_logger(logging.DEBUG),
+        logger_factory=structlog.PrintLoggerFactory(file=sys.stderr)
+    )
+
+    unittest.main()
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+
+# Allow module load from lib/python in main repo
+import sys
+from pathlib import Path
+currentdir = Path(__file__).resolve(strict=True).parent
+libdir = currentdir.parent.joinpath('lib/python')
+sys.path.append(str(libdir))
+
+import importlib
+import logging
+import structlog
+import tempfile
+import unittest
+from unittest import mock
+
+from secondlife.plugins.api import v1, load_plugins
+
+PLUGIN_SOURCE = '''
+from secondlife.plugins.api import v1
+
+v1.register_report(v1.Report('fake', object))
+'''
+
+
+class TestPlugins(unittest.TestCase):
+
+    def setUp(self):
+        tempdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tempdir.cleanup)
+
+        # A plugin namespace with a single module
+        self.package = Path(tempdir.name) / 'src' / 'fakeplugins'
+        self.package.mkdir(parents=True)
+        (self.package / '__init__.py').write_text('')
+        (self.package / 'fake_report.py').write_text(PLUGIN_SOURCE)
+
+        sys.path.insert(0, str(self.package.parent))
+        self.addCleanup(sys.path.remove, str(self.package.parent))
+
+        for patcher in [ mock.patch('xdg.XDG_CACHE_HOME', Path(tempdir.name) / 'cache'), mock.patch.dict(v1.reports) ]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def _forget(self):
+        # Simulate a new CLI invocation
+        for name in [ 'fakeplugins', 'fakeplugins.fake_report' ]:
+            sys.modules.pop(name, None)
+        del v1.reports['fake']
+        importlib.invalidate_caches()
+
+    def test_manifest(self):
+        load_plugins(importlib.import_module('fakeplugins'))
+        self.assertIn('fakeplugins.fake_report', sys.modules)
+        self.assertIs(v1.reports['fake'].handler_class, object)
+        self._forget()
+
+        # The codeword is known without importing the module
+        load_plugins(importlib.import_module('fakeplugins'))
+        self.assertIn('fake', v1.reports.keys() | v1.state_vars.keys())
+        self.assertNotIn('fakeplugins.fake_report', sys.modules)
+
+        self.assertIs(v1.reports['fake'].handler_class, object)
+        self.assertIn('fakeplugins.fake_report', sys.modules)
+        self._forget()
+
+        # A modified plugin is imported and the manifest rebuilt
+        (self.package / 'fake_report.py').write_text(PLUGIN_SOURCE.replace('object', 'dict'))
+        load_plugins(importlib.import_module('fakeplugins'))
+        self.assertIn('fakeplugins.fake_report', sys.modules)
+        self.assertIs(v1.reports['fake'].handler_class, dict)
+
+
+if __name__ == '__main__':
+    structlog.configure(
+        wrapper_class=structlog.make_filtering_bound_logger(logging.DEBUG),
+        logger_factory=structlog.PrintLoggerFactory(file=sys.stderr)
+    )
+
+    unittest.main()
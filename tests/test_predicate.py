@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+
+# Allow module load from lib/python in main repo
+import sys
+from pathlib import Path
+currentdir = Path(__file__).resolve(strict=True).parent
+libdir = currentdir.parent.joinpath('lib/python')
+sys.path.append(str(libdir))
+
+import logging
+import structlog
+import unittest
+import jq
+from unittest import mock
+
+from secondlife.infoset import Infoset
+from secondlife.celldb import bind_state_vars
+from secondlife.plugins.api import v1
+from secondlife.predicate import parse, compile_expr, restrictions, prefilter, Unsupported
+from secondlife.cli.utils import MatchQuery
+
+
+class UsableCapacity(object):
+    def __init__(self, **kwargs):
+        self._cell = kwargs['cell']
+
+    def fetch(self, path, default=None):
+        return self._cell.fetch('.log')[0]['results']['capacity']
+
+
+def _cell(id, path, props):
+    infoset = Infoset()
+    infoset.put('.id', id)
+    infoset.put('.path', path)
+    infoset.put('.props', props)
+    infoset.put('.log', [ dict(type='measurement', event='finished', ts=1,
+        results=dict(capacity=dict(v=2100 if id.endswith('1') else 1900, u='mAh'), IR=dict(v=45, u='mOhm'))) ])
+    infoset.put('.extra', [])
+    bind_state_vars(infoset)
+    return infoset
+
+
+class TestPredicate(unittest.TestCase):
+
+    def setUp(self):
+        patcher = mock.patch.dict(v1.state_vars, dict(usable_capacity=UsableCapacity))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.cells = [
+            _cell('TEST~1', '/STOCK/', dict(brand='LG', model='MJ1', tags=dict(likely_fake=True), capacity=None)),
+            _cell('TEST~2', '/BOX~1/', dict(brand='Samsung', model=None, tags={}, count=3)),
+            _cell('TEST~3', '/', dict(brand=None, tags=dict(likely_fake=False), count=3.0, flag=False)),
+        ]
+
+    def test_parse(self):
+        self.assertEqual(parse('.path == "/STOCK/"'), ('cmp', '==', ('path', ('path',)), ('literal', '/STOCK/')))
+        self.assertEqual(parse('.a and .b or .c | not'),
+            ('not', ('or', ('and', ('path', ('a',)), ('path', ('b',))), ('path', ('c',)))))
+        self.assertEqual(parse('.path | startswith("/BOX")'), ('startswith', ('path', ('path',)), '/BOX'))
+
+        for query in [ '.log[0]', '.a | length', '.a // 1', 'select(.a)', '"\\(.a)"', '.a == 1 # comment', '.a + 1', 'not' ]:
+            with self.assertRaises(Unsupported, msg=query):
+                parse(query)
+
+    def test_same_as_jq(self):
+        queries = [
+            '.path == "/STOCK/"',
+            '.path != "/STOCK/"',
+            '.props.tags.likely_fake != true',
+            '.props.tags.likely_fake == false',
+            '.props.missing.deeper == null',
+            '.state.usable_capacity.v > 2000',
+            '.state.usable_capacity.v <= 1900 and .props.brand == "Samsung"',
+            '.props.brand == "LG" or .props.brand == null',
+            '(.props.brand == "LG") | not',
+            '.props.brand | not',
+            '.props.count == 3',
+            '.props.count < "3"',
+            '.props.brand > null',
+            '.props.flag < true',
+            '.props.model',
+            '.path | startswith("/BOX")',
+            '(.path | startswith("/")) and .props.brand == "LG"',
+            '-1 < .props.count',
+            '.props.tags',
+            '.props.tags == .props.tags',
+            '.props.brand | startswith("L")',
+        ]
+
+        for query in queries:
+            program = jq.compile(query)
+            match = MatchQuery(query)
+            self.assertIsNotNone(match.expr, msg=query)
+            for cell in self.cells:
+                try:
+                    expected = program.input(text=cell.to_json()).first()
+                except ValueError:
+                    # jq reports an error, the native evaluation has to fall back to it
+                    with self.assertRaises(ValueError, msg=query):
+                        match.first(cell)
+                    continue
+
+                self.assertEqual(match.first(cell), expected, msg=f'{query} {cell.fetch(".id")}')
+
+    def test_restrictions(self):
+        expr = parse('(.id | startswith("FAKE")) and .path == "/BOX~1/" and (.props.brand == "LG" or .props.brand == "Samsung") and '
+                     '.props.tags.likely_fake and 2000 == .props.capacity and .props.model == null')
+        self.assertEqual(restrictions(expr), [ ('id_prefix', 'FAKE'), ('path', '/BOX~1/'), ('prop_present', ('tags', 'likely_fake')),
+                                               ('prop', ('capacity',), 2000) ])
+        self.assertEqual(restrictions(parse('.id == "FAKE~1" or .id == "FAKE~2"')), [])
+
+        check = prefilter(parse('.props.brand == "LG" and .state.usable_capacity.v > 2000'), ('id', 'path', 'props'))
+        self.assertTrue(check(dict(props=dict(brand='LG'))))
+        self.assertFalse(check(dict(props=dict(brand='Samsung'))))
+        self.assertIsNone(prefilter(parse('.state.usable_capacity.v > 2000'), ('id', 'path', 'props')))
+
+    def test_state_vars(self):
+        # Values of state variables are evaluated natively, without falling back to jq
+        self.assertEqual(compile_expr(parse('.state.usable_capacity.v'))(self.cells[0]), 2100)
+        self.assertEqual(compile_expr(parse('.state.usable_capacity.missing'))(self.cells[0]), None)
+
+    def test_fallback(self):
+        # The whole query is not supported
+        match = MatchQuery('.props.brand // "" | ascii_downcase == "lg"')
+        self.assertIsNone(match.expr)
+        self.assertEqual([ match.first(cell) for cell in self.cells ], [ True, False, False ])
+
+        # The value is not supported
+        with self.assertRaises(Unsupported):
+            compile_expr(parse('.props.tags == .props.tags'))(self.cells[0])
+
+
+if __name__ == '__main__':
+    structlog.configure(
+        wrapper_class=structlog.make_filtering_bound_logger(logging.DEBUG),
+        logger_factory=structlog.PrintLoggerFactory(file=sys.stderr)
+    )
+
+    unittest.main()
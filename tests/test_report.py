@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+
+# Allow module load from lib/python in main repo
+import sys
+from pathlib import Path
+currentdir = Path(__file__).resolve(strict=True).parent
+libdir = currentdir.parent.joinpath('lib/python')
+sys.path.append(str(libdir))
+
+import argparse
+import contextlib
+import csv
+import io
+import json
+import logging
+import pickle
+import random
+import structlog
+import tempfile
+import unittest
+
+import numpy as np
+
+from secondlife.cli.report import ExternalSorter, ReportOutput, ReportTable, ReportSections
+
+
+class TestReport(unittest.TestCase):
+
+    def test_external_sort(self):
+        keys = [ random.randrange(100) for i in range(1000) ]
+
+        sorter = ExternalSorter(max_rows=64)
+        for (i, key) in enumerate(keys):
+            sorter.add(key, (key, i))
+        self.assertGreater(len(sorter._runs), 10)
+
+        # Sorted by key, rows with equal keys stay in the order they were added
+        self.assertEqual(list(sorter), sorted([ (key, i) for (i, key) in enumerate(keys) ]))
+
+    def test_table(self):
+        config = argparse.Namespace(report_stream=False, sort_buffer_rows=2)
+        table = ReportTable('test', ['Cell ID', 'Value'], config)
+        for (id, value) in [ ('C~2', 1), ('C~1', 2), ('C~3', 3) ]:
+            table.add( (id, value), key=id )
+
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            table.close()
+        self.assertEqual([ line.split()[1] for line in output.getvalue().splitlines() if 'C~' in line ], ['C~1', 'C~2', 'C~3'])
+
+    def test_stream(self):
+        config = argparse.Namespace(report_stream=True, sort_buffer_rows=2)
+        (table, ordered_table, sections) = (ReportTable('test', ['Cell ID'], config), ReportTable('ordered', ['Cell ID'], config, ordered=True),
+                                            ReportSections('test', config))
+
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            for id in [ 'C~2', 'C~1', 'C~3' ]:
+                table.add( (id,), key=id )
+                ordered_table.add( (id,), key=id )
+                sections.add(f'Log for {id}', 'LOG EMPTY')
+
+            # Rows of unordered tables and sections are printed right away
+            self.assertEqual(output.getvalue().count('C~'), 6)
+            self.assertEqual(output.getvalue().count('Cell ID'), 1)
+
+            table.close()
+            ordered_table.close()
+            sections.close()
+
+        self.assertEqual(output.getvalue().splitlines()[-4:], ['report\tCell ID', 'ordered\tC~1', 'ordered\tC~2', 'ordered\tC~3'])
+
+        # Rows of each report are tagged with its name
+        self.assertEqual([ line for line in output.getvalue().splitlines() if line.startswith('test\t') ], ['test\tC~2', 'test\tC~1', 'test\tC~3'])
+
+    def test_unique(self):
+        config = argparse.Namespace(report_stream=True, sort_buffer_rows=2)
+        (table, sections) = (ReportTable('test', ['Cell ID', 'Value'], config, unique=True), ReportSections('test', config, unique=True))
+
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            # Cells selected twice, e.g. duplicate identifiers on stdin, are reported once
+            for id in [ 'C~2', 'C~1', 'C~2' ]:
+                table.add( (id, 1) )
+                sections.add(f'Log for {id}', 'LOG EMPTY')
+
+            worker_config = argparse.Namespace(output_format='csv', sort_buffer_rows=2, report_buffer=True)
+            worker_table = ReportTable('test', ['Cell ID', 'Value'], worker_config, unique=True)
+            for id in [ 'C~1', 'C~3' ]:
+                worker_table.add( (id, 2) )
+            table.merge(pickle.loads(pickle.dumps(worker_table)))
+
+        self.assertEqual((table.count, sections.count), (3, 2))
+        self.assertEqual([ line for line in output.getvalue().splitlines() if line.startswith('test\t') ],
+                         [ 'test\tC~2\t1', 'test\tC~1\t1', 'test\tC~3\t2' ])
+        self.assertEqual(output.getvalue().count('=== Log for C~2'), 1)
+
+    def test_merge(self):
+        worker_config = argparse.Namespace(output_format='csv', sort_buffer_rows=2, report_buffer=True)
+        (worker_table, worker_sections) = (ReportTable('test', ['Cell ID'], worker_config), ReportSections('test', worker_config))
+        for id in [ 'C~2', 'C~1', 'C~3' ]:
+            worker_table.add( (id,), key=id )
+            worker_sections.add(f'Log for {id}', 'LOG EMPTY')
+
+        config = argparse.Namespace(report_stream=False, sort_buffer_rows=2)
+        (table, sections) = (ReportTable('test', ['Cell ID'], config), ReportSections('test', config))
+        table.merge(pickle.loads(pickle.dumps(worker_table)))
+        sections.merge(pickle.loads(pickle.dumps(worker_sections)))
+        self.assertEqual((table.count, sections.count), (3, 3))
+
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            table.close()
+            sections.close()
+        self.assertEqual([ line.split()[1] for line in output.getvalue().splitlines() if line.startswith('│ C~') ], ['C~1', 'C~2', 'C~3'])
+        self.assertEqual(output.getvalue().count('=== Log for C~'), 3)
+
+    def _write_reports(self, output_format, filename):
+        config = argparse.Namespace(output_format=output_format, output=filename, sort_buffer_rows=2)
+        config.report_output = ReportOutput(config)
+
+        (capacity, infoset) = (ReportTable('capacity', ['Cell ID', 'Capacity [mAh]'], config),
+                               ReportTable('infoset', ['.id', '.props.brand'], config, ordered=True))
+        for (id, value, brand) in [ ('C~2', 2000.5, 'B'), ('C~1', 2500, None), ('C~3', 1500, 'A') ]:
+            capacity.add( (id, value) )
+            infoset.add( (id, brand), key=id )
+        capacity.close()
+        infoset.close()
+
+        config.report_output.close()
+
+    def test_output_csv(self):
+        with tempfile.NamedTemporaryFile(mode='r', suffix='.csv') as f:
+            self._write_reports('csv', f.name)
+            rows = list(csv.reader(f))
+
+        # Rows of the unordered report are written as they come, the ordered one is written when closed. A single header
+        # line has the columns of both reports.
+        self.assertEqual(rows, [
+            [ 'report', 'Cell ID', 'Capacity [mAh]', '.id', '.props.brand' ],
+            [ 'capacity', 'C~2', '2000.5', '', '' ], [ 'capacity', 'C~1', '2500', '', '' ], [ 'capacity', 'C~3', '1500', '', '' ],
+            [ 'infoset', '', '', 'C~1', '' ], [ 'infoset', '', '', 'C~2', 'B' ], [ 'infoset', '', '', 'C~3', 'A' ]
+        ])
+
+    def test_output_csv_interleaved(self):
+        config = argparse.Namespace(output_format='csv', output=None, sort_buffer_rows=2)
+        config.report_output = ReportOutput(config)
+
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            (capacity, ir) = (ReportTable('capacity', ['Cell ID', 'Capacity [mAh]'], config), ReportTable('ir', ['Cell ID', 'IR [mΩ]'], config))
+            for (id, value) in [ ('C~3', 2300.0), ('C~1', 2100.0) ]:
+                capacity.add( (id, value) )
+                ir.add( (id, value / 50) )
+            capacity.close()
+            ir.close()
+            config.report_output.close()
+
+        # The mixed output is a regular CSV file, columns of the same name are shared by the reports
+        reader = csv.DictReader(io.StringIO(output.getvalue()))
+        self.assertEqual(reader.fieldnames, [ 'report', 'Cell ID', 'Capacity [mAh]', 'IR [mΩ]' ])
+        self.assertEqual(list(reader), [
+            { 'report': 'capacity', 'Cell ID': 'C~3', 'Capacity [mAh]': '2300.0', 'IR [mΩ]': '' },
+            { 'report': 'ir', 'Cell ID': 'C~3', 'Capacity [mAh]': '', 'IR [mΩ]': '46.0' },
+            { 'report': 'capacity', 'Cell ID': 'C~1', 'Capacity [mAh]': '2100.0', 'IR [mΩ]': '' },
+            { 'report': 'ir', 'Cell ID': 'C~1', 'Capacity [mAh]': '', 'IR [mΩ]': '42.0' },
+        ])
+
+    def test_output_jsonl(self):
+        with tempfile.NamedTemporaryFile(mode='r', suffix='.jsonl') as f:
+            self._write_reports('jsonl', f.name)
+            rows = [ json.loads(line) for line in f ]
+        self.assertEqual(rows[0], { 'report': 'capacity', 'Cell ID': 'C~2', 'Capacity [mAh]': 2000.5 })
+        self.assertEqual([ row['.props.brand'] for row in rows if row['report'] == 'infoset' ], [ None, 'B', 'A' ])
+
+    def test_output_npz(self):
+        with tempfile.NamedTemporaryFile(suffix='.npz') as f:
+            self._write_reports('npz', f.name)
+            arrays = np.load(f.name)
+
+            self.assertEqual(list(arrays['capacity/Cell ID']), [ 'C~2', 'C~1', 'C~3' ])
+            self.assertEqual(arrays['capacity/Capacity [mAh]'].dtype, float)
+            self.assertEqual(list(arrays['infoset/.id']), [ 'C~1', 'C~2', 'C~3' ])
+
+
+if __name__ == '__main__':
+    structlog.configure(
+        wrapper_class=structlog.make_filtering_bound_logger(logging.DEBUG),
+        logger_factory=structlog.PrintLoggerFactory(file=sys.stderr)
+    )
+
+    unittest.main()
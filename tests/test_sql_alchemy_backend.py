@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+
+# Allow module load from lib/python in main repo
+import sys
+from pathlib import Path
+currentdir = Path(__file__).resolve(strict=True).parent
+libdir = currentdir.parent.joinpath('lib/python')
+sys.path.append(str(libdir))
+
+import argparse
+import logging
+import structlog
+import tempfile
+import unittest
+from unittest import mock
+from sqlalchemy import event, select, text, update
+from sqlalchemy.dialects import postgresql
+
+from secondlife.plugins import sql_alchemy_backend
+from secondlife.plugins.sql_alchemy_backend import SQLAlchemy
+from secondlife.predicate import parse
+
+
+class TestSQLAlchemyBackend(unittest.TestCase):
+    def setUp(self):
+        self.config = argparse.Namespace(loglevel='INFO')
+        self.backend = SQLAlchemy(dsn='sqlite://', config=self.config)
+        self.backend.init()
+
+    def test_put_fetch(self):
+        self.backend.put(self.backend.create(id='BOX~1', path='/'))
+
+        infoset = self.backend.create(id='FAKE~1', path='/BOX~1/')
+        infoset.put('.props.brand', 'FAKE')
+        self.backend.put(infoset)
+
+        infoset = self.backend.fetch('FAKE~1')
+        self.assertEqual(infoset.fetch('.path'), '/BOX~1/')
+        self.assertEqual(infoset.fetch('.props.brand'), 'FAKE')
+        self.assertEqual(infoset.fetch('.log')[0]['event'], 'created')
+
+        self.assertEqual(sorted([ infoset.fetch('.id') for infoset in self.backend.find() ]), ['BOX~1', 'FAKE~1'])
+
+    def test_find_chunks(self):
+        self.backend.put(self.backend.create(id='BOX~1', path='/'))
+        self.backend.put(self.backend.create(id='BOX~2', path='/BOX~1/'))
+        for i in range(5):
+            infoset = self.backend.create(id=f'FAKE~{i}', path='/BOX~1/BOX~2/')
+            infoset.fetch('.log').append(dict(type='measurement', event='finished', ts=i, results={}))
+            self.backend.put(infoset)
+
+        with mock.patch.object(sql_alchemy_backend, 'IN_CHUNK_SIZE', 2):
+            cells = { infoset.fetch('.id'): infoset for infoset in self.backend.find() }
+
+        self.assertEqual(len(cells), 7)
+        self.assertEqual(cells['BOX~2'].fetch('.path'), '/BOX~1/')
+        self.assertEqual(cells['FAKE~3'].fetch('.path'), '/BOX~1/BOX~2/')
+        self.assertEqual([ e['event'] for e in cells['FAKE~3'].fetch('.log') ], ['created', 'finished'])
+        self.assertEqual(cells['FAKE~3'].fetch('.log')[1]['ts'], 3)
+
+    def test_incremental_put(self):
+        infoset = self.backend.create(id='FAKE~1', path='/')
+        for i in range(10):
+            infoset.fetch('.log').append(dict(type='measurement', event='finished', ts=i, results={}))
+        self.backend.put(infoset)
+
+        statements = []
+        event.listen(self.backend.engine, 'before_cursor_execute',
+            lambda conn, cursor, statement, parameters, context, executemany: statements.append(statement))
+
+        infoset = self.backend.fetch('FAKE~1')
+        del statements[:]
+
+        infoset.fetch('.log').append(dict(type='measurement', event='finished', ts=10, results={}))
+        self.backend.put(infoset)
+
+        # Only the new log entry is written, props have not changed
+        self.assertEqual(len(statements), 1)
+        self.assertTrue(statements[0].startswith('INSERT INTO log_entries'))
+
+        infoset.put('.props.brand', 'FAKE')
+        self.backend.put(infoset)
+
+        infoset = self.backend.fetch('FAKE~1')
+        self.assertEqual(len(infoset.fetch('.log')), 12)
+        self.assertEqual(infoset.fetch('.log')[11]['ts'], 10)
+        self.assertEqual(infoset.fetch('.props.brand'), 'FAKE')
+
+    def test_move_subtree(self):
+        self.backend.put(self.backend.create(id='BOX~1', path='/'))
+        self.backend.put(self.backend.create(id='BOX~2', path='/BOX~1/'))
+        self.backend.put(self.backend.create(id='FAKE~1', path='/BOX~1/BOX~2'))
+        self.backend.put(self.backend.create(id='BOX~3', path='/'))
+
+        self.assertEqual(self.backend.fetch('FAKE~1').fetch('.path'), '/BOX~1/BOX~2/')
+
+        self.backend.move('BOX~2', '/BOX~3/')
+
+        self.assertEqual(self.backend.fetch('FAKE~1').fetch('.path'), '/BOX~3/BOX~2/')
+        self.assertEqual(sorted([ infoset.fetch('.id') for infoset in self.backend.find(path='/BOX~3/') ]), ['BOX~2', 'FAKE~1'])
+        self.assertEqual([ infoset.fetch('.id') for infoset in self.backend.find(path='/BOX~1/') ], [])
+
+        # Materialized paths can be rebuilt from the container hierarchy
+        self.backend.session.execute( update(sql_alchemy_backend.Cell).values(path=None) )
+        self.backend.reindex()
+        self.assertEqual(self.backend.fetch('FAKE~1').fetch('.path'), '/BOX~3/BOX~2/')
+
+    def test_migrate(self):
+        tempdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tempdir.cleanup)
+        dsn = f'sqlite:///{tempdir.name}/celldb.sqlite'
+
+        backend = SQLAlchemy(dsn=dsn, config=self.config)
+        backend.init()
+        backend.put(backend.create(id='BOX~1', path='/'))
+        backend.put(backend.create(id='FAKE~1', path='/BOX~1/'))
+        backend.session.close()
+
+        # The schema of databases created before the materialized paths
+        with backend.engine.begin() as conn:
+            conn.execute(text('DROP INDEX ix_cells_path'))
+            conn.execute(text('ALTER TABLE cells DROP COLUMN path'))
+        backend.engine.dispose()
+
+        backend = SQLAlchemy(dsn=dsn, config=self.config)
+        self.assertEqual(backend.fetch('FAKE~1').fetch('.path'), '/BOX~1/')
+        self.assertEqual(sorted([ infoset.fetch('.id') for infoset in backend.find(path='/BOX~1/') ]), ['FAKE~1'])
+        backend.engine.dispose()
+
+    def test_paths_valid(self):
+        self.backend.put(self.backend.create(id='BOX~1', path='/'))
+
+        self.assertEqual(self.backend.existing_ids(['BOX~1', 'BOX~2']), {'BOX~1'})
+        self.assertEqual(self.backend.paths_valid(['/', '/BOX~1/', '/BOX~2/']), [True, True, False])
+
+    def test_find_filter(self):
+        self.backend.put(self.backend.create(id='BOX~1', path='/'))
+        for i in range(4):
+            infoset = self.backend.create(id=f'FAKE~{i}', path='/BOX~1/' if i > 0 else '/')
+            infoset.put('.props.brand', 'LG' if i % 2 == 0 else 'Samsung')
+            infoset.put('.props.tags', dict(likely_fake=True) if i == 1 else {})
+            self.backend.put(infoset)
+
+        def found(query):
+            return sorted([ infoset.fetch('.id') for infoset in self.backend.find(filter=parse(query)) ])
+
+        self.assertEqual(found('.id == "FAKE~2"'), ['FAKE~2'])
+        self.assertEqual(found('.id | startswith("FAKE")'), ['FAKE~0', 'FAKE~1', 'FAKE~2', 'FAKE~3'])
+        self.assertEqual(found('.path == "/BOX~1/"'), ['FAKE~1', 'FAKE~2', 'FAKE~3'])
+        self.assertEqual(found('(.path | startswith("/BOX")) and .props.brand == "LG"'), ['FAKE~2'])
+        self.assertEqual(found('.props.tags.likely_fake'), ['FAKE~1'])
+        self.assertEqual(found('.props.tags.likely_fake == true or .props.brand == "LG"'), ['FAKE~0', 'FAKE~1', 'FAKE~2'])
+
+    def test_restriction_types(self):
+        values = dict(INT=3000, FLOAT=3000.0, STRING='3000', TRUE=True, ONE=1, TEXT='true', OBJECT=dict(v=3000))
+        for (name, value) in values.items():
+            infoset = self.backend.create(id=f'FAKE~{name}', path='/')
+            infoset.put('.props.tags.value', value)
+            self.backend.put(infoset)
+
+        # Only the restriction itself, without the checks in Python
+        def restricted(value):
+            clause = sql_alchemy_backend._restriction_clause(('prop', ('tags', 'value'), value), 'sqlite')
+            return sorted(self.backend.session.execute(select(sql_alchemy_backend.Cell.id).where(clause)).scalars())
+
+        self.assertEqual(restricted(3000), ['FAKE~FLOAT', 'FAKE~INT'])
+        self.assertEqual(restricted(True), ['FAKE~TRUE'])
+        self.assertEqual(restricted(1), ['FAKE~ONE'])
+        self.assertEqual(restricted('3000'), ['FAKE~STRING'])
+
+        # PostgreSQL fails casting strings to numbers, the type is checked first
+        clause = sql_alchemy_backend._restriction_clause(('prop', ('tags', 'value'), 3000), 'postgresql')
+        sql = str(clause.compile(dialect=postgresql.dialect()))
+        self.assertRegex(sql, r'^CASE WHEN \(json_typeof\(.*\) IN .*\) THEN CAST\(')
+
+        self.assertIsNone(sql_alchemy_backend._restriction_clause(('prop', ('brand', ), 3000), 'mssql'))
+
+    def test_find_path(self):
+        self.backend.put(self.backend.create(id='BOX~1', path='/'))
+        self.backend.put(self.backend.create(id='BOX~2', path='/BOX~1/'))
+        self.backend.put(self.backend.create(id='FAKE~1', path='/BOX~1/'))
+        self.backend.put(self.backend.create(id='FAKE~2', path='/BOX~1/BOX~2/'))
+
+        def found(path, recursive=True, query=None):
+            return sorted([ infoset.fetch('.id') for infoset in
+                            self.backend.find(path=path, recursive=recursive, filter=parse(query) if query else None) ])
+
+        self.assertEqual(found('/BOX~1/'), ['BOX~2', 'FAKE~1', 'FAKE~2'])
+        self.assertEqual(found('/BOX~1', recursive=False), ['BOX~2', 'FAKE~1'])
+        self.assertEqual(found('/', recursive=False), ['BOX~1'])
+        self.assertEqual(found('/BOX~1/BOX~2/'), ['FAKE~2'])
+        self.assertEqual(found('/BOX~3/'), [])
+        self.assertEqual(found('/BOX~1/', query='.id == "FAKE~2"'), ['FAKE~2'])
+        self.assertEqual(found('/BOX~1/BOX~2/', query='.id == "FAKE~1"'), [])
+        self.assertEqual(found('/BOX~1/BOX~2/', query='.path | startswith("/BOX~1/")'), ['FAKE~2'])
+
+    def test_fetch_many(self):
+        for i in range(5):
+            self.backend.put(self.backend.create(id=f'FAKE~{i}', path='/'))
+
+        found = self.backend.fetch_many(['FAKE~3', 'FAKE~1', 'FAKE~9', 'FAKE~3'])
+        self.assertEqual(sorted(found.keys()), ['FAKE~1', 'FAKE~3'])
+        self.assertEqual(found['FAKE~3'].fetch('.id'), 'FAKE~3')
+        self.assertEqual(self.backend.fetch_many([]), {})
+
+    def test_lazy_extra(self):
+        infoset = self.backend.create(id='FAKE~1', path='/')
+        infoset.fetch('.extra').append(dict(name='photo.jpg', props={}, ref=None, content=b'JPEG'))
+        self.backend.put(infoset)
+        self.backend.session.expunge_all()
+
+        infoset = self.backend.fetch('FAKE~1')
+        extra = infoset.fetch('.extra')[0]
+        self.assertIn('bytes(len=4)', infoset.to_json())
+        self.assertFalse(extra.loaded)
+
+        self.backend.put(infoset)
+        self.assertFalse(extra.loaded)
+
+        self.assertEqual(extra['content'], b'JPEG')
+
+
+if __name__ == '__main__':
+    structlog.configure(
+        wrapper_class=structlog.make_filtering_bound_logger(logging.DEBUG),
+        logger_factory=structlog.PrintLoggerFactory(file=sys.stderr)
+    )
+
+    unittest.main()
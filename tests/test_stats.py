@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+
+# Allow module load from lib/python in main repo
+import sys
+from pathlib import Path
+currentdir = Path(__file__).resolve(strict=True).parent
+libdir = currentdir.parent.joinpath('lib/python')
+sys.path.append(str(libdir))
+
+import logging
+import os
+import random
+import statistics
+import structlog
+import subprocess
+import unittest
+
+import numpy as np
+
+from secondlife.plugins.stats import summarize, group_stats
+
+
+class TestStats(unittest.TestCase):
+
+    def test_numpy_not_imported(self):
+        # Loading the plugin to register its config group doesn't import numpy
+        code = 'import sys; import secondlife.plugins.stats; print("numpy" in sys.modules)'
+        result = subprocess.run([ sys.executable, '-c', code ], env=dict(os.environ, PYTHONPATH=str(libdir)), capture_output=True,
+                                text=True, check=True)
+        self.assertEqual(result.stdout.strip(), 'False')
+
+    def test_summarize(self):
+        rng = random.Random(1)
+        values = [ rng.gauss(2500, 200) for i in range(101) ]
+        d = summarize(np.array(values + [ np.nan ]), [ 50 ])
+
+        self.assertEqual(d['count'], 101)
+        self.assertAlmostEqual(d['mean'], statistics.mean(values))
+        self.assertAlmostEqual(d['stdev'], statistics.stdev(values))
+        self.assertEqual(d['percentiles'], [ statistics.median(values) ])
+        self.assertEqual((d['min'], d['max']), (min(values), max(values)))
+
+        self.assertEqual(summarize(np.array([ np.nan ]))['count'], 0)
+
+    def test_group_stats(self):
+        rng = random.Random(1)
+        groups = { 0: [ 1.0, 5.0, 3.0, 4.0 ], 1: [], 2: [ 7.0 ], 3: [ 2.0, 9.0, 8.0 ] }
+        items = [ (code, value) for (code, values) in groups.items() for value in values ] + [ (1, np.nan) ]
+        rng.shuffle(items)
+
+        d = group_stats(np.array([ code for (code, value) in items ]), np.array([ value for (code, value) in items ]), len(groups))
+
+        self.assertEqual(list(d['count']), [ 4, 0, 1, 3 ])
+        for (code, values) in groups.items():
+            if len(values) == 0:
+                self.assertTrue(np.isnan(d['mean'][code]) and np.isnan(d['median'][code]))
+                continue
+            self.assertAlmostEqual(d['mean'][code], statistics.mean(values))
+            self.assertEqual(d['median'][code], statistics.median(values))
+            if len(values) > 1:
+                self.assertAlmostEqual(d['stdev'][code], statistics.stdev(values))
+            else:
+                self.assertTrue(np.isnan(d['stdev'][code]))
+
+
+if __name__ == '__main__':
+    structlog.configure(
+        wrapper_class=structlog.make_filtering_bound_logger(logging.DEBUG),
+        logger_factory=structlog.PrintLoggerFactory(file=sys.stderr)
+    )
+
+    unittest.main()
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+
+# Allow module load from lib/python in main repo
+import sys
+from pathlib import Path
+currentdir = Path(__file__).resolve(strict=True).parent
+libdir = currentdir.parent.joinpath('lib/python')
+sys.path.append(str(libdir))
+
+import logging
+import structlog
+import unittest
+
+from secondlife.infoset import Infoset
+from secondlife.units import scale_factor, normalize, convert
+from secondlife.plugins.capacity import UsableCapacity
+from secondlife.plugins.internal_resistance import InternalResistance
+from secondlife.plugins.self_discharge import SelfDischargeCheckResult
+
+
+class TestUnits(unittest.TestCase):
+
+    def test_scale_factor(self):
+        self.assertAlmostEqual(scale_factor('Ohm', 'mOhm'), 1000)
+        self.assertAlmostEqual(scale_factor('mΩ', 'mOhm'), 1)
+        self.assertAlmostEqual(scale_factor('Ah', 'mAh'), 1000)
+
+    def test_normalize(self):
+        measurement = dict(range='AUTO', v=0.05, u='Ohm')
+
+        self.assertEqual(normalize(measurement, 'mOhm'), dict(range='AUTO', v=50, u='mOhm'))
+        self.assertEqual(measurement, dict(range='AUTO', v=0.05, u='Ohm'))
+
+    def test_normalize_without_unit(self):
+        self.assertEqual(normalize(dict(v=2100), 'mAh'), dict(v=2100, u='mAh'))
+
+    def test_usable_capacity(self):
+        log = [ dict(type='measurement', results=dict(capacity=dict(v=2.1, u='Ah'))) ]
+        cell = Infoset(data=dict(log=log))
+
+        self.assertEqual(UsableCapacity(cell=cell).fetch(''), dict(v=2100, u='mAh'))
+        self.assertEqual(log[0]['results']['capacity'], dict(v=2.1, u='Ah'))
+
+    def test_internal_resistance(self):
+        log = [ dict(type='measurement', equipment=dict(model='RC3563'), results=dict(IR=dict(v=0.045, u='Ohm'))) ]
+        cell = Infoset(data=dict(log=log))
+
+        self.assertEqual(InternalResistance(cell=cell).fetch(''), dict(v=45, u='mOhm'))
+        self.assertEqual(log[0]['results']['IR'], dict(v=0.045, u='Ohm'))
+
+    def test_self_discharge(self):
+        day = 24 * 3600
+        log = [
+            dict(type='measurement', ts=0, results=dict(capacity=dict(v=2100, u='mAh'), OCV=dict(v=3900, u='mV'))),
+            dict(type='measurement', ts=30 * day, results=dict(OCV=dict(v=3.87, u='V'))),
+        ]
+        cell = Infoset(data=dict(id='TEST~1', log=log))
+
+        result = SelfDischargeCheckResult(cell=cell).fetch('')
+        self.assertEqual((result['assessment'], result['u']), ('PASS', 'mV/day'))
+        self.assertAlmostEqual(result['v'], -1)
+
+    def test_convert(self):
+        self.assertEqual(list(convert([0.05, 40, 0.1], ['Ohm', 'mOhm', 'Ohm'], 'mOhm')), [50, 40, 100])
+        self.assertEqual(list(convert([1, 2], 'Ah', 'mAh')), [1000, 2000])
+
+
+if __name__ == '__main__':
+    structlog.configure(
+        wrapper_class=structlog.make_filtering_bound_logger(logging.DEBUG),
+        logger_factory=structlog.PrintLoggerFactory(file=sys.stderr)
+    )
+
+    unittest.main()